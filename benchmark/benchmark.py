@@ -0,0 +1,418 @@
+
+#
+# This script is licensed as public domain.
+#
+
+# Benchmark of the exporter hot paths on synthetic scenes (see scenes.py). It doesn't
+# need Blender, run it with Python 3:
+#   python3 benchmark/benchmark.py [--quick] [--cases grid,skinned] [--output results.json]
+# or with the Blender Python (it then uses the real mathutils):
+#   blender -b --python benchmark/benchmark.py -- [options]
+#
+# Each scene is exported at more sizes, for each stage it reports the best time of
+# some runs, the peak of the memory allocated by the stage (Python 3.4+) and how the
+# time scales with the size (exponent: 1 linear, 2 quadratic).
+# Stages:
+#   input      MeshDataFromArrays, AddBones, animation frames (as ExtractMeshData reads a mesh)
+#   decompose  DecomposeGeometry for each LOD and DecomposeShape for each shape key
+#   tangents   GenerateTangents of geometries and morphs
+#   optimize   OptimizeIndices
+#   reduce     ReduceKeyframes of the animations
+#   export     UrhoExport
+#   write      UrhoWriteModel and UrhoWriteAnimation
+#
+# Save the results with '--output baseline.json', then compare later runs with
+# '--baseline baseline.json': the exit code is 1 if a stage is slower than the
+# baseline by more than the tolerance, or if it scales worse. Timings depend on the
+# machine and on the mathutils module, compare only results taken on the same setup.
+# Some stages have a budget (see BUDGETS), the exit code is 1 also if a stage is over
+# its budget, with or without a baseline.
+
+import sys
+import os
+import gc
+import json
+import math
+import time
+import shutil
+import logging
+import argparse
+import importlib.util
+import tempfile
+import platform
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+BENCHMARK_PATH = os.path.dirname(os.path.abspath(__file__))
+ADDON_PATH = os.path.join(os.path.dirname(BENCHMARK_PATH), "io_mesh_urho")
+
+sys.path.insert(0, BENCHMARK_PATH)
+sys.path.insert(0, ADDON_PATH)
+
+# Outside Blender use the pure Python stand-in of mathutils
+if importlib.util.find_spec("mathutils") is not None:
+    MATHUTILS = "blender"
+else:
+    import mathutils_stub
+    sys.modules["mathutils"] = mathutils_stub
+    MATHUTILS = "stub"
+
+from mathutils import Vector, Matrix, Quaternion
+from core import (TData, TOptions, TFrame, TTrack, TAnimation, MeshDataFromArrays, AddBones,
+                  DecomposeGeometry, VertexFaces, DecomposeShape, GenerateTangents, OptimizeIndices,
+                  ReduceKeyframes)
+from export_urho import UrhoExportData, UrhoExportOptions, UrhoExport, UrhoWriteModel, UrhoWriteAnimation
+from scenes import SCENES
+
+log = logging.getLogger("ExportLogger")
+
+STAGES = ("input", "decompose", "tangents", "optimize", "reduce", "export", "write")
+
+# Time differences smaller than this (seconds) are not compared, they are mostly noise
+MIN_TIME = 0.005
+# Stages faster than this (seconds) are not used for the exponents, with small sizes
+# the fixed costs hide how the time scales
+EXPONENT_MIN_TIME = 0.02
+# Memory differences smaller than this (bytes) are not compared
+MIN_MEMORY = 1024 * 1024
+# Budgets of the stages: max time for each unit of the scene size (microseconds, the 
+# size is the faces or the keyframes of the scene) and max scaling exponent. The times
+# are for the mathutils stand-in on an average pc, use '--budget-scale' on slower ones.
+BUDGETS = {
+    "reduce": (50.0, 1.3),
+}
+
+# Counts the errors logged by the exporter, the scenes should not have any
+class ErrorsCounter(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self, logging.ERROR)
+        self.errors = 0
+
+    def emit(self, record):
+        self.errors += 1
+
+# Runs the stages and saves their time and memory peak
+class StageTimer:
+    def __init__(self, traceMemory = False):
+        # Trace the memory allocations (slower, the times are not saved)
+        self.traceMemory = traceMemory
+        # Time of each stage in seconds
+        self.times = {}
+        # Peak of the memory allocated by each stage in bytes
+        self.peaks = {}
+
+    def run(self, stage, function, *args):
+        # The exporter prints its progress, we don't want it in the report
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        # Collect before the stage and not during it, it adds noise to the times
+        gc.collect()
+        gc.disable()
+        try:
+            if self.traceMemory:
+                tracemalloc.start()
+            startTime = time.perf_counter()
+            result = function(*args)
+            elapsed = time.perf_counter() - startTime
+            if self.traceMemory:
+                self.peaks[stage] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                self.times[stage] = elapsed
+        finally:
+            gc.enable()
+            sys.stdout.close()
+            sys.stdout = stdout
+        return result
+
+#--------------------
+# Stages
+#--------------------
+
+# Converts the scene arrays in a TData, the TMeshData of each LOD and the animations
+def BuildInput(scene):
+    tData = TData()
+    tData.objectName = scene.name
+    if scene.bones:
+        AddBones(tData, *scene.bones)
+    meshes = [(distance, MeshDataFromArrays(**arrays)) for distance, arrays in scene.lods]
+    for name, tracks in scene.animations:
+        tAnimation = TAnimation(name)
+        for boneName, frames in tracks:
+            tTrack = TTrack(boneName)
+            for frameTime, position, rotation, scale in frames:
+                tTrack.frames.append(TFrame(frameTime, Vector(position), Quaternion(rotation), Vector(scale)))
+            tAnimation.tracks.append(tTrack)
+        tData.animationsList.append(tAnimation)
+    return tData, meshes
+
+# Decomposes the LODs as Scan does and the shape keys of the first LOD as DecomposeMesh
+def Decompose(scene, tData, meshes, tOptions):
+    identity = Matrix.Identity(4)
+    for k, (distance, tMeshData) in enumerate(meshes):
+        # Request a new LOD
+        tOptions.lodUpdatedGeometryIndices.clear()
+        tOptions.lodDistance = distance
+        faceVertexMap = DecomposeGeometry(tMeshData, tData, tOptions, tData.errorsDict, scene.name)
+        if k == 0 and scene.shapes:
+            vertexFaces = VertexFaces(tMeshData, len(tMeshData.positions))
+            for name, coords in scene.shapes:
+                DecomposeShape(tMeshData, tData, tOptions, faceVertexMap, vertexFaces,
+                               scene.baseCoords, coords, identity, identity, name)
+
+# Runs the postponed tasks of a function (see CompleteDecomposition)
+def RunTasks(tData, taskFunction):
+    tasks = []
+    for function, arguments in tData.postponedTasks:
+        if function is taskFunction:
+            function(*arguments)
+        else:
+            tasks.append( (function, arguments) )
+    tData.postponedTasks = tasks
+
+def ReduceAnimations(tData, tOptions):
+    for tAnimation in tData.animationsList:
+        ReduceKeyframes(tAnimation, tData.bonesMap, tOptions)
+
+def Export(tData):
+    uExportData = UrhoExportData()
+    UrhoExport(tData, UrhoExportOptions(), uExportData, tData.errorsDict)
+    return uExportData
+
+def Write(uExportData, outputPath):
+    for uModel in uExportData.models:
+        UrhoWriteModel(uModel, os.path.join(outputPath, uModel.name + ".mdl"))
+    for uAnimation in uExportData.animations:
+        UrhoWriteAnimation(uAnimation, os.path.join(outputPath, uAnimation.name + ".ani"))
+
+# Exports a scene, each stage is measured by the timer
+def ExportScene(scene, outputPath, timer):
+    tOptions = TOptions()
+    tData, meshes = timer.run("input", BuildInput, scene)
+    timer.run("decompose", Decompose, scene, tData, meshes, tOptions)
+    timer.run("tangents", RunTasks, tData, GenerateTangents)
+    timer.run("optimize", RunTasks, tData, OptimizeIndices)
+    timer.run("reduce", ReduceAnimations, tData, tOptions)
+    uExportData = timer.run("export", Export, tData)
+    timer.run("write", Write, uExportData, outputPath)
+
+#--------------------
+# Results
+#--------------------
+
+# Slope of the least squares line of log(time) over log(size), None if there are less
+# than two sizes with a measurable time
+def ScalingExponent(sizes, times):
+    points = [(math.log(s), math.log(t)) for s, t in zip(sizes, times) if s > 0 and t >= EXPONENT_MIN_TIME]
+    if len(points) < 2:
+        return None
+    meanX = sum(x for x, y in points) / len(points)
+    meanY = sum(y for x, y in points) / len(points)
+    den = sum((x - meanX) ** 2 for x, y in points)
+    if not den:
+        return None
+    return sum((x - meanX) * (y - meanY) for x, y in points) / den
+
+# Runs a case at all its sizes, returns its results:
+# {"sizes": {size: {"scene", "faces", stage: {"time", "peak"}}}, "exponents": {stage: exponent}}
+def RunCase(generator, parameters, args, outputPath, counter):
+    result = {"sizes": {}, "exponents": {}}
+    sizes = []
+    for parameter in parameters:
+        scene = generator(parameter)
+        errors = counter.errors
+
+        # Best time of some runs
+        times = {}
+        for i in range(args.repeat):
+            timer = StageTimer()
+            ExportScene(scene, outputPath, timer)
+            for stage, elapsed in timer.times.items():
+                times[stage] = min(elapsed, times.get(stage, elapsed))
+
+        # Memory peaks in another run, tracing slows down everything
+        peaks = {}
+        if args.memory:
+            timer = StageTimer(traceMemory = True)
+            ExportScene(scene, outputPath, timer)
+            peaks = timer.peaks
+
+        sizeResult = {"scene": scene.name, "size": scene.size, "errors": counter.errors - errors}
+        for stage in STAGES:
+            sizeResult[stage] = {"time": times.get(stage), "peak": peaks.get(stage)}
+        result["sizes"][str(scene.size)] = sizeResult
+        sizes.append(scene.size)
+        PrintSize(sizeResult)
+
+    for stage in STAGES:
+        stageTimes = [result["sizes"][str(s)][stage]["time"] for s in sizes]
+        result["exponents"][stage] = ScalingExponent(sizes, stageTimes)
+    PrintExponents(result["exponents"])
+    return result
+
+def PrintHeader():
+    print("{:14s}".format("scene") + "".join("{:>17s}".format(stage) for stage in STAGES))
+    print("{:14s}".format("") + "{:>17s}".format("ms / peak KB") * len(STAGES))
+
+def PrintSize(sizeResult):
+    line = "{:14s}".format(sizeResult["scene"])
+    for stage in STAGES:
+        values = sizeResult[stage]
+        peak = values["peak"]
+        line += "{:>9.1f} / {:>5s}".format(values["time"] * 1000.0,
+                                          "-" if peak is None else str(peak // 1024))
+    if sizeResult["errors"]:
+        line += "  {:d} ERRORS".format(sizeResult["errors"])
+    print(line)
+    sys.stdout.flush()
+
+def PrintExponents(exponents):
+    line = "{:14s}".format("  exponent")
+    for stage in STAGES:
+        exponent = exponents[stage]
+        line += "{:>17s}".format("-" if exponent is None else "{:.2f}".format(exponent))
+    print(line)
+    print()
+    sys.stdout.flush()
+
+# Checks the stages with a budget, returns the list of the stages over it
+def CheckBudgets(results, args):
+    overruns = []
+    for caseName, case in results["cases"].items():
+        for stage, (unitTime, maxExponent) in BUDGETS.items():
+            for sizeResult in case["sizes"].values():
+                elapsed = sizeResult[stage]["time"]
+                budget = unitTime * 1e-6 * sizeResult["size"] * args.budget_scale
+                if elapsed is not None and elapsed > budget and elapsed > MIN_TIME:
+                    overruns.append("{:s} {:s}: time {:.1f} ms, budget {:.1f} ms"
+                        .format(sizeResult["scene"], stage, elapsed * 1000.0, budget * 1000.0))
+            exponent = case["exponents"].get(stage)
+            if exponent is not None and exponent > maxExponent:
+                overruns.append("{:s} {:s}: exponent {:.2f}, budget {:.2f}"
+                                .format(caseName, stage, exponent, maxExponent))
+    return overruns
+
+# Compares the results with the baseline, returns the list of regressions
+def CompareBaseline(results, baseline, args):
+    regressions = []
+    if baseline.get("mathutils") != results["mathutils"]:
+        print("WARNING: baseline taken with mathutils '{}', now '{}'"
+              .format(baseline.get("mathutils"), results["mathutils"]))
+    for caseName, case in results["cases"].items():
+        baseCase = baseline.get("cases", {}).get(caseName)
+        if not baseCase:
+            continue
+        for size, sizeResult in case["sizes"].items():
+            baseSize = baseCase["sizes"].get(size)
+            if not baseSize:
+                continue
+            for stage in STAGES:
+                new = sizeResult[stage]
+                old = baseSize.get(stage)
+                if not old:
+                    continue
+                if (new["time"] is not None and old["time"] is not None and
+                        new["time"] > old["time"] * (1.0 + args.tolerance) and
+                        new["time"] - old["time"] > MIN_TIME):
+                    regressions.append("{:s} {:s}: time {:.1f} ms, baseline {:.1f} ms"
+                        .format(sizeResult["scene"], stage, new["time"] * 1000.0, old["time"] * 1000.0))
+                if (new["peak"] is not None and old["peak"] is not None and
+                        new["peak"] > old["peak"] * (1.0 + args.memory_tolerance) and
+                        new["peak"] - old["peak"] > MIN_MEMORY):
+                    regressions.append("{:s} {:s}: peak {:d} KB, baseline {:d} KB"
+                        .format(sizeResult["scene"], stage, new["peak"] // 1024, old["peak"] // 1024))
+        for stage in STAGES:
+            new = case["exponents"].get(stage)
+            old = baseCase.get("exponents", {}).get(stage)
+            if new is not None and old is not None and new > old + args.exponent_tolerance:
+                regressions.append("{:s} {:s}: exponent {:.2f}, baseline {:.2f}"
+                                   .format(caseName, stage, new, old))
+    return regressions
+
+def ParseArguments(argv):
+    if "--" in argv:
+        argv = argv[argv.index("--") + 1:]
+    parser = argparse.ArgumentParser(description = "Urho3D exporter benchmark")
+    parser.add_argument("--cases", help = "comma separated cases to run (default: all): " +
+                        ", ".join(name for name, generator, parameters in SCENES))
+    parser.add_argument("--quick", action = "store_true", help = "run only the two smallest sizes")
+    parser.add_argument("--repeat", type = int, default = 3, help = "runs of each size, the best is kept")
+    parser.add_argument("--no-memory", dest = "memory", action = "store_false",
+                        help = "don't measure the memory peaks")
+    parser.add_argument("--output", help = "JSON file where to save the results")
+    parser.add_argument("--baseline", help = "JSON results to compare with")
+    parser.add_argument("--tolerance", type = float, default = 0.25,
+                        help = "allowed time increase over the baseline (default: 0.25)")
+    parser.add_argument("--memory-tolerance", type = float, default = 0.25,
+                        help = "allowed memory increase over the baseline (default: 0.25)")
+    parser.add_argument("--exponent-tolerance", type = float, default = 0.2,
+                        help = "allowed exponent increase over the baseline (default: 0.2)")
+    parser.add_argument("--budget-scale", type = float, default = 1.0,
+                        help = "multiplier of the stages time budgets (default: 1.0)")
+    return parser.parse_args(argv)
+
+def Main(argv):
+    args = ParseArguments(argv)
+    if args.memory and tracemalloc is None:
+        print("Memory peaks need Python 3.4 or later")
+        args.memory = False
+
+    cases = SCENES
+    if args.cases:
+        names = args.cases.split(",")
+        unknown = set(names) - set(name for name, generator, parameters in SCENES)
+        if unknown:
+            print("Unknown cases: " + ", ".join(sorted(unknown)))
+            return 2
+        cases = [case for case in SCENES if case[0] in names]
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+
+    counter = ErrorsCounter()
+    log.addHandler(counter)
+    log.propagate = False
+
+    results = {"mathutils": MATHUTILS, "python": platform.python_version(),
+               "date": time.strftime("%Y-%m-%d %H:%M:%S"), "cases": {}}
+    print("Python {:s}, mathutils {:s}".format(results["python"], MATHUTILS))
+    print()
+    PrintHeader()
+    outputPath = tempfile.mkdtemp(prefix = "urho_benchmark_")
+    try:
+        for name, generator, parameters in cases:
+            if args.quick:
+                parameters = parameters[:2]
+            results["cases"][name] = RunCase(generator, parameters, args, outputPath, counter)
+    finally:
+        shutil.rmtree(outputPath, ignore_errors = True)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent = 1, sort_keys = True)
+        print("Results saved in " + args.output)
+
+    if counter.errors:
+        print("{:d} export errors".format(counter.errors))
+
+    overruns = CheckBudgets(results, args)
+    for overrun in overruns:
+        print("OVER BUDGET: " + overrun)
+
+    if baseline is not None:
+        regressions = CompareBaseline(results, baseline, args)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        if regressions:
+            return 1
+        print("No regressions")
+    return 1 if counter.errors or overruns else 0
+
+
+if __name__ == "__main__":
+    sys.exit(Main(sys.argv[1:]))
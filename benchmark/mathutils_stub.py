@@ -0,0 +1,227 @@
+
+#
+# This script is licensed as public domain.
+#
+
+# Minimal pure Python stand-in of the Blender 'mathutils' module, only what the exporter
+# uses: Vector, Quaternion and 4x4 Matrix. It is used by benchmark.py when the real
+# module is not available (outside Blender). It is slower than the C module, so the
+# timings are useful to compare versions of the exporter, not as absolute numbers.
+
+import math
+
+class Vector(list):
+    __slots__ = ()
+
+    def __init__(self, values = (0.0, 0.0, 0.0)):
+        list.__init__(self, (float(v) for v in values))
+
+    def _get(index):
+        return property(lambda self: self[index], lambda self, value: self.__setitem__(index, float(value)))
+    x = _get(0)
+    y = _get(1)
+    z = _get(2)
+    w = _get(3)
+    del _get
+
+    def __add__(self, other):
+        return self.__class__([a + b for a, b in zip(self, other)])
+
+    def __sub__(self, other):
+        return self.__class__([a - b for a, b in zip(self, other)])
+
+    def __mul__(self, k):
+        return self.__class__([a * k for a in self])
+    __rmul__ = __mul__
+
+    def __truediv__(self, k):
+        return self.__class__([a / k for a in self])
+
+    def __neg__(self):
+        return self.__class__([-a for a in self])
+
+    def __iadd__(self, other):
+        for i, b in enumerate(other):
+            self[i] += b
+        return self
+
+    def __isub__(self, other):
+        for i, b in enumerate(other):
+            self[i] -= b
+        return self
+
+    def __imul__(self, k):
+        for i in range(len(self)):
+            self[i] *= k
+        return self
+
+    def dot(self, other):
+        return sum(a * b for a, b in zip(self, other))
+
+    def cross(self, other):
+        return Vector((self[1] * other[2] - self[2] * other[1],
+                       self[2] * other[0] - self[0] * other[2],
+                       self[0] * other[1] - self[1] * other[0]))
+
+    @property
+    def length(self):
+        return math.sqrt(self.dot(self))
+
+    def normalized(self):
+        length = self.length
+        if not length:
+            return self.copy()
+        return self / length
+
+    def normalize(self):
+        length = self.length
+        if length:
+            self *= 1.0 / length
+
+    def copy(self):
+        return self.__class__(self)
+
+    def lerp(self, other, factor):
+        return self.__class__([a + (b - a) * factor for a, b in zip(self, other)])
+
+    def to_tuple(self):
+        return tuple(self)
+
+# Quaternion (w, x, y, z), like mathutils it is iterated in this order
+class Quaternion(Vector):
+    __slots__ = ()
+
+    def __init__(self, values = (1.0, 0.0, 0.0, 0.0)):
+        Vector.__init__(self, values)
+
+    def _get(index):
+        return property(lambda self: self[index], lambda self, value: self.__setitem__(index, float(value)))
+    w = _get(0)
+    x = _get(1)
+    y = _get(2)
+    z = _get(3)
+    del _get
+
+    def slerp(self, other, factor):
+        dot = self.dot(other)
+        if dot < 0.0:
+            other = -other
+            dot = -dot
+        if dot > 0.9995:
+            return self.lerp(other, factor).normalized()
+        angle = math.acos(dot)
+        a = math.sin((1.0 - factor) * angle) / math.sin(angle)
+        b = math.sin(factor * angle) / math.sin(angle)
+        return Quaternion([x * a + y * b for x, y in zip(self, other)])
+
+# 4x4 matrix stored as a list of rows, the product with a 3D vector is done as (x, y, z, 1)
+class Matrix(list):
+    __slots__ = ()
+
+    def __init__(self, rows = None):
+        if rows is None:
+            rows = Matrix.Identity(4)
+        list.__init__(self, ([float(v) for v in row] for row in rows))
+
+    @staticmethod
+    def Identity(size):
+        return Matrix([[1.0 if i == j else 0.0 for j in range(size)] for i in range(size)])
+
+    @staticmethod
+    def Translation(vector):
+        matrix = Matrix.Identity(4)
+        for i in range(3):
+            matrix[i][3] = float(vector[i])
+        return matrix
+
+    @staticmethod
+    def Scale(factor, size, axis = None):
+        matrix = Matrix.Identity(size)
+        for i in range(min(size, 3)):
+            matrix[i][i] = float(factor)
+        return matrix
+
+    @staticmethod
+    def Rotation(angle, size, axis):
+        c = math.cos(angle)
+        s = math.sin(angle)
+        i, j = {'X': (1, 2), 'Y': (2, 0), 'Z': (0, 1)}[axis]
+        matrix = Matrix.Identity(size)
+        matrix[i][i] = c
+        matrix[i][j] = -s
+        matrix[j][i] = s
+        matrix[j][j] = c
+        return matrix
+
+    def __mul__(self, other):
+        if isinstance(other, Matrix):
+            columns = list(zip(*other))
+            return Matrix([[sum(a * b for a, b in zip(row, column)) for column in columns] for row in self])
+        values = list(other)
+        if len(values) == 3:
+            values.append(1.0)
+            return Vector([sum(a * b for a, b in zip(row, values)) for row in self[:3]])
+        return Vector([sum(a * b for a, b in zip(row, values)) for row in self])
+
+    def copy(self):
+        return Matrix(self)
+
+    def transposed(self):
+        return Matrix(zip(*self))
+
+    def inverted(self):
+        # Gauss-Jordan elimination with partial pivoting
+        size = len(self)
+        rows = [list(row) + [1.0 if i == j else 0.0 for j in range(size)] for i, row in enumerate(self)]
+        for column in range(size):
+            pivot = max(range(column, size), key = lambda r: abs(rows[r][column]))
+            rows[column], rows[pivot] = rows[pivot], rows[column]
+            value = rows[column][column]
+            if value == 0.0:
+                raise ValueError("Matrix.inverted(): matrix does not have an inverse")
+            rows[column] = [v / value for v in rows[column]]
+            for r in range(size):
+                if r != column:
+                    factor = rows[r][column]
+                    if factor:
+                        rows[r] = [a - factor * b for a, b in zip(rows[r], rows[column])]
+        return Matrix([row[size:] for row in rows])
+
+    def to_translation(self):
+        return Vector((self[0][3], self[1][3], self[2][3]))
+
+    def to_scale(self):
+        return Vector([math.sqrt(sum(self[i][j] ** 2 for i in range(3))) for j in range(3)])
+
+    def to_quaternion(self):
+        scale = self.to_scale()
+        m = [[self[i][j] / (scale[j] or 1.0) for j in range(3)] for i in range(3)]
+        trace = m[0][0] + m[1][1] + m[2][2]
+        if trace > 0.0:
+            s = math.sqrt(trace + 1.0) * 2.0
+            q = (0.25 * s, (m[2][1] - m[1][2]) / s, (m[0][2] - m[2][0]) / s, (m[1][0] - m[0][1]) / s)
+        elif m[0][0] > m[1][1] and m[0][0] > m[2][2]:
+            s = math.sqrt(1.0 + m[0][0] - m[1][1] - m[2][2]) * 2.0
+            q = ((m[2][1] - m[1][2]) / s, 0.25 * s, (m[0][1] + m[1][0]) / s, (m[0][2] + m[2][0]) / s)
+        elif m[1][1] > m[2][2]:
+            s = math.sqrt(1.0 + m[1][1] - m[0][0] - m[2][2]) * 2.0
+            q = ((m[0][2] - m[2][0]) / s, (m[0][1] + m[1][0]) / s, 0.25 * s, (m[1][2] + m[2][1]) / s)
+        else:
+            s = math.sqrt(1.0 + m[2][2] - m[0][0] - m[1][1]) * 2.0
+            q = ((m[1][0] - m[0][1]) / s, (m[0][2] + m[2][0]) / s, (m[1][2] + m[2][1]) / s, 0.25 * s)
+        return Quaternion(q)
+
+    @property
+    def translation(self):
+        return self.to_translation()
+
+    @translation.setter
+    def translation(self, vector):
+        for i in range(3):
+            self[i][3] = float(vector[i])
+
+class Color(Vector):
+    __slots__ = ()
+
+class Euler(Vector):
+    __slots__ = ()
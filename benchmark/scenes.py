@@ -0,0 +1,220 @@
+
+#
+# This script is licensed as public domain.
+#
+
+# Generators of synthetic scenes for benchmark.py. Each generator returns a BenchScene
+# with plain arrays (no Blender and no mathutils), the benchmark converts them with the
+# input API of core.py. The parameter of each generator sets its size, so the same
+# scene can be created with more sizes to find how the times scale.
+
+import math
+
+# A synthetic object to export
+class BenchScene:
+    def __init__(self, name):
+        # Object name, used for the output files
+        self.name = name
+        # Size used for the scaling exponents (faces, or keyframes for animations)
+        self.size = 0
+        # LODs: list of tuples (distance, arguments of MeshDataFromArrays)
+        self.lods = []
+        # Skeleton: tuple (names, parents, matrices) of the arguments of AddBones, or None
+        self.bones = None
+        # Coordinates of the first LOD vertices in Blender space (Z up), flat list
+        self.baseCoords = None
+        # Shape keys: list of tuples (name, flat list of the vertex coordinates in Blender space)
+        self.shapes = []
+        # Animations: list of tuples (name, tracks), a track is a tuple (bone name,
+        # frames), a frame is a tuple (time, position, rotation, scale)
+        self.animations = []
+
+    # Adds a LOD, positions and normals are lists of (x, y, z) in Urho space (Y up)
+    def addLod(self, distance, positions, faces, normals = None, uvs = None, weights = None, materials = None):
+        self.lods.append( (distance, {"positions": positions, "faces": faces, "normals": normals,
+                                      "uvs": uvs, "weights": weights, "materials": materials}) )
+        if len(self.lods) == 1:
+            self.size = len(faces)
+            # Blender space is Z up, the input API swaps Y and Z
+            self.baseCoords = [c for x, y, z in positions for c in (x, z, y)]
+
+    # Adds shapeCount shape keys to the first LOD, each one moves a band of vertices
+    def addShapes(self, shapeCount):
+        coordsCount = len(self.baseCoords)
+        verticesCount = coordsCount // 3
+        for k in range(shapeCount):
+            coords = list(self.baseCoords)
+            for vertexIndex in range(k * verticesCount // shapeCount, (k + 1) * verticesCount // shapeCount):
+                # Move up (Blender Z)
+                coords[3 * vertexIndex + 2] += 0.1 * (k + 1)
+            self.shapes.append( ("Shape{:d}".format(k), coords) )
+
+#--------------------
+# Meshes
+#--------------------
+
+# Returns the (u, v) of each corner of the faces
+def CornersUv(faces, vertexUv):
+    return [vertexUv[vertexIndex] for face in faces for vertexIndex in face]
+
+# Flat grid of n x n quads on the XZ plane, with materials bands of quads
+def GridMesh(n, materials = 1):
+    positions = []
+    uv = []
+    for i in range(n + 1):
+        for j in range(n + 1):
+            positions.append( (j / n - 0.5, 0.0, i / n - 0.5) )
+            uv.append( (j / n, i / n) )
+    normals = [(0.0, 1.0, 0.0)] * len(positions)
+    faces = []
+    faceMaterials = []
+    for i in range(n):
+        for j in range(n):
+            a = i * (n + 1) + j
+            faces.append( (a, a + 1, a + n + 2, a + n + 1) )
+            faceMaterials.append(i * materials // n)
+    return positions, faces, normals, CornersUv(faces, uv), faceMaterials
+
+# UV sphere with n segments and n/2 rings: triangles at the poles, quads between
+def SphereMesh(n):
+    rings = max(n // 2, 2)
+    positions = [(0.0, 1.0, 0.0)]
+    uv = [(0.5, 0.0)]
+    for r in range(1, rings):
+        theta = math.pi * r / rings
+        for s in range(n):
+            phi = 2.0 * math.pi * s / n
+            positions.append( (math.sin(theta) * math.cos(phi), math.cos(theta), math.sin(theta) * math.sin(phi)) )
+            uv.append( (s / n, r / rings) )
+    positions.append( (0.0, -1.0, 0.0) )
+    uv.append( (0.5, 1.0) )
+    bottom = len(positions) - 1
+    normals = list(positions)
+
+    def Index(r, s):
+        return 1 + (r - 1) * n + (s % n)
+
+    faces = []
+    for s in range(n):
+        faces.append( (0, Index(1, s + 1), Index(1, s)) )
+    for r in range(1, rings - 1):
+        for s in range(n):
+            faces.append( (Index(r, s), Index(r, s + 1), Index(r + 1, s + 1), Index(r + 1, s)) )
+    for s in range(n):
+        faces.append( (bottom, Index(rings - 1, s), Index(rings - 1, s + 1)) )
+    return positions, faces, normals, CornersUv(faces, uv)
+
+# Open cylinder along Y, radius 1 and height 'height', with a chain of bones along its
+# axis. Each vertex is weighted on the two nearest bones.
+# Returns the mesh arrays and the bones (names, parents, matrices)
+def SkinnedCylinderMesh(segments, rings, bonesCount, height = 4.0):
+    positions = []
+    normals = []
+    uv = []
+    weights = []
+    boneStep = height / bonesCount
+    for r in range(rings + 1):
+        y = height * r / rings
+        # Bone position along the chain
+        bonePos = min(max(y / boneStep - 0.5, 0.0), bonesCount - 1.0)
+        bone = min(int(bonePos), bonesCount - 2) if bonesCount > 1 else 0
+        t = bonePos - bone
+        for s in range(segments):
+            phi = 2.0 * math.pi * s / segments
+            positions.append( (math.cos(phi), y, math.sin(phi)) )
+            normals.append( (math.cos(phi), 0.0, math.sin(phi)) )
+            uv.append( (s / segments, r / rings) )
+            if bonesCount > 1:
+                weights.append( ((bone, 1.0 - t), (bone + 1, t)) )
+            else:
+                weights.append( ((0, 1.0),) )
+    faces = []
+    for r in range(rings):
+        for s in range(segments):
+            a = r * segments + s
+            b = r * segments + (s + 1) % segments
+            faces.append( (a, b, b + segments, a + segments) )
+
+    names = ["Bone{:03d}".format(i) for i in range(bonesCount)]
+    parents = [i - 1 for i in range(bonesCount)]
+    matrices = []
+    for i in range(bonesCount):
+        matrices.append( ((1.0, 0.0, 0.0, 0.0),
+                          (0.0, 1.0, 0.0, (i + 0.5) * boneStep),
+                          (0.0, 0.0, 1.0, 0.0),
+                          (0.0, 0.0, 0.0, 1.0)) )
+    return (positions, faces, normals, CornersUv(faces, uv), weights), (names, parents, matrices)
+
+# Animation of all the bones: each bone rotates around Y and moves up and down
+def BonesAnimation(name, boneNames, framesCount, fps = 25.0):
+    tracks = []
+    for i, boneName in enumerate(boneNames):
+        frames = []
+        for f in range(framesCount):
+            angle = 0.5 * math.sin(0.1 * f + 0.3 * i)
+            position = (0.0, 0.1 * math.sin(0.05 * f + i), 0.0)
+            rotation = (math.cos(angle / 2.0), 0.0, math.sin(angle / 2.0), 0.0)
+            frames.append( (f / fps, position, rotation, (1.0, 1.0, 1.0)) )
+        tracks.append( (boneName, frames) )
+    return (name, tracks)
+
+#--------------------
+# Scenes
+#--------------------
+
+# Grid with 4 materials
+def GridScene(n):
+    scene = BenchScene("Grid{:d}".format(n))
+    positions, faces, normals, uvs, materials = GridMesh(n, materials = 4)
+    scene.addLod(0.0, positions, faces, normals, uvs, materials = materials)
+    return scene
+
+def SphereScene(n):
+    scene = BenchScene("Sphere{:d}".format(n))
+    positions, faces, normals, uvs = SphereMesh(n)
+    scene.addLod(0.0, positions, faces, normals, uvs)
+    return scene
+
+# Cylinder with 80 bones, more than the 64 of the hardware skinning, so the geometry
+# is split by bones
+def SkinnedScene(rings, bonesCount = 80):
+    scene = BenchScene("Skinned{:d}".format(rings))
+    (positions, faces, normals, uvs, weights), scene.bones = SkinnedCylinderMesh(64, rings, bonesCount)
+    scene.addLod(0.0, positions, faces, normals, uvs, weights)
+    return scene
+
+# Grid with 8 shape keys
+def ShapesScene(n, shapeCount = 8):
+    scene = BenchScene("Shapes{:d}".format(n))
+    positions, faces, normals, uvs, materials = GridMesh(n)
+    scene.addLod(0.0, positions, faces, normals, uvs)
+    scene.addShapes(shapeCount)
+    return scene
+
+# Sphere with 4 LODs, each one with half the segments of the previous
+def LodsScene(n, lodsCount = 4):
+    scene = BenchScene("Lods{:d}".format(n))
+    for k in range(lodsCount):
+        positions, faces, normals, uvs = SphereMesh(max(n >> k, 4))
+        scene.addLod(10.0 * k, positions, faces, normals, uvs)
+    return scene
+
+# Small skinned cylinder with a long animation of its 32 bones, the size is the number
+# of keyframes
+def ActionScene(framesCount, bonesCount = 32):
+    scene = BenchScene("Action{:d}".format(framesCount))
+    (positions, faces, normals, uvs, weights), scene.bones = SkinnedCylinderMesh(16, 8, bonesCount)
+    scene.addLod(0.0, positions, faces, normals, uvs, weights)
+    scene.animations.append(BonesAnimation("Action", scene.bones[0], framesCount))
+    scene.size = framesCount * bonesCount
+    return scene
+
+# Benchmark cases: name, generator, parameters from the smallest to the largest
+SCENES = (
+    ("grid",    GridScene,    (32, 64, 128)),
+    ("sphere",  SphereScene,  (32, 64, 128)),
+    ("skinned", SkinnedScene, (16, 32, 64)),
+    ("shapes",  ShapesScene,  (16, 32, 64)),
+    ("lods",    LodsScene,    (32, 64, 128)),
+    ("action",  ActionScene,  (250, 1000, 4000)),
+)
@@ -36,19 +36,29 @@ bl_info = {
 
 if "decompose" in locals():
     import imp
+    imp.reload(cache)
+    imp.reload(core)
     imp.reload(decompose)
     imp.reload(export_urho)
+    imp.reload(telemetry)
     if DEBUG and "testing" in locals(): imp.reload(testing)
 
-from .decompose import TOptions, Scan
+from .core import TOptions, CompleteDecompositionSteps, RunSteps, ScaleSteps
+from .decompose import ScanSteps, FindArmature
 from .export_urho import UrhoExportData, UrhoExportOptions, UrhoWriteModel, UrhoWriteAnimation, UrhoWriteMaterial, UrhoWriteMaterialsList, UrhoExport
+from .cache import Dumps
+from .telemetry import ExportStats, ObjectStats
 if DEBUG: from .testing import PrintUrhoData, PrintAll
     
 import os
+import math
 import time
 import sys
 import shutil
 import logging
+import pickle
+import multiprocessing
+import concurrent.futures
 
 import bpy
 from bpy.props import StringProperty, BoolProperty, EnumProperty, FloatProperty, IntProperty
@@ -162,6 +172,12 @@ class UrhoAddonPreferences(bpy.types.AddonPreferences):
             name = "Max number of messages",
             description = "Max number of messages in the report window",
             default = 500)
+
+    slowestCount = IntProperty(
+            name = "Slowest objects",
+            description = "Number of the slowest objects in the report window",
+            default = 5,
+            min = 0)
             
     def draw(self, context):
         layout = self.layout
@@ -170,6 +186,7 @@ class UrhoAddonPreferences(bpy.types.AddonPreferences):
         row.label("Report window:")
         row.prop(self, "reportWidth")
         row.prop(self, "maxMessagesCount")
+        row.prop(self, "slowestCount")
 
 
 # Here we define all the UI objects we'll add in the export panel
@@ -240,6 +257,7 @@ class UrhoExportSettings(bpy.types.PropertyGroup):
         
         self.useStandardDirs = True
         self.fileOverwrite = False
+        self.watchDelay = 0.5
 
         self.source = 'ONLY_SELECTED'
         self.scale = 1.0
@@ -254,6 +272,10 @@ class UrhoExportSettings(bpy.types.PropertyGroup):
         self.lods = False
         self.strictLods = True
         self.optimizeIndices = False
+        self.useCache = False
+        self.cachePath = ""
+        self.cacheSize = 1024
+        self.parallel = False
 
         self.skeletons = False
         self.onlyKeyedBones = False
@@ -266,6 +288,12 @@ class UrhoExportSettings(bpy.types.PropertyGroup):
         self.animationPos = True
         self.animationRot = True
         self.animationSca = False
+        self.bakeProcesses = 0
+        self.stripBindChannels = False
+        self.reduceKeyframes = False
+        self.reducePosTolerance = 0.001
+        self.reduceRotTolerance = math.radians(0.1)
+        self.reduceScaTolerance = 0.001
 
         self.geometries = True
         self.geometryPos = True
@@ -309,6 +337,13 @@ class UrhoExportSettings(bpy.types.PropertyGroup):
             description = "If enabled existing files are overwritten without warnings",
             default = False)
 
+    watchDelay = FloatProperty(
+            name = "Watch delay",
+            description = "Watch mode: seconds without changes before exporting the changed objects",
+            default = 0.5,
+            min = 0.0,
+            max = 60.0)
+
     # --- Source settings ---
             
     source = EnumProperty(
@@ -385,10 +420,33 @@ class UrhoExportSettings(bpy.types.PropertyGroup):
             default = True)
             
     optimizeIndices = BoolProperty(
-            name = "Optimize indices (slow)",
+            name = "Optimize indices",
             description = "Linear-Speed vertex cache optimisation",
             default = True)
 
+    useCache = BoolProperty(
+            name = "Use cache",
+            description = "Save decomposed objects and sampled animations in a cache, unchanged ones are loaded from the cache",
+            default = False)
+
+    cachePath = StringProperty(
+            name = "",
+            description = "Cache folder (if empty a folder in the Blender user path)",
+            default = "", 
+            maxlen = 1024,
+            subtype = "DIR_PATH")
+
+    cacheSize = IntProperty(
+            name = "Cache size (MB)",
+            description = "Max size of the cache folder, the least recently used files are deleted",
+            default = 1024,
+            min = 1)
+
+    parallel = BoolProperty(
+            name = "Parallel export",
+            description = "Export the objects in more processes (not on Windows)",
+            default = False)
+
     # --- Components settings ---
 
     skeletons = BoolProperty(
@@ -453,6 +511,50 @@ class UrhoExportSettings(bpy.types.PropertyGroup):
             description = "Within animations export bone scales",
             default = False)
 
+    bakeProcesses = IntProperty(
+            name = "Bake processes",
+            description = "Bake the animations in more background Blender processes (0: only this one, the file must be saved)",
+            default = 0,
+            min = 0,
+            max = 64)
+
+    stripBindChannels = BoolProperty(
+            name = "Strip bind pose channels",
+            description = "Remove from each track the position, rotation or scale which is always the bind pose "
+                          "(the bone keeps its current value, blending with other animations may change)",
+            default = False)
+
+    reduceKeyframes = BoolProperty(
+            name = "Reduce keyframes",
+            description = "Remove the keyframes which can be interpolated from the others within the tolerances",
+            default = False)
+
+    reducePosTolerance = FloatProperty(
+            name = "Position tolerance",
+            description = "Max position error at the end of a bones chain",
+            default = 0.001,
+            min = 0.0,
+            max = 1.0,
+            step = 0.01,
+            precision = 4)
+
+    reduceRotTolerance = FloatProperty(
+            name = "Rotation tolerance",
+            description = "Max rotation error of a bone",
+            default = math.radians(0.1),
+            min = 0.0,
+            max = math.radians(10.0),
+            subtype = 'ANGLE')
+
+    reduceScaTolerance = FloatProperty(
+            name = "Scale tolerance",
+            description = "Max scale error of a bone",
+            default = 0.001,
+            min = 0.0,
+            max = 1.0,
+            step = 0.01,
+            precision = 4)
+
     geometries = BoolProperty(
             name = "Geometries",
             description = "Export vertex buffers, index buffers, geometries, lods",
@@ -576,6 +678,29 @@ class UrhoReportDialog(bpy.types.Operator):
         layout = self.layout
         scene = context.scene
         
+        # Times of the last export and its slowest objects
+        if exportStats and exportStats.totalTime is not None:
+            addonPrefs = context.user_preferences.addons[__name__].preferences
+            box = layout.box()
+            phases = ", ".join("{:s} {:.2f}".format(phase, seconds) 
+                               for phase, seconds in exportStats.phases.times.items())
+            box.label(text = "Export {:.2f} sec ({:s})".format(exportStats.totalTime, phases), icon = 'TIME')
+            slowest = exportStats.slowestObjects(addonPrefs.slowestCount)
+            if slowest:
+                row = box.row()
+                for text in ("Object", "Time", "Slowest stage", "Vertices", "Triangles", "Frames"):
+                    row.label(text = text)
+                for objectStats in slowest:
+                    stage = objectStats.slowestStage()
+                    counters = objectStats.counters
+                    row = box.row()
+                    row.label(text = objectStats.name)
+                    row.label(text = "{:.2f} sec".format(objectStats.totalTime()))
+                    row.label(text = "{:s} {:.2f}".format(stage, objectStats.times[stage]) if stage else "-")
+                    row.label(text = str(counters.get("vertices", 0)))
+                    row.label(text = str(counters.get("triangles", 0)))
+                    row.label(text = str(counters.get("frames", 0)))
+        
         for line in logList:
             lines = line.split(":", 1)
             if lines[0] == 'CRITICAL':
@@ -590,19 +715,99 @@ class UrhoReportDialog(bpy.types.Operator):
                 lineicon = 'TEXT'
             layout.label(text = lines[1], icon = lineicon)
             
-# Export button
+# Watch button
+class UrhoWatchOperator(bpy.types.Operator):
+    """ Start or stop exporting the objects when they change """
+    
+    bl_idname = "urho.watch"
+    bl_label = "Watch"
+ 
+    def execute(self, context):
+        if IsWatching():
+            StopWatch()
+        else:
+            StartWatch(context)
+        return {'FINISHED'}
+     
+# Seconds of export work for each timer event of the export operator, then the UI
+# is updated
+EXPORT_TIME_SLICE = 0.1
+
+# Export button: from the UI the export runs in time slices in a modal operator, the
+# progress is shown on the cursor and Esc cancels the export
 class UrhoExportOperator(bpy.types.Operator):
-    """ Start exporting """
+    """ Start exporting (Esc to cancel) """
     
     bl_idname = "urho.export"
     bl_label = "Export"
+
+    # The modal export currently running (an UrhoExportOperator) or None
+    running = None
+
+    @classmethod
+    def poll(cls, context):
+        return cls.running is None
   
     def execute(self, context):
         ExecuteUrhoExport(context)
         return {'FINISHED'}
  
     def invoke(self, context, event):
-        return self.execute(context)
+        global watchExporting
+        if bpy.app.background:
+            return self.execute(context)
+        # Generator of the export steps (ExportSteps)
+        self.steps = ExportSteps(context)
+        # The export changes frames and poses, the watch mode must ignore them
+        watchExporting = True
+        UrhoExportOperator.running = self
+        wm = context.window_manager
+        wm.progress_begin(0.0, 1.0)
+        self.timer = wm.event_timer_add(0.01, context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            # Closing the generator runs its 'finally' blocks, they restore the scene
+            try:
+                self.steps.close()
+            finally:
+                self.finish(context)
+            log.warning("Export canceled")
+            print("----------------------Urho export canceled----------------------")
+            return {'CANCELLED'}
+
+        # Block the other events, the scene must not change during the export
+        if event.type != 'TIMER':
+            return {'RUNNING_MODAL'}
+
+        endTime = time.time() + EXPORT_TIME_SLICE
+        try:
+            while time.time() < endTime:
+                progress = next(self.steps)
+        except StopIteration:
+            self.finish(context)
+            return {'FINISHED'}
+        except:
+            # If the exception didn't come from the generator, its 'finally' blocks 
+            # have not run yet: close it to restore the scene
+            try:
+                self.steps.close()
+            finally:
+                self.finish(context)
+            raise
+        context.window_manager.progress_update(progress)
+        return {'RUNNING_MODAL'}
+
+    def finish(self, context):
+        global watchExporting, watchSkipUpdate
+        wm = context.window_manager
+        wm.event_timer_remove(self.timer)
+        wm.progress_end()
+        UrhoExportOperator.running = None
+        watchExporting = False
+        watchSkipUpdate = True
     
 # The export panel, here we draw the panel using properties we have created earlier
 class UrhoExportRenderPanel(bpy.types.Panel):
@@ -623,6 +828,10 @@ class UrhoExportRenderPanel(bpy.types.Panel):
         row = layout.row()
         #row=layout.row(align=True)
         row.operator("urho.export", icon='EXPORT')
+        if IsWatching():
+            row.operator("urho.watch", text="", icon='PAUSE')
+        else:
+            row.operator("urho.watch", text="", icon='PLAY')
         #split = layout.split(percentage=0.1)
         row.operator("urho.report", text="", icon='TEXT')
 
@@ -633,6 +842,7 @@ class UrhoExportRenderPanel(bpy.types.Panel):
         box.prop(settings, "outputPath")
         box.prop(settings, "useStandardDirs")
         box.prop(settings, "fileOverwrite")
+        box.prop(settings, "watchDelay")
 
         row = layout.row()    
         row.label("Settings:")
@@ -665,6 +875,13 @@ class UrhoExportRenderPanel(bpy.types.Panel):
             row.prop(settings, "mergeNotMaterials")
         box.prop(settings, "geometrySplit")
         box.prop(settings, "optimizeIndices")
+        box.prop(settings, "useCache")
+        if settings.useCache:
+            row = box.row()
+            row.separator()
+            row.prop(settings, "cachePath")
+            row.prop(settings, "cacheSize")
+        box.prop(settings, "parallel")
         box.prop(settings, "lods")
         if settings.lods:
             row = box.row()
@@ -707,6 +924,16 @@ class UrhoExportRenderPanel(bpy.types.Panel):
             row.prop(settings, "animationPos")
             row.prop(settings, "animationRot")
             row.prop(settings, "animationSca")
+            column.prop(settings, "bakeProcesses")
+            column.prop(settings, "stripBindChannels")
+            column.prop(settings, "reduceKeyframes")
+            if settings.reduceKeyframes:
+                row = column.row()
+                row.separator()
+                col = row.column()
+                col.prop(settings, "reducePosTolerance")
+                col.prop(settings, "reduceRotTolerance")
+                col.prop(settings, "reduceScaTolerance")
         
         row = box.row()
         row.prop(settings, "geometries")
@@ -784,6 +1011,7 @@ def register():
     bpy.utils.register_class(UrhoAddonPreferences)
     bpy.utils.register_class(UrhoExportSettings)
     bpy.utils.register_class(UrhoExportOperator) 
+    bpy.utils.register_class(UrhoWatchOperator) 
     bpy.utils.register_class(UrhoExportResetOperator) 
     bpy.utils.register_class(UrhoExportRenderPanel)
     bpy.utils.register_class(UrhoReportDialog)
@@ -812,9 +1040,12 @@ def unregister():
     
     #bpy.utils.unregister_module(__name__)
     
+    StopWatch()
+    
     bpy.utils.unregister_class(UrhoAddonPreferences)
     bpy.utils.unregister_class(UrhoExportSettings)
     bpy.utils.unregister_class(UrhoExportOperator) 
+    bpy.utils.unregister_class(UrhoWatchOperator) 
     bpy.utils.unregister_class(UrhoExportResetOperator) 
     bpy.utils.unregister_class(UrhoExportRenderPanel)
     bpy.utils.unregister_class(UrhoReportDialog)
@@ -885,14 +1116,318 @@ def composePath(path, standardDir, useStandardDirs):
         
     return path
 
+#--------------------
+# Watch mode
+#--------------------
+
+# Names of the mesh objects changed and not yet exported
+watchChangedNames = set()
+# Time of the last change
+watchLastChange = 0.0
+# We are exporting, ignore the scene updates
+watchExporting = False
+# Ignore the changes of the first scene update after the export, they are caused
+# by the export itself (rest pose, frames)
+watchSkipUpdate = False
+
+def IsWatching():
+    return WatchSceneUpdate in bpy.app.handlers.scene_update_post
+
+def StartWatch(context):
+    global watchSkipUpdate
+    if not context.scene.urho_exportsettings.fileOverwrite:
+        log.warning("Watch mode cannot update the files without Overwrite")
+    watchChangedNames.clear()
+    watchSkipUpdate = False
+    bpy.app.handlers.scene_update_post.append(WatchSceneUpdate)
+    print("Urho export watch started")
+
+def StopWatch():
+    if IsWatching():
+        bpy.app.handlers.scene_update_post.remove(WatchSceneUpdate)
+        print("Urho export watch stopped")
+    watchChangedNames.clear()
+
+def IsUpdated(datablock):
+    return datablock.is_updated or datablock.is_updated_data
+
+# Returns the actions used by an object: its active action and the actions of its NLA strips
+def ObjectActions(obj):
+    actions = set()
+    animationData = obj.animation_data
+    if animationData:
+        if animationData.action:
+            actions.add(animationData.action)
+        for track in animationData.nla_tracks:
+            actions.update(strip.action for strip in track.strips if strip.action)
+    return actions
+
+# Returns the names of the mesh objects changed in the last scene update: their object,
+# mesh, materials or armature and actions
+def WatchChangedObjects(scene):
+    data = bpy.data
+    # Fast check, no datablock of these types changed
+    if not (data.objects.is_updated or data.meshes.is_updated or data.armatures.is_updated or
+            data.actions.is_updated or data.materials.is_updated):
+        return None
+
+    materials = set()
+    if data.materials.is_updated:
+        materials = set(m for m in data.materials if IsUpdated(m))
+    actions = set()
+    if data.actions.is_updated:
+        actions = set(a for a in data.actions if IsUpdated(a))
+
+    changedNames = set()
+    for obj in scene.objects:
+        if obj.type != 'MESH':
+            continue
+        if IsUpdated(obj) or IsUpdated(obj.data):
+            changedNames.add(obj.name)
+            continue
+        armatureObj = FindArmature(obj)
+        if armatureObj and (IsUpdated(armatureObj) or IsUpdated(armatureObj.data) or
+                            (actions and not actions.isdisjoint(ObjectActions(armatureObj)))):
+            changedNames.add(obj.name)
+            continue
+        if materials and any(slot.material in materials for slot in obj.material_slots):
+            changedNames.add(obj.name)
+    return changedNames
+
+# Called after each scene update: it collects the changed objects and, when there are 
+# no new changes for 'watchDelay' seconds, it exports them
+def WatchSceneUpdate(scene):
+    global watchLastChange, watchExporting, watchSkipUpdate
+
+    if watchExporting:
+        return
+    if watchSkipUpdate:
+        watchSkipUpdate = False
+        return
+
+    changedNames = WatchChangedObjects(scene)
+    if changedNames:
+        watchChangedNames.update(changedNames)
+        watchLastChange = time.time()
+        return
+
+    if not watchChangedNames:
+        return
+    if time.time() - watchLastChange < scene.urho_exportsettings.watchDelay:
+        return
+    # In Edit mode the mesh is not updated, wait
+    activeObj = scene.objects.active
+    if activeObj and activeObj.mode == 'EDIT':
+        return
+
+    onlyObjects = set(watchChangedNames)
+    watchChangedNames.clear()
+    watchExporting = True
+    try:
+        ExecuteUrhoExport(bpy.context, onlyObjects)
+    finally:
+        watchExporting = False
+        watchSkipUpdate = True
+
+#--------------------
+# Export models
+#--------------------
+
+# What ExecuteUrhoExport needs of an exported object to write its materials
+class UrhoExportResult:
+    def __init__(self):
+        # List of UrhoMaterial
+        self.materials = []
+        # List of tuple(model name, list of UrhoMaterial indices) of the written models
+        self.modelsMaterials = []
+        # Dictionary container for errors
+        self.errorsDict = {}
+        # Log messages of an export in another process: list of tuple(level, message)
+        self.logRecords = []
+        # Time and counters of the export stages (telemetry.ObjectStats)
+        self.stats = None
+
+# Logger handler which saves the messages in a list, used in the export processes
+class RecordsLoggerHandler(logging.Handler):
+    def __init__(self, records):
+        logging.Handler.__init__(self)
+        self.records = records
+    def emit(self, record):
+        self.records.append( (record.levelno, record.getMessage()) )
+
+# Completes the decomposition of an object, exports it and writes its models and 
+# animations. It doesn't use Blender data, so it can run in another process.
+def ExportModels(tData, uExportOptions, modelsPath, fileOverwrite):
+    return RunSteps(ExportModelsSteps(tData, uExportOptions, modelsPath, fileOverwrite))
+
+# Same as ExportModels but as a generator: it yields the fraction of the work done 
+# (0.0 to 1.0) and returns the UrhoExportResult
+def ExportModelsSteps(tData, uExportOptions, modelsPath, fileOverwrite):
+
+    #PrintAll(tData)
+    
+    log.info("---- Exporting {:s} ----".format(tData.objectName))
+
+    stats = tData.stats or ObjectStats(tData.objectName)
+    tData.stats = stats
+    CountDecomposed(tData, stats)
+
+    # Progress: half for the postponed tasks, a quarter for the export and a quarter 
+    # for writing the files
+    for fraction in CompleteDecompositionSteps(tData):
+        yield 0.5 * fraction
+
+    uExportData = UrhoExportData()
+    
+    with stats.timer("UrhoExport"):
+        UrhoExport(tData, uExportOptions, uExportData, tData.errorsDict)
+    yield 0.75
+
+    filesCount = len(uExportData.models) + len(uExportData.animations)
+
+    #PrintUrhoData(uExportData, "FIRST20,POS,COLOR")
+    #PrintUrhoData(uExportData, 0x22B)
+
+    uResult = UrhoExportResult()
+    uResult.materials = uExportData.materials
+    uResult.errorsDict = tData.errorsDict
+    uResult.stats = stats
+
+    for i, uModel in enumerate(uExportData.models):
+        if uModel.geometries:
+            stats.count("bufferVertices", sum(len(b.vertices) for b in uModel.vertexBuffers))
+            filename = os.path.join(modelsPath, uModel.name + os.path.extsep + "mdl")
+            #filename = bpy.path.ensure_ext(filename, ".mdl")
+            #filename = bpy.path.clean_name(filename)
+            if not os.path.exists(filename) or fileOverwrite:
+                log.info( "Creating file {:s}".format(filename) )
+                with stats.timer("UrhoWriteModel"):
+                    UrhoWriteModel(uModel, filename)
+                CountWritten(filename, stats)
+            else:
+                log.error( "File already exist {:s}".format(filename) )
+            uResult.modelsMaterials.append( (uModel.name, uModel.materialsIndices) )
+        yield 0.75 + 0.25 * (i + 1) / filesCount
+        
+    for i, uAnimation in enumerate(uExportData.animations, len(uExportData.models)):
+        filename = os.path.join(modelsPath, uAnimation.name + os.path.extsep + "ani")
+        if not os.path.exists(filename) or fileOverwrite:
+            log.info( "Creating file {:s}".format(filename) )
+            with stats.timer("UrhoWriteAnimation"):
+                UrhoWriteAnimation(uAnimation, filename)
+            CountWritten(filename, stats)
+        else:
+            log.error( "File already exist {:s}".format(filename) )
+        yield 0.75 + 0.25 * (i + 1) / filesCount
+
+    return uResult
+
+# Adds the counters of the decomposed data to the stats
+def CountDecomposed(tData, stats):
+    stats.count("vertices", len(tData.verticesList))
+    stats.count("triangles", sum(len(lodLevel.triangleList) for geometry in tData.geometriesList 
+                                 for lodLevel in geometry.lodLevels))
+    stats.count("geometries", len(tData.geometriesList))
+    stats.count("morphs", len(tData.morphsList))
+    stats.count("bones", len(tData.bonesMap))
+    stats.count("animations", len(tData.animationsList))
+    stats.count("tracks", sum(len(animation.tracks) for animation in tData.animationsList))
+    stats.count("frames", sum(len(track.frames) for animation in tData.animationsList
+                              for track in animation.tracks))
+
+# Adds a written file to the stats
+def CountWritten(filename, stats):
+    stats.count("files")
+    try:
+        stats.count("bytesWritten", os.path.getsize(filename))
+    except OSError:
+        pass
+
+# ExportModels in an export process. Arguments and result are pickled by us because
+# the default pickler doesn't know the mathutils types.
+def ExportModelsProcess(data):
+    tData, uExportOptions, modelsPath, fileOverwrite = pickle.loads(data)
+    
+    # Save the log messages, they will be logged in the main process
+    records = []
+    savedHandlers = log.handlers[:]
+    log.handlers = [RecordsLoggerHandler(records)]
+    try:
+        uResult = ExportModels(tData, uExportOptions, modelsPath, fileOverwrite)
+    finally:
+        log.handlers = savedHandlers
+    uResult.logRecords = records
+    
+    return Dumps(uResult)
+
+# Size of the work to export a TData
+def ExportSize(tData):
+    size = len(tData.verticesList)
+    for geometry in tData.geometriesList:
+        for lodLevel in geometry.lodLevels:
+            size += len(lodLevel.triangleList)
+    for animation in tData.animationsList:
+        for track in animation.tracks:
+            size += len(track.frames)
+    return size
+
+# Seconds of a wait for the export processes, then ExportModelsParallel yields
+PARALLEL_WAIT_TIME = 0.05
+
+# Exports the objects in a pool of processes, the biggest first. It is a generator, while
+# waiting for the processes it yields the fraction of the objects exported (0.0 to 1.0),
+# it returns the list of UrhoExportResult in the same order of tDataList. If it is closed
+# before the end, the objects not yet started are canceled.
+def ExportModelsParallel(tDataList, uExportOptions, modelsPath, fileOverwrite):
+    uResults = [None] * len(tDataList)
+    order = sorted(range(len(tDataList)), key = lambda i: ExportSize(tDataList[i]), reverse = True)
+    workers = min(len(tDataList), multiprocessing.cpu_count())
+    log.info("Exporting {:d} objects in {:d} processes".format(len(tDataList), workers))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = {}
+        for i in order:
+            data = Dumps( (tDataList[i], uExportOptions, modelsPath, fileOverwrite) )
+            futures[executor.submit(ExportModelsProcess, data)] = i
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(pending, timeout = PARALLEL_WAIT_TIME,
+                                                        return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    uResults[futures[future]] = pickle.loads(future.result())
+                yield 1.0 - len(pending) / len(futures)
+        finally:
+            # When closed, cancel the objects not started, wait the others
+            for future in pending:
+                future.cancel()
+
+    return uResults
+
 #-------------------------------------------------------------------------
 # Export main
 #-------------------------------------------------------------------------
+
+# Name of the telemetry report written in the output folder
+REPORT_FILENAME = "urho_export_report.json"
+
+# Telemetry of the last export (telemetry.ExportStats), shown in the report window
+exportStats = None
     
-def ExecuteUrhoExport(context):
+# Export the objects in the scene, if 'onlyObjects' is a set of names export only these
+# objects (with the objects merged or LODs with them) without showing the report
+def ExecuteUrhoExport(context, onlyObjects = None):
+    RunSteps(ExportSteps(context, onlyObjects))
+
+# Same as ExecuteUrhoExport but as a generator, it yields the fraction of the export 
+# done (0.0 to 1.0): the decomposition is the first half, the export of the models 
+# up to 0.9, then the materials. The export operator runs it in time slices, if it is 
+# closed before the end the export is canceled (the scene is restored by ScanSteps).
+def ExportSteps(context, onlyObjects = None):
     global logList
+    global exportStats
 
-    startTime = time.time()
+    exportStats = ExportStats()
     
     print("----------------------Urho export start----------------------")
     
@@ -913,6 +1448,7 @@ def ExecuteUrhoExport(context):
     tOptions.doForceElements = settings.forceElements
     tOptions.useLods = settings.lods
     tOptions.onlySelected = (settings.source == 'ONLY_SELECTED')
+    tOptions.onlyObjects = onlyObjects
     tOptions.scale = settings.scale
     tOptions.globalOrigin = (settings.origin == 'GLOBAL')
     tOptions.applyModifiers = settings.modifiers
@@ -933,6 +1469,11 @@ def ExecuteUrhoExport(context):
     tOptions.doAnimationPos = settings.animationPos
     tOptions.doAnimationRot = settings.animationRot
     tOptions.doAnimationSca = settings.animationSca
+    tOptions.doReduceKeyframes = settings.reduceKeyframes
+    tOptions.reducePosTolerance = settings.reducePosTolerance
+    tOptions.reduceRotTolerance = settings.reduceRotTolerance
+    tOptions.reduceScaTolerance = settings.reduceScaTolerance
+    tOptions.bakeProcesses = settings.bakeProcesses
     tOptions.doGeometries = settings.geometries
     tOptions.doGeometryPos = settings.geometryPos
     tOptions.doGeometryNor = settings.geometryNor
@@ -950,65 +1491,62 @@ def ExecuteUrhoExport(context):
     tOptions.doMaterials = settings.materials or settings.textures
     tOptions.bonesGlobalOrigin = settings.bonesGlobalOrigin
     tOptions.actionsGlobalOrigin = settings.actionsGlobalOrigin
+    if settings.useCache:
+        tOptions.cachePath = bpy.path.abspath(settings.cachePath)
+        if not settings.cachePath:
+            tOptions.cachePath = bpy.utils.user_resource('DATAFILES', "urho_export_cache")
+        tOptions.cacheSize = settings.cacheSize * 1024 * 1024
     
     if tOptions.mergeObjects and not tOptions.globalOrigin:
         log.warning("Probably you should use Origin = Global")
 
     # Decompose
-    if DEBUG: ttt = time.time() #!TIME
-    Scan(context, tDataList, tOptions)
-    if DEBUG: print("[TIME] Decompose in {:.4f} sec".format(time.time() - ttt) ) #!TIME
+    for fraction in exportStats.timeSteps("Scan", ScanSteps(context, tDataList, tOptions)):
+        yield 0.5 * fraction
 
     if not settings.outputPath:
         log.error( "Output path is not set" )
         tDataList.clear()
 
-    # Export each decomposed object
-    for tData in tDataList:
-    
-        #PrintAll(tData)
-        
-        log.info("---- Exporting {:s} ----".format(tData.objectName))
-
-        uExportData = UrhoExportData()
-        
-        uExportOptions = UrhoExportOptions()
-        uExportOptions.splitSubMeshes = settings.geometrySplit
-        uExportOptions.useStrictLods = settings.strictLods
+    modelsPath = None
+    if tDataList:
+        modelsPath = composePath(settings.outputPath, "Models", settings.useStandardDirs)
 
-        if DEBUG: ttt = time.time() #!TIME
-        UrhoExport(tData, uExportOptions, uExportData, tData.errorsDict)
-        if DEBUG: print("[TIME] Export in {:.4f} sec".format(time.time() - ttt) ) #!TIME
-        if DEBUG: ttt = time.time() #!TIME
+    uExportOptions = UrhoExportOptions()
+    uExportOptions.splitSubMeshes = settings.geometrySplit
+    uExportOptions.useStrictLods = settings.strictLods
+    uExportOptions.stripBindChannels = settings.stripBindChannels
+
+    # Export each decomposed object and write models and animations, this doesn't need 
+    # Blender data so it can run in more processes (fork is needed to share the modules)
+    if settings.parallel and len(tDataList) > 1 and hasattr(os, "fork"):
+        steps = ExportModelsParallel(tDataList, uExportOptions, modelsPath, settings.fileOverwrite)
+        uResults = yield from ScaleSteps(exportStats.timeSteps("ExportModels", steps), 0.5, 0.4)
+    else:
+        uResults = []
+        for i, tData in enumerate(tDataList):
+            steps = ExportModelsSteps(tData, uExportOptions, modelsPath, settings.fileOverwrite)
+            uResult = yield from ScaleSteps(exportStats.timeSteps("ExportModels", steps),
+                                            0.5 + 0.4 * i / len(tDataList), 0.4 / len(tDataList))
+            uResults.append(uResult)
+
+    # Write textures and materials, in the order of the objects
+    writeTime = 0.0
+    for objectIndex, (tData, uResult) in enumerate(zip(tDataList, uResults)):
+        writeStartTime = time.time()
+    
+        # Log the messages of the export process
+        for level, message in uResult.logRecords:
+            log.log(level, message)
 
-        #PrintUrhoData(uExportData, "FIRST20,POS,COLOR")
-        #PrintUrhoData(uExportData, 0x22B)
+        stats = uResult.stats
+        exportStats.addObject(stats)
 
-        modelsPath = composePath(settings.outputPath, "Models", settings.useStandardDirs)
-            
-        for uModel in uExportData.models:
-            if uModel.geometries:
-                filename = os.path.join(modelsPath, uModel.name + os.path.extsep + "mdl")
-                #filename = bpy.path.ensure_ext(filename, ".mdl")
-                #filename = bpy.path.clean_name(filename)
-                if not os.path.exists(filename) or settings.fileOverwrite:
-                    log.info( "Creating file {:s}".format(filename) )
-                    UrhoWriteModel(uModel, filename)
-                else:
-                    log.error( "File already exist {:s}".format(filename) )
-            
-        for uAnimation in uExportData.animations:
-            filename = os.path.join(modelsPath, uAnimation.name + os.path.extsep + "ani")
-            if not os.path.exists(filename) or settings.fileOverwrite:
-                log.info( "Creating file {:s}".format(filename) )
-                UrhoWriteAnimation(uAnimation, filename)
-            else:
-                log.error( "File already exist {:s}".format(filename) )
-    
         if settings.textures:
+            texturesStartTime = time.time()
             texturesPath = composePath(settings.outputPath, "Textures", settings.useStandardDirs)
             texturesList = []
-            for uMaterial in uExportData.materials:
+            for uMaterial in uResult.materials:
                 for i in range(0, uMaterial.getTexturesNumber()):
                     textureName = uMaterial.getTextureName(i)
                     if textureName is None or textureName in texturesList:
@@ -1040,44 +1578,58 @@ def ExecuteUrhoExport(context):
                             log.error( "Cannot copy texture in {:s}".format(filename) )
                     else:
                         log.error( "File already exist {:s}".format(filename) )
+            stats.add("CopyTextures", time.time() - texturesStartTime)
 
         if settings.materials:
             materialsPath = composePath(settings.outputPath, "Materials", settings.useStandardDirs)
             materialsFilenames = []
-            for uMaterial in uExportData.materials:
+            for uMaterial in uResult.materials:
                 filename = os.path.join(materialsPath, uMaterial.name + os.path.extsep + "xml")
                 materialsFilenames.append(filename)
                 if not os.path.exists(filename) or settings.fileOverwrite:
                     log.info( "Creating file {:s}".format(filename) )
-                    UrhoWriteMaterial(uMaterial, filename, settings.useStandardDirs)
+                    with stats.timer("UrhoWriteMaterial"):
+                        UrhoWriteMaterial(uMaterial, filename, settings.useStandardDirs)
+                    CountWritten(filename, stats)
                 else:
                     log.error( "File already exist {:s}".format(filename) )
                     
             if settings.materialsList:
-                for uModel in uExportData.models:
-                    if uModel.geometries and uModel.materialsIndices:
-                        filename = os.path.join(modelsPath, uModel.name + os.path.extsep + "txt")
+                for modelName, materialsIndices in uResult.modelsMaterials:
+                    if materialsIndices:
+                        filename = os.path.join(modelsPath, modelName + os.path.extsep + "txt")
                         if not os.path.exists(filename) or settings.fileOverwrite:
                             log.info( "Creating file {:s}".format(filename) )
-                            UrhoWriteMaterialsList(uModel.materialsIndices, materialsFilenames, filename)
+                            with stats.timer("UrhoWriteMaterialsList"):
+                                UrhoWriteMaterialsList(materialsIndices, materialsFilenames, filename)
+                            CountWritten(filename, stats)
                         else:
                             log.error( "File already exist {:s}".format(filename) )
 
-        if DEBUG: print("[TIME] Write in {:.4f} sec".format(time.time() - ttt) ) #!TIME
-
-        if settings.selectErrors:
+        if settings.selectErrors and onlyObjects is None and not bpy.app.background:
             indices = set()
-            for key, value in tData.errorsDict.items():
+            for key, value in uResult.errorsDict.items():
                 if not value or not type(value) is set:
                     continue
                 log.warning( "Selecting {:d} vertices on {:s} with '{:s}' errors".format(len(value), tData.objectName, key) )
                 indices.update(value)
             if indices and tData.blenderObjectName:
                 selectVertices(context, tData.blenderObjectName, indices)
+        writeTime += time.time() - writeStartTime
+        yield 0.9 + 0.1 * (objectIndex + 1) / len(tDataList)
+    exportStats.phases.add("WriteMaterials", writeTime)
+
+    exportStats.finish()
+    if settings.outputPath and tDataList:
+        reportFilename = os.path.join(settings.outputPath, REPORT_FILENAME)
+        if exportStats.write(reportFilename):
+            log.info("Report written in {:s}".format(reportFilename))
     
-    log.info("Export ended in {:.4f} sec".format(time.time() - startTime) )
+    log.info("Export ended in {:.4f} sec ({:s})".format(exportStats.totalTime, 
+             ", ".join("{:s} {:.4f}".format(phase, seconds) for phase, seconds in exportStats.phases.times.items())) )
     
-    bpy.ops.urho.report('INVOKE_DEFAULT')
+    if onlyObjects is None and not bpy.app.background:
+        bpy.ops.urho.report('INVOKE_DEFAULT')
 
     
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+#
+# This script is licensed as public domain.
+#
+
+# Bakes some animations of an armature in a background Blender process, it is started
+# by DecomposeActionsParallel (decompose.py) on the saved .blend file:
+#   blender -b file.blend -S scene --python io_mesh_urho/bake.py -- INPUT OUTPUT
+# INPUT is a pickle of (armature name, animation object indices, TOptions, bones map),
+# OUTPUT is written as a pickle of ([(index, packed animation)], [(level, message)]),
+# with the animations packed by PackAnimation.
+# Exit code: 0 done, 1 errors.
+
+import sys
+import os
+import pickle
+import importlib
+import logging
+
+import bpy
+
+def Main():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    if len(argv) != 2:
+        print("Usage: blender -b file.blend --python bake.py -- INPUT OUTPUT")
+        return 1
+    inputFilename, outputFilename = argv
+
+    # Import the addon from the folder of this script
+    addonPath = os.path.dirname(os.path.abspath(__file__))
+    packagePath, packageName = os.path.split(addonPath)
+    if packagePath not in sys.path:
+        sys.path.append(packagePath)
+    addon = importlib.import_module(packageName)
+    core = importlib.import_module(packageName + ".core")
+    decompose = importlib.import_module(packageName + ".decompose")
+
+    with open(inputFilename, "rb") as file:
+        armatureName, indices, tOptions, bonesMap = pickle.load(file)
+    # Don't start other processes, the main process uses the cache
+    tOptions.bakeProcesses = 0
+    tOptions.cachePath = None
+
+    # Save the log messages, they will be logged in the main process
+    records = []
+    log = logging.getLogger("ExportLogger")
+    log.handlers = [addon.RecordsLoggerHandler(records)]
+
+    scene = bpy.context.scene
+    armatureObj = bpy.data.objects.get(armatureName)
+    if armatureObj is None:
+        print("Armature {:s} not found".format(armatureName))
+        return 1
+
+    # Decompose each animation object alone to know the index of its animations
+    animations = []
+    for index in indices:
+        tData = core.TData()
+        tData.bonesMap = bonesMap
+        core.RunSteps(decompose.DecomposeActions(scene, armatureObj, tData, tOptions, {index}))
+        for tAnimation in tData.animationsList:
+            animations.append( (index, core.PackAnimation(tAnimation)) )
+
+    # Write a temporary file first, the main process must not read a partial file
+    with open(outputFilename + ".tmp", "wb") as file:
+        pickle.dump( (animations, records), file, pickle.HIGHEST_PROTOCOL)
+    os.replace(outputFilename + ".tmp", outputFilename)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(Main())
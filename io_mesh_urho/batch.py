@@ -0,0 +1,147 @@
+
+#
+# This script is licensed as public domain.
+#
+
+# Headless export of a .blend file, run it with Blender in background mode:
+#   blender -b file.blend --python io_mesh_urho/batch.py -- [options]
+# To export another scene add '-S scene' before '--python'.
+#
+# Options (after '--'):
+#   --job FILE          JSON job file: {"reset": true, "settings": {...}}
+#   --set NAME=VALUE    set an export setting, the value is JSON (strings can be unquoted),
+#                       it can be repeated and it overrides the job file
+#   --output PATH       output folder (same as --set outputPath=PATH)
+#   --result FILE       write a JSON file with the export log, timing and stats
+#
+# The settings are the properties of the export panel (see UrhoExportSettings in
+# __init__.py), e.g. {"source": "ALL", "skeletons": true, "animations": true}.
+# With "reset" (default true) the settings saved in the .blend file are reset first.
+# Exit code: 0 no errors, 1 export errors, 2 wrong arguments or job.
+
+import sys
+import os
+import json
+import time
+import argparse
+
+import bpy
+import addon_utils
+
+ADDON_NAME = "io_mesh_urho"
+
+class JobError(Exception):
+    pass
+
+# Returns the arguments after '--'
+def ParseArguments(argv):
+    if "--" in argv:
+        argv = argv[argv.index("--") + 1:]
+    else:
+        argv = []
+
+    parser = argparse.ArgumentParser(prog = "blender -b file.blend --python batch.py --",
+                                     description = "Urho3D headless export")
+    parser.add_argument("--job", help = "JSON job file")
+    parser.add_argument("--set", action = "append", default = [], metavar = "NAME=VALUE",
+                        help = "export setting, the value is JSON")
+    parser.add_argument("--output", help = "output folder")
+    parser.add_argument("--result", help = "JSON file where to write the result")
+    return parser.parse_args(argv)
+
+# Returns the job dictionary from the job file and the command line settings
+def LoadJob(args):
+    job = {}
+    if args.job:
+        try:
+            with open(args.job, "r") as file:
+                job = json.load(file)
+        except (OSError, ValueError) as e:
+            raise JobError("Cannot read job file {:s}: {:s}".format(args.job, str(e)))
+        if not isinstance(job, dict):
+            raise JobError("Job file {:s} is not a JSON object".format(args.job))
+
+    settings = job.setdefault("settings", {})
+    for item in args.set:
+        name, sep, value = item.partition("=")
+        if not sep:
+            raise JobError("Wrong setting {:s}, use NAME=VALUE".format(item))
+        try:
+            settings[name] = json.loads(value)
+        except ValueError:
+            settings[name] = value
+    if args.output:
+        settings["outputPath"] = args.output
+    return job
+
+# Copies the job settings in the export settings. They are set in the same order of the
+# panel, so the rules between them (e.g. animations need skeletons) work as in the UI
+def ApplySettings(settings, jobSettings):
+    properties = [p.identifier for p in settings.bl_rna.properties]
+
+    unknown = set(jobSettings) - set(properties)
+    if unknown:
+        raise JobError("Unknown settings: {:s}".format(", ".join(sorted(unknown))))
+
+    for name in properties:
+        if name not in jobSettings:
+            continue
+        value = jobSettings[name]
+        if name == "outputPath":
+            value = os.path.abspath(value)
+        try:
+            setattr(settings, name, value)
+        except (TypeError, ValueError) as e:
+            raise JobError("Wrong value for setting {:s}: {:s}".format(name, str(e)))
+
+# Writes the result file
+def WriteResult(filename, result):
+    with open(filename, "w") as file:
+        json.dump(result, file, indent = 1)
+
+def Main():
+    startTime = time.time()
+    args = ParseArguments(sys.argv)
+    result = {"file": bpy.data.filepath, "errors": 0, "warnings": 0, "log": []}
+
+    try:
+        job = LoadJob(args)
+
+        # Enable the addon (it registers the settings), if it is not installed we can
+        # import it from the folder of this script
+        addonPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        if addonPath not in sys.path:
+            sys.path.append(addonPath)
+        addon_utils.enable(ADDON_NAME, default_set = False)
+        addon = sys.modules.get(ADDON_NAME)
+        if addon is None or not hasattr(bpy.types.Scene, "urho_exportsettings"):
+            raise JobError("Cannot enable the addon {:s}".format(ADDON_NAME))
+
+        context = bpy.context
+        settings = context.scene.urho_exportsettings
+        if job.get("reset", True):
+            settings.reset(context)
+        ApplySettings(settings, job["settings"])
+    except JobError as e:
+        print("ERROR:" + str(e))
+        result["errors"] = 1
+        result["log"] = ["ERROR:" + str(e)]
+        if args.result:
+            WriteResult(args.result, result)
+        return 2
+
+    addon.ExecuteUrhoExport(context)
+
+    result["log"] = list(addon.logList)
+    result["errors"] = sum(1 for line in addon.logList if line.startswith(("ERROR:", "CRITICAL:")))
+    result["warnings"] = sum(1 for line in addon.logList if line.startswith("WARNING:"))
+    result["time"] = time.time() - startTime
+    if addon.exportStats:
+        result["stats"] = addon.exportStats.report()
+    if args.result:
+        WriteResult(args.result, result)
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(Main())
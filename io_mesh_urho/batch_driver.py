@@ -0,0 +1,168 @@
+
+#
+# This script is licensed as public domain.
+#
+
+# Exports many .blend files running Blender in background mode with batch.py, more
+# files at the same time. It doesn't need Blender, run it with Python 3:
+#   python3 batch_driver.py manifest.txt --jobs 4 --job job.json --logs logs/
+#
+# The manifest has a .blend file per line, relative paths start from the manifest
+# folder, empty lines and lines starting with '#' are skipped. A line can add options
+# for batch.py after the file name, e.g.:
+#   levels/level1.blend --set skeletons=true
+#
+# For each file it saves in the logs folder the Blender output (<name>.log) and the
+# result of batch.py (<name>.json), then it writes a summary with the timings.
+# Exit code: 0 all files exported without errors, 1 otherwise.
+
+import sys
+import os
+import json
+import time
+import shlex
+import argparse
+import subprocess
+import multiprocessing
+import concurrent.futures
+
+# Script executed by Blender
+BATCH_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "batch.py")
+
+# An export of a .blend file
+class BatchItem:
+    def __init__(self, filename, options):
+        # Path of the .blend file
+        self.filename = filename
+        # Extra options for batch.py
+        self.options = options
+        # Name of the log files (unique)
+        self.name = None
+        # Blender exit code (None: not started or timed out)
+        self.returnCode = None
+        # Export time in seconds
+        self.time = 0.0
+        # Result written by batch.py
+        self.result = None
+
+# Returns the list of BatchItem in the manifest file
+def ReadManifest(manifestFilename):
+    items = []
+    names = set()
+    basePath = os.path.dirname(os.path.abspath(manifestFilename))
+    with open(manifestFilename, "r") as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            words = shlex.split(line)
+            item = BatchItem(os.path.join(basePath, words[0]), words[1:])
+            # Files with the same name in different folders
+            name = os.path.splitext(os.path.basename(item.filename))[0]
+            item.name = name
+            count = 1
+            while item.name in names:
+                count += 1
+                item.name = "{:s}_{:d}".format(name, count)
+            names.add(item.name)
+            items.append(item)
+    return items
+
+# Runs Blender on an item
+def RunItem(item, args):
+    logFilename = os.path.join(args.logs, item.name + ".log")
+    resultFilename = os.path.join(args.logs, item.name + ".json")
+    if os.path.exists(resultFilename):
+        os.remove(resultFilename)
+
+    command = [args.blender, "-b", item.filename, "--python", BATCH_SCRIPT, "--"]
+    if args.job:
+        command += ["--job", args.job]
+    if args.output:
+        command += ["--output", args.output]
+    command += ["--result", resultFilename] + item.options
+
+    startTime = time.time()
+    with open(logFilename, "w") as logFile:
+        logFile.write(" ".join(shlex.quote(c) for c in command) + "\n")
+        logFile.flush()
+        try:
+            item.returnCode = subprocess.call(command, stdout = logFile, stderr = subprocess.STDOUT,
+                                              timeout = args.timeout)
+        except subprocess.TimeoutExpired:
+            logFile.write("Timeout after {:d} sec\n".format(args.timeout))
+        except OSError as e:
+            logFile.write("Cannot run {:s}: {:s}\n".format(args.blender, str(e)))
+    item.time = time.time() - startTime
+
+    try:
+        with open(resultFilename, "r") as file:
+            item.result = json.load(file)
+    except (OSError, ValueError):
+        item.result = None
+    return item
+
+# Returns the status of an item for the summary
+def ItemStatus(item):
+    if item.returnCode is None:
+        return "FAILED"
+    if item.returnCode == 0 and item.result is not None:
+        return "OK"
+    if item.returnCode == 1 and item.result is not None:
+        return "ERRORS"
+    return "FAILED"
+
+def ParseArguments(argv):
+    parser = argparse.ArgumentParser(description = "Urho3D batch export of .blend files")
+    parser.add_argument("manifest", help = "file with the list of .blend files")
+    parser.add_argument("--blender", default = os.environ.get("BLENDER", "blender"),
+                        help = "Blender executable (default: $BLENDER or 'blender')")
+    parser.add_argument("--jobs", "-j", type = int, default = multiprocessing.cpu_count(),
+                        help = "Blender processes at the same time")
+    parser.add_argument("--job", help = "JSON job file for batch.py")
+    parser.add_argument("--output", help = "output folder (overrides the job)")
+    parser.add_argument("--logs", default = "urho_export_logs", help = "folder of the logs")
+    parser.add_argument("--timeout", type = int, default = None, help = "max seconds for a file")
+    parser.add_argument("--summary", help = "JSON summary file (default: <logs>/summary.json)")
+    return parser.parse_args(argv)
+
+def Main(argv):
+    args = ParseArguments(argv)
+    if args.job:
+        args.job = os.path.abspath(args.job)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    args.logs = os.path.abspath(args.logs)
+    if not os.path.isdir(args.logs):
+        os.makedirs(args.logs)
+
+    items = ReadManifest(args.manifest)
+    startTime = time.time()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, args.jobs)) as executor:
+        futures = [executor.submit(RunItem, item, args) for item in items]
+        for future in concurrent.futures.as_completed(futures):
+            item = future.result()
+            print("{:8s} {:8.2f}s  {:s}".format(ItemStatus(item), item.time, item.filename))
+            sys.stdout.flush()
+
+    totalTime = time.time() - startTime
+    summary = {"time": totalTime, "files": []}
+    for item in items:
+        result = item.result or {}
+        summary["files"].append({"file": item.filename, "status": ItemStatus(item),
+                                 "returnCode": item.returnCode, "time": item.time,
+                                 "errors": result.get("errors"), "warnings": result.get("warnings"),
+                                 "log": os.path.join(args.logs, item.name + ".log")})
+    summaryFilename = args.summary or os.path.join(args.logs, "summary.json")
+    with open(summaryFilename, "w") as file:
+        json.dump(summary, file, indent = 1)
+
+    failed = sum(1 for f in summary["files"] if f["status"] != "OK")
+    print("{:d} files in {:.2f}s, {:d} with errors, summary in {:s}".format(
+          len(items), totalTime, failed, summaryFilename))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(Main(sys.argv[1:]))
@@ -0,0 +1,428 @@
+#
+# This script is licensed as public domain.
+#
+
+# Persistent cache of decomposed objects.
+# Each entry is a file in the cache folder with the TData of one exported model. The
+# file name is a fingerprint of everything the decomposition reads: the meshes with
+# their modifiers, vertex groups, shape keys and materials texture slots, the armature,
+# the actions and the decompose options. If nothing changed, the fingerprint is the
+# same and the TData can be loaded instead of decomposing the objects again.
+# The sampled animations are saved in the same folder, each one with a fingerprint of
+# its actions keyframes, frames, skeleton and options, so when only the meshes change
+# the actions are not sampled again.
+
+# Pickle with custom reducers:
+#  http://docs.python.org/3.3/library/pickle.html#dispatch-tables
+
+from mathutils import Vector, Matrix, Quaternion, Color, Euler
+import hashlib
+import pickle
+import copyreg
+import array
+import io
+import os
+import stat
+import tempfile
+
+import logging
+log = logging.getLogger("ExportLogger")
+
+# Change this when the decomposed data (TData and its classes) changes
+CACHE_VERSION = 3
+
+# Extension of the cache files: decomposed objects and sampled animations
+CACHE_EXTENSION = ".tdata"
+ANIMATION_CACHE_EXTENSION = ".tanim"
+
+# TOptions fields which don't change the decomposed data
+CACHE_IGNORED_OPTIONS = ('lodUpdatedGeometryIndices', 'lodDistance', 'lodIndex',
+                         'onlySelected', 'onlyObjects', 'cachePath', 'cacheSize',
+                         'bakeProcesses')
+
+# TOptions fields which change the sampled animations
+ANIMATION_KEY_OPTIONS = ('scale', 'actionsGlobalOrigin', 'doAnimationPos', 'doAnimationRot',
+                         'doAnimationSca', 'doReduceKeyframes', 'reducePosTolerance', 
+                         'reduceRotTolerance', 'reduceScaTolerance')
+
+#--------------------
+# Fingerprint
+#--------------------
+
+# Converts a Blender value in a plain Python value we can hash: mathutils types and
+# arrays become tuples, datablocks become their names
+def PlainValue(value):
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    # Datablock (ID) pointer
+    if hasattr(value, "bl_rna") and hasattr(value, "users"):
+        return value.name
+    try:
+        return tuple(PlainValue(v) for v in value)
+    except TypeError:
+        return repr(value)
+
+# Adds a value to the hash
+def HashValue(hasher, value):
+    hasher.update(repr(PlainValue(value)).encode("utf-8"))
+    hasher.update(b"\0")
+
+# Adds an attribute of all the items of a Blender collection to the hash, with a
+# single API call
+def HashCollection(hasher, collection, attribute, itemSize, typecode = 'f'):
+    values = [0] * (len(collection) * itemSize)
+    collection.foreach_get(attribute, values)
+    hasher.update(array.array(typecode, values).tobytes())
+
+# Adds all the properties of a Blender struct to the hash (but not its collections)
+def HashProperties(hasher, struct):
+    for prop in struct.bl_rna.properties:
+        if prop.identifier == "rna_type" or prop.type == 'COLLECTION':
+            continue
+        HashValue(hasher, (prop.identifier, getattr(struct, prop.identifier, None)))
+
+# Adds to the hash a mesh object: transform, modifiers, vertex groups and its mesh
+# with UV, colors, weights, shape keys and materials texture slots (they select the UV)
+def HashMeshObject(hasher, obj):
+    HashValue(hasher, (obj.name, obj.parent, obj.parent_type, obj.parent_bone, obj.matrix_world))
+
+    for group in obj.vertex_groups:
+        HashValue(hasher, (group.index, group.name))
+
+    for modifier in obj.modifiers:
+        HashProperties(hasher, modifier)
+        # The result of the modifier also depends on the objects it uses (boolean 
+        # operand, array caps and curve, lattice...)
+        for prop in modifier.bl_rna.properties:
+            if prop.type == 'POINTER' and prop.fixed_type.identifier == 'Object':
+                target = getattr(modifier, prop.identifier)
+                if target:
+                    HashModifierTarget(hasher, target)
+
+    mesh = obj.data
+    HashValue(hasher, (mesh.name, len(mesh.vertices), len(mesh.edges), len(mesh.polygons), len(mesh.loops)))
+    HashCollection(hasher, mesh.vertices, "co", 3)
+    HashCollection(hasher, mesh.edges, "vertices", 2, 'I')
+    HashCollection(hasher, mesh.edges, "use_edge_sharp", 1, 'B')
+    HashCollection(hasher, mesh.polygons, "loop_start", 1, 'I')
+    HashCollection(hasher, mesh.polygons, "loop_total", 1, 'I')
+    HashCollection(hasher, mesh.polygons, "material_index", 1, 'I')
+    HashCollection(hasher, mesh.polygons, "use_smooth", 1, 'B')
+    HashCollection(hasher, mesh.polygons, "hide", 1, 'B')
+    HashCollection(hasher, mesh.loops, "vertex_index", 1, 'I')
+
+    HashValue(hasher, mesh.uv_textures.active_index)
+    for layer in mesh.uv_layers:
+        HashValue(hasher, layer.name)
+        HashCollection(hasher, layer.data, "uv", 2)
+
+    HashValue(hasher, mesh.vertex_colors.active_index)
+    for layer in mesh.vertex_colors:
+        HashValue(hasher, layer.name)
+        HashCollection(hasher, layer.data, "color", 3)
+
+    # Vertex groups weights, the count of each vertex separates the vertices. There is
+    # no attribute with the weights of all the vertices, we read each vertex groups with
+    # one call per attribute
+    if obj.vertex_groups:
+        counts = array.array('I')
+        for vertex in mesh.vertices:
+            vertexGroups = vertex.groups
+            counts.append(len(vertexGroups))
+            if vertexGroups:
+                HashCollection(hasher, vertexGroups, "group", 1, 'I')
+                HashCollection(hasher, vertexGroups, "weight", 1)
+        hasher.update(counts.tobytes())
+
+    if mesh.shape_keys:
+        for block in mesh.shape_keys.key_blocks:
+            HashValue(hasher, (block.name, block.mute, block.value, block.relative_key.name))
+            HashCollection(hasher, block.data, "co", 3)
+
+    for material in mesh.materials:
+        if not material:
+            HashValue(hasher, None)
+            continue
+        HashValue(hasher, material.name)
+        for texture in material.texture_slots:
+            if texture:
+                HashValue(hasher, (texture.name, texture.texture_coords, texture.uv_layer))
+
+# Adds to the hash an object used by a modifier: transform, modifiers and the data read
+# by the modifier (mesh geometry, lattice points, curve points)
+def HashModifierTarget(hasher, obj):
+    HashValue(hasher, (obj.name, obj.type, obj.matrix_world))
+    # Its modifiers change the data used (we don't follow their targets, they can loop)
+    for modifier in obj.modifiers:
+        HashProperties(hasher, modifier)
+
+    data = obj.data
+    if obj.type == 'MESH':
+        HashValue(hasher, (data.name, len(data.vertices), len(data.polygons), len(data.loops)))
+        HashCollection(hasher, data.vertices, "co", 3)
+        HashCollection(hasher, data.polygons, "loop_total", 1, 'I')
+        HashCollection(hasher, data.loops, "vertex_index", 1, 'I')
+    elif obj.type == 'LATTICE':
+        HashProperties(hasher, data)
+        HashCollection(hasher, data.points, "co_deform", 3)
+    elif obj.type == 'CURVE':
+        HashProperties(hasher, data)
+        for spline in data.splines:
+            HashProperties(hasher, spline)
+            HashValue(hasher, (len(spline.points), len(spline.bezier_points)))
+            HashCollection(hasher, spline.points, "co", 4)
+            HashCollection(hasher, spline.points, "tilt", 1)
+            HashCollection(hasher, spline.bezier_points, "co", 3)
+            HashCollection(hasher, spline.bezier_points, "handle_left", 3)
+            HashCollection(hasher, spline.bezier_points, "handle_right", 3)
+            HashCollection(hasher, spline.bezier_points, "tilt", 1)
+
+# Adds to the hash an armature object: transform, bones rest position and flags, pose
+# bones constraints
+def HashArmatureObject(hasher, obj):
+    HashValue(hasher, (obj.name, obj.matrix_world, obj.data.layers))
+    for bone in obj.data.bones:
+        HashValue(hasher, (bone.name, bone.parent, bone.matrix_local, bone.length,
+                           bone.use_deform, bone.hide, bone.layers))
+    for poseBone in obj.pose.bones:
+        HashValue(hasher, (poseBone.name, poseBone.rotation_mode))
+        for constraint in poseBone.constraints:
+            HashProperties(hasher, constraint)
+
+# Adds to the hash what we sample in the animations: timeline, actions keyframes,
+# NLA tracks and strips of the armature
+def HashAnimations(hasher, scene, armatureObj, actions):
+    render = scene.render
+    HashValue(hasher, (render.fps, render.fps_base, scene.frame_start, scene.frame_end, scene.frame_step))
+
+    for action in actions:
+        HashAction(hasher, action)
+    HashNla(hasher, armatureObj)
+
+# Adds to the hash the keyframes of an action
+def HashAction(hasher, action):
+    HashValue(hasher, (action.name, action.frame_range))
+    for fcurve in action.fcurves:
+        HashFCurve(hasher, fcurve)
+
+# Adds to the hash the keyframes and the modifiers of an F-curve
+def HashFCurve(hasher, fcurve):
+    HashValue(hasher, (fcurve.data_path, fcurve.array_index, fcurve.mute, fcurve.extrapolation))
+    points = fcurve.keyframe_points
+    HashCollection(hasher, points, "co", 2)
+    HashCollection(hasher, points, "handle_left", 2)
+    HashCollection(hasher, points, "handle_right", 2)
+    HashValue(hasher, [p.interpolation for p in points])
+    for modifier in fcurve.modifiers:
+        HashProperties(hasher, modifier)
+
+# Adds to the hash the current action and the NLA tracks and strips of an object
+def HashNla(hasher, obj):
+    animationData = obj.animation_data
+    if animationData:
+        HashValue(hasher, animationData.action)
+        for track in animationData.nla_tracks:
+            HashValue(hasher, (track.name, track.mute, track.select, track.is_solo))
+            for strip in track.strips:
+                HashProperties(hasher, strip)
+
+# Returns the fingerprint of the decomposition of the mesh objects in a TData.
+# armatures: armature of each mesh object (or None)
+# actions: the actions sampled with the armature of each mesh object (see AnimationActions)
+def DecompositionKey(scene, meshObjects, armatures, actions, tOptions):
+    hasher = hashlib.sha1()
+
+    HashValue(hasher, CACHE_VERSION)
+    # The current frame can change the shape keys
+    HashValue(hasher, scene.frame_current)
+
+    options = sorted((k, v) for k, v in tOptions.__dict__.items() if k not in CACHE_IGNORED_OPTIONS)
+    HashValue(hasher, options)
+
+    for meshObj, armatureObj, armatureActions in zip(meshObjects, armatures, actions):
+        HashMeshObject(hasher, meshObj)
+        if armatureObj:
+            HashArmatureObject(hasher, armatureObj)
+            if tOptions.doAnimations:
+                HashAnimations(hasher, scene, armatureObj, armatureActions)
+
+    return hasher.hexdigest()
+
+# Returns the fingerprint of an animation sampled by DecomposeAnimations.
+# kind, name: type and name of the animation object (action, NLA track or strip, timeline)
+# startFrame, endFrame: sampled frames
+# actions: the actions used by the animation
+# useNla: the animation is sampled with the NLA of the armature
+# bones: names of the sampled bones, bonesMap: the skeleton
+def AnimationKey(scene, armatureObj, kind, name, startFrame, endFrame, actions, useNla, 
+                 bones, bonesMap, tOptions):
+    hasher = hashlib.sha1()
+
+    HashValue(hasher, CACHE_VERSION)
+    HashValue(hasher, (kind, name, startFrame, endFrame))
+    render = scene.render
+    HashValue(hasher, (render.fps, render.fps_base, scene.frame_step))
+    HashValue(hasher, [(k, getattr(tOptions, k)) for k in ANIMATION_KEY_OPTIONS])
+    HashValue(hasher, [(bone, bonesMap[bone].parentName) for bone in bones])
+
+    # The pose depends on the rest position, the constraints and the drivers
+    HashArmatureObject(hasher, armatureObj)
+    animationData = armatureObj.animation_data
+    if animationData:
+        for fcurve in animationData.drivers:
+            HashFCurve(hasher, fcurve)
+            HashValue(hasher, fcurve.driver.expression)
+
+    for action in sorted(actions, key = lambda a: a.name):
+        HashAction(hasher, action)
+    if useNla:
+        HashNla(hasher, armatureObj)
+
+    return hasher.hexdigest()
+
+#--------------------
+# Cache
+#--------------------
+
+# mathutils types cannot be pickled, we save them as tuples
+def ReduceVector(v):
+    return (Vector, (tuple(v),))
+
+def ReduceQuaternion(q):
+    return (Quaternion, (tuple(q),))
+
+def ReduceMatrix(m):
+    return (Matrix, (tuple(tuple(row) for row in m),))
+
+def ReduceColor(c):
+    return (Color, (tuple(c),))
+
+def ReduceEuler(e):
+    return (Euler, (tuple(e), e.order))
+
+dispatchTable = copyreg.dispatch_table.copy()
+dispatchTable[Vector] = ReduceVector
+dispatchTable[Quaternion] = ReduceQuaternion
+dispatchTable[Matrix] = ReduceMatrix
+dispatchTable[Color] = ReduceColor
+dispatchTable[Euler] = ReduceEuler
+
+# Returns the data pickled, mathutils types included
+def Dumps(data):
+    file = io.BytesIO()
+    pickler = pickle.Pickler(file, pickle.HIGHEST_PROTOCOL)
+    pickler.dispatch_table = dispatchTable
+    pickler.dump(data)
+    return file.getvalue()
+
+# Returns True if the file stat is of a file of the current user which the other users
+# cannot change. Loading the cache runs the code in the files (pickle), so we load only
+# files written by the user. Without user ids (Windows) we rely on the folder permissions.
+def IsPrivate(fileStat):
+    if not hasattr(os, "getuid"):
+        return True
+    return (fileStat.st_uid == os.getuid() and 
+            not fileStat.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+# Returns the TDataCache of the folder, or None if the folder cannot be created or it 
+# is not private to the user. A new folder is accessible only by the user.
+def OpenCache(path, maxSize, extension = CACHE_EXTENSION):
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path, 0o700)
+        pathStat = os.stat(path)
+    except OSError as e:
+        log.warning("Cannot create cache folder {:s} {:s}".format(path, str(e)))
+        return None
+    if not stat.S_ISDIR(pathStat.st_mode) or not IsPrivate(pathStat):
+        log.warning("Cache not used, the folder {:s} is not private to the user".format(path))
+        return None
+    return TDataCache(path, maxSize, extension)
+
+# Cache of decomposed data in a folder (open it with OpenCache). When the files in the
+# folder exceed the maximum size, evict deletes the least recently used. The decomposed 
+# objects and the sampled animations use different extensions in the same folder.
+class TDataCache:
+    def __init__(self, path, maxSize, extension = CACHE_EXTENSION):
+        # Folder of the cache files
+        self.path = path
+        # Max size of the folder in bytes
+        self.maxSize = maxSize
+        # Extension of the files of this cache
+        self.extension = extension
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+    def getFilename(self, key):
+        return os.path.join(self.path, key + self.extension)
+
+    # Returns the data saved with the key, or None
+    def load(self, key):
+        filename = self.getFilename(key)
+        try:
+            with open(filename, "rb") as file:
+                fileStat = os.fstat(file.fileno())
+                if not stat.S_ISREG(fileStat.st_mode) or not IsPrivate(fileStat):
+                    log.warning("Cache file {:s} not loaded, it is not private to the user".format(filename))
+                    self.misses += 1
+                    return None
+                data = pickle.load(file)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            log.warning("Cannot read cache file {:s} {:s}".format(filename, str(e)))
+            self.misses += 1
+            return None
+        # Update the last access time
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return data
+
+    # Saves the data with the key. The temporary file has an unique name (readable only
+    # by the user), more processes can save the same key at the same time.
+    def save(self, key, data):
+        filename = self.getFilename(key)
+        tempFilename = None
+        try:
+            fd, tempFilename = tempfile.mkstemp(dir = self.path, prefix = key + ".", suffix = ".tmp")
+            with os.fdopen(fd, "wb") as file:
+                file.write(Dumps(data))
+            os.replace(tempFilename, filename)
+        except Exception as e:
+            log.warning("Cannot write cache file {:s} {:s}".format(filename, str(e)))
+            if tempFilename:
+                try:
+                    os.remove(tempFilename)
+                except OSError:
+                    pass
+
+    # Deletes the least recently used files until the cache is within the max size, 
+    # called once at the end of the export
+    def evict(self):
+        entries = []
+        totalSize = 0
+        for name in os.listdir(self.path):
+            if not name.endswith((CACHE_EXTENSION, ANIMATION_CACHE_EXTENSION)):
+                continue
+            filename = os.path.join(self.path, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+            totalSize += stat.st_size
+        entries.sort()
+        for mtime, size, filename in entries:
+            # Always keep the most recent file
+            if totalSize <= self.maxSize or filename == entries[-1][2]:
+                break
+            try:
+                os.remove(filename)
+                totalSize -= size
+            except OSError:
+                pass
@@ -0,0 +1,1628 @@
+
+#
+# This script is licensed as public domain.
+#
+
+# Core of the decomposition, it doesn't use Blender data (bpy) so it can run in other
+# processes or outside Blender (only the mathutils module is needed):
+# - the T classes (TData, TVertex, TGeometry...) and the decompose options,
+# - tangents generation and indices optimization,
+# - keyframes reduction of the animations,
+# - DecomposeGeometry: vertices, geometries and LODs from a TMeshData,
+# - DecomposeShape: morphs from the shape keys coordinates,
+# - the input API to create a TMeshData and the bones from plain arrays.
+# The long functions have a generator version (DecomposeGeometrySteps, 
+# CompleteDecompositionSteps) to run them in time slices.
+# decompose.py reads the Blender data and uses these functions.
+# Outside Blender put this folder in sys.path and import 'core' and 'export_urho', e.g.:
+#   tData = TData()
+#   AddBones(tData, names, parents, matrices)
+#   tMeshData = MeshDataFromArrays(positions, faces, normals, uvs, weights = weights)
+#   DecomposeGeometry(tMeshData, tData, TOptions(), tData.errorsDict, "name")
+#   CompleteDecomposition(tData)
+#   UrhoExport(tData, UrhoExportOptions(), uExportData, tData.errorsDict)
+
+DEBUG = False
+
+import math
+import time
+import array
+import itertools
+import operator
+from mathutils import Vector, Matrix, Quaternion
+from collections import OrderedDict
+
+import logging
+log = logging.getLogger("ExportLogger")
+
+#------------------
+# Geometry classes
+#------------------
+
+# Vertex class (slots save the per instance dictionary, we have millions of these)
+class TVertex:
+    __slots__ = ('blenderIndex', 'pos', 'normal', 'color', 'uv', 'uv2', 'tangent', 'bitangent', 'weights')
+
+    def __init__(self):
+        # Index of the vertex in the Blender buffer
+        self.blenderIndex = None
+        # Position of the vertex: Vector((0.0, 0.0, 0.0))
+        self.pos = None
+        # Normal of the vertex: Vector((0.0, 0.0, 0.0))
+        self.normal = None
+        # Color of the vertex: (0, 0, 0, 0)...(255, 255, 255, 255)
+        self.color = None
+        # UV coordinates of the vertex: Vector((0.0, 0.0))..Vector((1.0, 1.0))
+        self.uv = None
+        # UV2 coordinates of the vertex: Vector((0.0, 0.0))..Vector((1.0, 1.0))
+        self.uv2 = None
+        # Tangent of the vertex: Vector((0.0, 0.0, 0.0, 0.0))
+        self.tangent = None
+        # Bitangent of the vertex: Vector((0.0, 0.0, 0.0))
+        self.bitangent = None
+        # Bones weights: list of tuple(boneIndex, weight)
+        self.weights = None
+
+    # returns True is this vertex is a changed morph of vertex 'other'
+    def isMorphed(self, other):
+        # TODO: compare floats with a epsilon margin?
+        if other.pos is None:
+            return True
+        if self.pos and self.pos != other.pos:
+            return True
+        if self.normal and self.normal != other.normal:
+            return True
+        # We cannot use tangent, it is not calculated yet
+        if self.uv and self.uv != other.uv:
+            return True
+        return False
+
+    # used by the function index() of lists
+    def __eq__(self, other):
+        # TODO: can we do without color and weights?
+        # TODO: compare floats with a epsilon margin?
+        #return (self.__dict__ == other.__dict__)
+        return (self.pos == other.pos and 
+                self.normal == other.normal and 
+                self.uv == other.uv)
+
+    def isEqual(self, other):
+        # TODO: compare floats with a epsilon margin?
+        return self == other
+                
+    def __hash__(self):
+        hashValue = 0
+        if self.pos:
+            hashValue ^= hash(self.pos.x) ^ hash(self.pos.y) ^ hash(self.pos.z)
+        if self.normal:
+            hashValue ^= hash(self.normal.x) ^ hash(self.normal.y) ^ hash(self.normal.z)
+        if self.uv:
+            hashValue ^= hash(self.uv.x) ^ hash(self.uv.y)
+        return hashValue
+    
+    def __str__(self):
+        s  = "  coords: {: .3f} {: .3f} {: .3f}".format(self.pos.x, self.pos.y, self.pos.z)
+        s += "\n normals: {: .3f} {: .3f} {: .3f}".format(self.normal.x, self.normal.y, self.normal.z)
+        if self.color:
+            s += "\n   color: {:3d} {:3d} {:3d} {:3d}".format(self.color[0], self.color[1], self.color[2], self.color[3])
+        if self.uv:
+            s += "\n      uv: {: .3f} {: .3f}".format(self.uv[0], self.uv[1])
+        if self.uv2:
+            s += "\n     uv2: {: .3f} {: .3f}".format(self.uv2[0], self.uv2[1])
+        if self.tangent:
+            s += "\n tangent: {: .3f} {: .3f} {: .3f}".format(self.tangent.x, self.tangent.y, self.tangent.z)
+        if self.weights:
+            s += "\n weights: "
+            for w in self.weights:
+                s += "{:d} {:.3f}  ".format(w[0],w[1])
+        return s
+
+# List of triangles stored in a flat array of vertex indices (3 per triangle), it
+# works like a list of tuples (triples of vertex indices) but it takes much less memory
+class TTriangleList:
+    def __init__(self, triangles = ()):
+        self.indices = array.array('I')
+        for triangle in triangles:
+            self.indices.extend(triangle)
+
+    def __len__(self):
+        return len(self.indices) // 3
+
+    def __iter__(self):
+        # Three references to the same iterator give consecutive triples
+        it = iter(self.indices)
+        return zip(it, it, it)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("triangle index out of range")
+        return tuple(self.indices[3*index : 3*index+3])
+
+    def append(self, triangle):
+        self.indices.extend(triangle)
+
+# Geometry LOD level class
+class TLodLevel:
+    def __init__(self):
+        self.distance = 0.0
+        # Set of all vertex indices use by this LOD
+        self.indexSet = set()
+        # List of triangles of the LOD (triples of vertex indices)
+        self.triangleList = TTriangleList()
+
+    def __str__(self):  
+        s = "  distance: {:.3f}\n".format(self.distance)
+        s += "  triangles: "
+        for i, t in enumerate(self.triangleList):
+            if i and (i % 5) == 0:
+                s += "\n             "
+            s += "{:3d} {:3d} {:3d} |".format(t[0],t[1],t[2])
+        return s
+    
+# Geometry class
+class TGeometry:
+    def __init__(self):
+        # List of TLodLevel
+        self.lodLevels = []
+
+    def __str__(self):
+        s = ""
+        for i, l in enumerate(self.lodLevels):
+            s += " {:d}\n".format(i) + str(l)
+        return s
+
+# Mesh data read in bulk from a Blender mesh (ExtractMeshData) or created from arrays
+# (MeshDataFromArrays), positions and normals are already transformed and converted to Y up
+class TMeshData:
+    def __init__(self):
+        # Position of each Blender vertex: list of tuples (x, y, z)
+        self.positions = []
+        # Normal of each Blender vertex: list of tuples (x, y, z)
+        self.vertexNormals = []
+        # Normal of each face: list of tuples (x, y, z)
+        self.faceNormals = []
+        # Vertex indices of each face: list of tuples of 3 (triangle) or 4 (quad) indices
+        self.faceVertices = []
+        # Smooth flag of each face
+        self.faceSmooth = []
+        # Material index of each face
+        self.faceMaterials = []
+        # Hidden flag of each face
+        self.faceHidden = []
+        # UV of each face: array of 8 floats per face (u1,v1..u4,v4) with V
+        # flipped (1-v), or None
+        self.uvs = None
+        # UV2 of each face: same format of uvs, or None
+        self.uvs2 = None
+        # RGB colors of each face: list of 4 flat lists (one per face corner)
+        # of 3 floats per face, or None
+        self.colorsRgb = None
+        # Alpha colors of each face, same format of colorsRgb, or None
+        self.colorsAlpha = None
+        # Bones weights of each vertex: tuple of tuples (bone index, weight) or None, 
+        # or None if there are no weights
+        self.vertexWeights = None
+        # Number of materials, a geometry is created for each one
+        self.materialsCount = 1
+
+#------------------
+# Morph classes
+#------------------
+
+class TMorph:
+    def __init__(self, name):
+        # Morph name
+        self.name = name
+        # Set of all vertex indices use by this morph
+        self.indexSet = set()
+        # List of triangles of the morph (triples of vertex indices)
+        self.triangleList = TTriangleList()
+        # Maps vertex index to morphed TVertex
+        self.vertexMap = {}
+
+    def __str__(self):  
+        s = " name: {:s}\n".format(self.name)
+        s += " Vertices: "
+        for k, v in sorted(self.vertices.items()):
+            s += "\n  index: {:d}".format(k)
+            s += "\n" + str(v)
+        return s
+
+#-------------------
+# Materials classes
+#-------------------
+
+# NOTE: in Blender images names are unique
+
+class TMaterial:
+    def __init__(self, name):
+        # Material name
+        self.name = name
+        # Diffuse color (0.0, 0.0, 0.0)
+        self.diffuseColor = None
+        # Diffuse intesity (0.0)
+        self.diffuseIntensity = None
+        # Specular color (0.0, 0.0, 0.0)
+        self.specularColor = None
+        # Specular intesity (0.0)
+        self.specularIntensity = None
+        # Specular hardness (1.0)
+        self.specularHardness = None
+        # Opacity (1.0) 
+        self.opacity = None
+        # Material is two sided
+        self.twoSided = False
+        # Diffuse color texture filename (no path)
+        self.diffuseTexName = None
+        # Normal texture filename (no path)
+        self.normalTexName = None
+        # Specular texture filename (no path)
+        self.specularTexName = None
+        # Emissive texture filename (no path)
+        self.lightmapTexName = None
+        # This material is shadeless
+        self.shadeless = False
+
+    def __eq__(self, other):
+        if hasattr(other, 'name'):
+            return (self.name == other.name)
+        return (self.name == other)
+
+    def __str__(self):  
+        return (" name: {:s}\n"
+                " image: \"{:s}\""
+                .format(self.name, self.diffuseTexName) )
+
+
+#--------------------
+# Animations classes
+#--------------------
+
+class TBone:    
+    def __init__(self, index, parentName, position, rotation, scale, transform):
+        # Position of the bone in the OrderedDict
+        self.index = index
+        # Name of the parent bone
+        self.parentName = parentName
+        # Bone position in the parent bone tail space (you first apply this)
+        self.bindPosition = position
+        # Bone rotation in the parent bone tail space (and then this)
+        self.bindRotation = rotation
+        # Bone scale
+        self.bindScale = scale
+        # Bone transformation in object space
+        self.worldTransform = transform
+
+    def __str__(self):
+        s = " bind pos " + str(self.bindPosition)
+        s += "\n bind rot " + str(self.bindRotation) #+ "\n" + str(self.bindRotation.to_axis_angle())
+        #s += "\n" + str(self.worldTransform.inverted())
+        s += "\n" + str(self.worldTransform)
+        return s
+
+class TFrame:
+    __slots__ = ('time', 'position', 'rotation', 'scale')
+
+    def __init__(self, time, position, rotation, scale):
+        self.time = time
+        self.position = position
+        self.rotation = rotation
+        self.scale = scale
+        
+    def hasMoved(self, other):
+        return (self.position != other.position or self.rotation != other.rotation or self.scale != other.scale)
+
+class TTrack:
+    def __init__(self, name):
+        self.name = name
+        self.frames = []
+
+class TAnimation:
+    def __init__(self, name):
+        self.name = name
+        self.tracks = []
+
+# Converts an animation to plain data with the frames in float32 arrays, compact to send
+# to another process: (name, [(track name, times, positions, rotations, scales)]), the
+# arrays of the channels not exported are None
+def PackAnimation(tAnimation):
+    tracks = []
+    for tTrack in tAnimation.tracks:
+        frames = tTrack.frames
+        channels = [array.array('f', (frame.time for frame in frames))]
+        for attribute in ('position', 'rotation', 'scale'):
+            if frames and getattr(frames[0], attribute) is not None:
+                values = itertools.chain.from_iterable(getattr(frame, attribute) for frame in frames)
+                channels.append(array.array('f', values))
+            else:
+                channels.append(None)
+        tracks.append( (tTrack.name,) + tuple(channels) )
+    return (tAnimation.name, tracks)
+
+# Converts the data of PackAnimation back to a TAnimation
+def UnpackAnimation(data):
+    name, tracks = data
+    tAnimation = TAnimation(name)
+    for trackName, times, positions, rotations, scales in tracks:
+        tTrack = TTrack(trackName)
+        for i, frameTime in enumerate(times):
+            position = positions and Vector(positions[3 * i : 3 * i + 3])
+            rotation = rotations and Quaternion(rotations[4 * i : 4 * i + 4])
+            scale = scales and Vector(scales[3 * i : 3 * i + 3])
+            tTrack.frames.append(TFrame(frameTime, position, rotation, scale))
+        tAnimation.tracks.append(tTrack)
+    return tAnimation
+
+#---------------------
+# Export data classes
+#---------------------
+
+class TData:
+    def __init__(self):
+        self.objectName = None
+        self.blenderObjectName = None
+        # List of all the TVertex of all the geometries
+        self.verticesList = []
+        # List of TGeometry, they contains triangles, triangles are made of vertex indices
+        self.geometriesList = []
+        # List of TMorph: a subset of the vertices list with modified position
+        self.morphsList = []
+        # List of TMaterial
+        self.materialsList = []
+        # Material name to geometry index map
+        self.materialGeometryMap = {}
+        # Ordered dictionary of TBone: bone name to TBone
+        self.bonesMap = OrderedDict()
+        # List of TAnimation
+        self.animationsList = []
+        # Dictionary container for errors
+        self.errorsDict = {}
+        # A map which stores whether or not a material is being used by an exported mesh
+        self.materialsUsed = {}
+        # List of tasks which don't need Blender data (tangents, indices optimization), 
+        # they are postponed so they can run in another process: tuple(function, arguments)
+        self.postponedTasks = []
+        # Time and counters of the export stages (telemetry.ObjectStats) or None
+        self.stats = None
+        
+    # Blender materials cannot be pickled, materialsUsed is only needed by Scan
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['materialsUsed']
+        return state
+
+    def MarkUsedMaterials(self, object, mesh):
+        """mark materials used in the given object as being in use."""
+        for slot in object.material_slots:
+            # if the material in the slot is valid...
+            if slot.material:
+                self.materialsUsed[slot.material] = True
+
+           
+class TOptions:
+    def __init__(self):
+        self.lodUpdatedGeometryIndices = set()
+        self.lodDistance = None
+        self.doForceElements = False
+        self.mergeObjects = False
+        self.mergeNotMaterials = False
+        self.useLods = False
+        self.onlySelected = False
+        # Names of the objects to export, with the objects exported together with them
+        # (None: all the objects)
+        self.onlyObjects = None
+        self.scale = 1.0
+        self.globalOrigin = True
+        self.bonesGlobalOrigin = False  #useless
+        self.actionsGlobalOrigin = False
+        self.applyModifiers = False
+        self.applySettings = 'PREVIEW'
+        self.doBones = True
+        self.doOnlyKeyedBones = False
+        self.doOnlyDeformBones = False
+        self.doOnlyVisibleBones = False
+        self.derigifyArmature = False
+        self.doAnimations = True
+        self.doAllActions = True
+        self.doUsedActions = False
+        self.doSelectedStrips = False
+        self.doSelectedTracks = False
+        self.doStrips = False
+        self.doTracks = False
+        self.doTimeline = False
+        self.doAnimationPos = True
+        self.doAnimationRot = True
+        self.doAnimationSca = True
+        # Remove the keyframes which can be interpolated within these tolerances 
+        # (position and scale in Urho units, rotation in radians)
+        self.doReduceKeyframes = False
+        self.reducePosTolerance = 0.001
+        self.reduceRotTolerance = math.radians(0.1)
+        self.reduceScaTolerance = 0.001
+        # Background Blender processes baking the animations (0 or 1: bake them in this
+        # process), the .blend file must be saved
+        self.bakeProcesses = 0
+        self.doGeometries = True
+        self.doGeometryPos = True
+        self.doGeometryNor = True
+        self.doGeometryCol = True
+        self.doGeometryColAlpha = False
+        self.doGeometryUV  = True
+        self.doGeometryUV2 = False
+        self.doGeometryTan = True
+        self.doGeometryWei = True
+        self.doMorphs = True
+        self.doMorphNor = True
+        self.doMorphTan = True
+        self.doMorphUV = True
+        self.doOptimizeIndices = True
+        self.doMaterials = True
+        # Folder of the decomposition cache (None: don't use the cache)
+        self.cachePath = None
+        # Max size of the cache folder in bytes
+        self.cacheSize = 1024 * 1024 * 1024
+        
+
+#--------------------
+# “Computing Tangent Space Basis Vectors for an Arbitrary Mesh” by Lengyel, Eric. 
+# Terathon Software 3D Graphics Library, 2001.
+# http://www.terathon.com/code/tangent.html
+#--------------------
+        
+# The same function works on LODs and morphs: tVertexList can be the list of all
+# the TVertex (LODs) or the map vertex index to TVertex (morphs). The vertex data
+# is copied in flat lists of floats, then tangents are accumulated and orthogonalized
+# without creating a Vector for each triangle.
+def GenerateTangents(tLodLevels, tVertexList, invalidUvIndices):
+
+    if not tVertexList:
+        log.warning("No vertices, tangent generation cancelled.")
+        return
+
+    # Skip empty LODs
+    lodLevels = []
+    for tLodLevel in tLodLevels:
+        if not tLodLevel.indexSet or not tLodLevel.triangleList:
+            log.warning("Empty LOD, tangent generation skipped.")
+            continue
+        lodLevels.append(tLodLevel)
+
+    # Map each vertex index used by the LODs to its position in the flat lists 
+    # (a vertex can be shared by more LODs but we calculate it only once)
+    slotMap = {}
+    vertices = []
+    for tLodLevel in lodLevels:
+        for vertexIndex in tLodLevel.indexSet:
+            if vertexIndex not in slotMap:
+                slotMap[vertexIndex] = len(vertices)
+                vertices.append(tVertexList[vertexIndex])
+
+    # Check if we have all the needed data to do the calculations
+    tangentOverwritten = 0    
+    for vertex in vertices:
+        # Check if the tangent was already calculated (4 components) for this vertex and we're overwriting it
+        if vertex.tangent and len(vertex.tangent) == 4:
+            tangentOverwritten += 1
+        
+        if vertex.pos is None:
+            if invalidUvIndices is not None:
+                invalidUvIndices.add(vertex.blenderIndex)
+            log.warning("Missing position on vertex {:d}, tangent generation cancelled.".format(vertex.blenderIndex))
+            return
+        if vertex.normal is None:
+            if invalidUvIndices is not None:
+                invalidUvIndices.add(vertex.blenderIndex)
+            log.warning("Missing normal on vertex {:d}, tangent generation cancelled.".format(vertex.blenderIndex))
+            return
+        if vertex.uv is None:
+            if invalidUvIndices is not None:
+                invalidUvIndices.add(vertex.blenderIndex)
+            log.warning("Missing UV on vertex {:d}, tangent generation cancelled.".format(vertex.blenderIndex))
+            return
+
+    if tangentOverwritten:
+        log.warning("Overwriting {:d} tangents".format(tangentOverwritten))
+
+    # Flat lists of positions (x,y,z) and UV (u,v) of the vertices
+    positions = []
+    uvs = []
+    for vertex in vertices:
+        positions.extend(vertex.pos)
+        uvs.extend(vertex.uv)
+
+    # Sum of the tangents and bitangents of the triangles using each vertex, 
+    # stored as 32 bits floats like the Vector they will become
+    count = 3 * len(vertices)
+    tangents = array.array('f', bytes(4 * count))
+    bitangents = array.array('f', bytes(4 * count))
+    # Tangent and bitangent of a triangle
+    triangleTangent = array.array('f', bytes(12))
+    triangleBitangent = array.array('f', bytes(12))
+
+    # Calculate tangent and bitangent
+    invalidUV = False
+    for tLodLevel in lodLevels:
+        for triangle in tLodLevel.triangleList:
+            # For each triangle, we have 3 vertices vertex1, vertex2, vertex3, each of the have their UV coordinates, we want to 
+            # find two unit orthogonal vectors (tangent and bitangent) such as we can express each vertex position as a function
+            # of the vertex UV: 
+            #  VertexPosition = Tangent * f'(VertexUV) + BiTangent * f"(VertexUV)
+            # Actually we are going to express them relatively to a vertex choosen as origin (vertex1):
+            #  vertex - vertex1 = Tangent * (vertex.u - vertex1.u) + BiTangent * (vertex.v - vertex1.v)
+            # We have two equations, one for vertex2-vertex1 and one for vertex3-vertex1, if we put them in a system and solve it
+            # we can obtain Tangent and BiTangent:
+            #  [T; B] = [u1, v1; u2, v2]^-1 * [V2-V1; V3-V1]
+
+            slot1 = slotMap[triangle[0]]
+            slot2 = slotMap[triangle[1]]
+            slot3 = slotMap[triangle[2]]
+            p1 = 3 * slot1
+            p2 = 3 * slot2
+            p3 = 3 * slot3
+
+            # First equation: [x1, y1, z1] = Tangent * u1 + BiTangent * v1
+            x1 = positions[p2] - positions[p1]
+            y1 = positions[p2+1] - positions[p1+1]
+            z1 = positions[p2+2] - positions[p1+2]
+
+            u1 = uvs[2*slot2] - uvs[2*slot1]
+            v1 = uvs[2*slot2+1] - uvs[2*slot1+1]
+
+            # Second equation: [x2, y2, z2] = Tangent * u2 + BiTangent * v2
+            x2 = positions[p3] - positions[p1]
+            y2 = positions[p3+1] - positions[p1+1]
+            z2 = positions[p3+2] - positions[p1+2]
+
+            u2 = uvs[2*slot3] - uvs[2*slot1]
+            v2 = uvs[2*slot3+1] - uvs[2*slot1+1]
+
+            # Determinant of the matrix [u1 v1; u2 v2]
+            d = u1 * v2 - u2 * v1
+            
+            # If the determinant is zero then the points (0,0), (u1,v1), (u2,v2) are in line, this means
+            # the area on the UV map of this triangle is null. This is an error, we must skip this triangle.
+            if d == 0:
+                if invalidUvIndices is not None:
+                    invalidUvIndices.add(vertices[slot1].blenderIndex)
+                    invalidUvIndices.add(vertices[slot2].blenderIndex)
+                    invalidUvIndices.add(vertices[slot3].blenderIndex)
+                invalidUV = True
+                continue
+
+            triangleTangent[0] = (v2 * x1 - v1 * x2) / d
+            triangleTangent[1] = (v2 * y1 - v1 * y2) / d
+            triangleTangent[2] = (v2 * z1 - v1 * z2) / d
+            
+            triangleBitangent[0] = (u1 * x2 - u2 * x1) / d
+            triangleBitangent[1] = (u1 * y2 - u2 * y1) / d
+            triangleBitangent[2] = (u1 * z2 - u2 * z1) / d
+
+            for p in (p1, p2, p3):
+                tangents[p] += triangleTangent[0]
+                tangents[p+1] += triangleTangent[1]
+                tangents[p+2] += triangleTangent[2]
+                bitangents[p] += triangleBitangent[0]
+                bitangents[p+1] += triangleBitangent[1]
+                bitangents[p+2] += triangleBitangent[2]
+
+    if invalidUV:
+        log.error("Invalid UV, the area in the UV map is too small.")
+
+    # Gram-Schmidt orthogonalize normal, tangent and bitangent
+    for slot, vertex in enumerate(vertices):
+        p = 3 * slot
+        tx, ty, tz = tangents[p : p+3]
+        nx, ny, nz = vertex.normal
+
+        # Unit vector perpendicular to normal and in the same plane of normal and tangent
+        dot = nx * tx + ny * ty + nz * tz
+        ox = tx - nx * dot
+        oy = ty - ny * dot
+        oz = tz - nz * dot
+        length = math.sqrt(ox * ox + oy * oy + oz * oz)
+        if length:
+            ox /= length
+            oy /= length
+            oz /= length
+
+        # Unit vector perpendicular to the plane of normal and tangent
+        bx = ny * tz - nz * ty
+        by = nz * tx - nx * tz
+        bz = nx * ty - ny * tx
+        length = math.sqrt(bx * bx + by * by + bz * bz)
+        if length:
+            bx /= length
+            by /= length
+            bz /= length
+
+        # Calculate handedness: if bOrtho and bitangent have the different directions, save the verse
+        # in tangent.w, so we can reconstruct bitangent by: tangent.w * normal.cross(tangent)
+        dot = bx * bitangents[p] + by * bitangents[p+1] + bz * bitangents[p+2]
+        w = 1.0 if dot >= 0.0 else -1.0
+
+        vertex.bitangent = Vector((bx, by, bz))
+        vertex.tangent = Vector((ox, oy, oz, w))
+
+
+        
+#--------------------
+# Linear-Speed Vertex Cache Optimisation algorithm by Tom Forsyth
+#  https://home.comcast.net/~tom_forsyth/papers/fast_vert_cache_opt.html
+#--------------------
+
+# This version runs in linear time: it keeps everything in flat lists of
+# integers indexed by vertex or triangle, it uses precomputed score tables and,
+# for each vertex, the list of the triangles still to be drawn.
+
+#  We try to sort triangles in the index buffer so that we gain an optimal use
+#  of the hardware vertices cache.
+#  We assign a score to each triangle, we find the best and save it in a new 
+#  ordered list.
+#  The score of each triangle is the sum of the score of its vertices, and the
+#  score of a vertex is higher if it is:
+#  - used recently (it is still in the cache) but we also try to avoid the last
+#    triangle added (n this way we get better result),
+#  - lonely isolated vertices (otherwise the will be keep for last and drawing
+#    them will require an higher cost)
+#  The order of vertices in the triangle does not matter.
+#  We'll apply this optimization to each lod of each geometry.
+
+# These are the constants used in the algorithm:
+VERTEX_CACHE_SIZE = 32
+CACHE_DECAY_POWER = 1.5
+LAST_TRI_SCORE = 0.75
+VALENCE_BOOST_SCALE = 2.0
+VALENCE_BOOST_POWER = 0.5
+# Vertices used by more triangles than this don't use the valence table
+VALENCE_TABLE_SIZE = 64
+
+def CacheScore(cachePosition):
+
+    if cachePosition < 0:
+        # Vertex is not in FIFO cache - no score
+        return 0.0
+
+    if cachePosition < 3:
+        # This vertex was used in the last triangle,
+        # so it has a fixed score, whichever of the three
+        # it's in. Otherwise, you can get very different
+        # answers depending on whether you add
+        # the triangle 1,2,3 or 3,1,2 - which is silly.
+        return LAST_TRI_SCORE
+
+    # Points for being high in the cache
+    score = 1.0 - float(cachePosition - 3) / (VERTEX_CACHE_SIZE - 3)
+    return pow(score, CACHE_DECAY_POWER)
+
+def ValenceScore(useCount):
+
+    # Bonus points for having a low number of tris still to
+    # use the vert, so we get rid of lone verts quickly
+    return VALENCE_BOOST_SCALE * pow(useCount, -VALENCE_BOOST_POWER)
+
+# Score by cache position, the last item (index -1) is the score of a vertex
+# not in the cache
+CACHE_SCORE_TABLE = [CacheScore(i) for i in range(VERTEX_CACHE_SIZE)] + [CacheScore(-1)]
+# Score by number of triangles still using the vertex (zero is never used)
+VALENCE_SCORE_TABLE = [0.0] + [ValenceScore(i) for i in range(1, VALENCE_TABLE_SIZE)]
+
+def CalculateScore(cachePosition, useCount):
+
+    # The vertex is not used anymore
+    if useCount == 0:
+        return -1.0
+
+    if useCount < VALENCE_TABLE_SIZE:
+        return CACHE_SCORE_TABLE[cachePosition] + VALENCE_SCORE_TABLE[useCount]
+    return CACHE_SCORE_TABLE[cachePosition] + ValenceScore(useCount)
+
+def OptimizeIndices(lodLevel):
+
+    oldIndices = lodLevel.triangleList.indices
+    trianglesCount = len(oldIndices) // 3
+    if not trianglesCount:
+        return
+
+    # Vertex indices are indices in the whole TData vertices list, we remap
+    # them to 0..verticesCount-1 so we can store vertex data in flat lists.
+    # 'indices' is the flat list of the triangles remapped vertex indices: the
+    # triangle 't' uses indices[3*t], indices[3*t+1], indices[3*t+2]
+    vertexRemap = {}
+    indices = []
+    for vertexIndex in oldIndices:
+        try:
+            indices.append(vertexRemap[vertexIndex])
+        except KeyError:
+            newIndex = len(vertexRemap)
+            vertexRemap[vertexIndex] = newIndex
+            indices.append(newIndex)
+    verticesCount = len(vertexRemap)
+
+    # For each vertex count how many triangles (not yet drawn) are using it
+    # (we can find the same vertex index more than once)
+    useCount = [0] * verticesCount
+    for vertexIndex in indices:
+        useCount[vertexIndex] += 1
+
+    # Adjacency: the triangles using the vertex 'v' are stored in
+    # adjacency[adjacencyStart[v] : adjacencyStart[v] + useCount[v]]; when a
+    # triangle is drawn we move it after the end of this range, so the range
+    # always contains only the triangles still to be drawn
+    adjacencyStart = [0] * (verticesCount + 1)
+    for vertexIndex in range(verticesCount):
+        adjacencyStart[vertexIndex + 1] = adjacencyStart[vertexIndex] + useCount[vertexIndex]
+    adjacencyFill = adjacencyStart[:verticesCount]
+    adjacency = [0] * len(indices)
+    for i, vertexIndex in enumerate(indices):
+        adjacency[adjacencyFill[vertexIndex]] = i // 3
+        adjacencyFill[vertexIndex] += 1
+
+    # Score of each vertex
+    vertexScore = [CalculateScore(-1, count) for count in useCount]
+    # Flag for the triangles already moved to the new list
+    triangleDrawn = bytearray(trianglesCount)
+
+    # Ths list will contain the triangles sorted in optimal order, we fill
+    # its index array directly
+    newTriangles = TTriangleList()
+    newIndices = newTriangles.indices
+
+    # Cache of vertex indices
+    vertexCache = []
+
+    # Scan all the triangles and start from the best one, the score of a triangle
+    # is the sum of its vertices scores
+    bestTriangle = max(range(trianglesCount), key = lambda t: 
+        vertexScore[indices[3*t]] + vertexScore[indices[3*t+1]] + vertexScore[indices[3*t+2]])
+
+    # When no triangle in the cache can be drawn, we take the first triangle not yet
+    # drawn from the old list, this is its index
+    nextTriangle = 0
+
+    if DEBUG: ttt = time.time() #!TIME
+
+    while True:
+        if bestTriangle < 0:
+            # No triangle found using the vertices in the cache
+            while nextTriangle < trianglesCount and triangleDrawn[nextTriangle]:
+                nextTriangle += 1
+            if nextTriangle == trianglesCount:
+                break
+            bestTriangle = nextTriangle
+
+        # Move the best triangle to the output list
+        triangleDrawn[bestTriangle] = 1
+        newIndices.extend(oldIndices[3*bestTriangle : 3*bestTriangle+3])
+
+        bestVertices = indices[3*bestTriangle : 3*bestTriangle+3]
+
+        for vertexIndex in bestVertices:
+            # Remove the best triangle from the vertex adjacency range, swapping it
+            # with the last triangle of the range
+            start = adjacencyStart[vertexIndex]
+            last = start + useCount[vertexIndex] - 1
+            for j in range(start, last + 1):
+                if adjacency[j] == bestTriangle:
+                    adjacency[j] = adjacency[last]
+                    adjacency[last] = bestTriangle
+                    break
+            # Decrement the use counter of its vertices
+            useCount[vertexIndex] -= 1
+
+        # Model the LRU cache behaviour: move the vertices of the best triangle 
+        # to the front of the cache, the vertices pushed out of the cache are
+        # kept at the end of the list for the score update
+        newCache = []
+        for vertexIndex in reversed(bestVertices):
+            if vertexIndex not in newCache:
+                newCache.append(vertexIndex)
+        newCache.extend(i for i in vertexCache if i not in bestVertices)
+        vertexCache = newCache
+
+        # Update scores of all vertices in the cache, the position -1 gives
+        # no cache score
+        for position, vertexIndex in enumerate(vertexCache):
+            if position >= VERTEX_CACHE_SIZE:
+                # Vertex is going to be erased
+                position = -1
+            # Calculate the new score
+            count = useCount[vertexIndex]
+            if count == 0:
+                vertexScore[vertexIndex] = -1.0
+            elif count < VALENCE_TABLE_SIZE:
+                vertexScore[vertexIndex] = CACHE_SCORE_TABLE[position] + VALENCE_SCORE_TABLE[count]
+            else:
+                vertexScore[vertexIndex] = CACHE_SCORE_TABLE[position] + ValenceScore(count)
+
+        # Search the best triangle among the ones using the vertices in the cache,
+        # only these triangles have changed their score
+        bestTriangle = -1
+        bestScore = -1.0
+        for vertexIndex in vertexCache[:VERTEX_CACHE_SIZE]:
+            start = adjacencyStart[vertexIndex]
+            for triangleIndex in adjacency[start : start + useCount[vertexIndex]]:
+                i = 3 * triangleIndex
+                score = vertexScore[indices[i]] + vertexScore[indices[i+1]] + vertexScore[indices[i+2]]
+                if score > bestScore:
+                    bestScore = score
+                    bestTriangle = triangleIndex
+
+        # Finally erase the extra vertices
+        del vertexCache[VERTEX_CACHE_SIZE:]
+
+    if DEBUG: print("[TIME2] {:.4f}".format(time.time() - ttt) ) #!TIME
+
+    # Rewrite the index data now
+    lodLevel.triangleList = newTriangles
+
+#--------------------
+# Normals
+#--------------------
+
+# Calculates the normal of a tessface from a flat list of coordinates, the same way
+# Blender does: cross product of two edges for triangles, of the diagonals for quads
+def TessfaceNormal(coords, faceVertices):
+    if len(faceVertices) == 4:
+        i1, i2, i3, i4 = [3 * i for i in faceVertices]
+        ax, ay, az = coords[i1] - coords[i3], coords[i1+1] - coords[i3+1], coords[i1+2] - coords[i3+2]
+        bx, by, bz = coords[i2] - coords[i4], coords[i2+1] - coords[i4+1], coords[i2+2] - coords[i4+2]
+    else:
+        i1, i2, i3 = [3 * i for i in faceVertices]
+        ax, ay, az = coords[i1] - coords[i2], coords[i1+1] - coords[i2+1], coords[i1+2] - coords[i2+2]
+        bx, by, bz = coords[i2] - coords[i3], coords[i2+1] - coords[i3+1], coords[i2+2] - coords[i3+2]
+    nx = ay * bz - az * by
+    ny = az * bx - ax * bz
+    nz = ax * by - ay * bx
+    length = math.sqrt(nx * nx + ny * ny + nz * nz)
+    if length == 0.0:
+        return (0.0, 0.0, 0.0)
+    return (nx / length, ny / length, nz / length)
+
+# Calculates the normal of a vertex the same way Blender does: sum of the normals of 
+# the faces using the vertex, weighted by the angle of the face corner. Blender stores 
+# vertex normals as shorts, we do the same rounding.
+# vertexFaces: indices of the faces using the vertex
+# faceVertices: list of the vertex indices of every face
+# faceNormals: map face index to its normal
+def VertexNormal(coords, vertexIndex, vertexFaces, faceVertices, faceNormals):
+    i = 3 * vertexIndex
+    px, py, pz = coords[i], coords[i+1], coords[i+2]
+    nx = ny = nz = 0.0
+    for faceIndex in vertexFaces:
+        vertices = faceVertices[faceIndex]
+        k = vertices.index(vertexIndex)
+        # Edges from this corner to the previous and the next vertex of the face
+        i1 = 3 * vertices[k - 1]
+        i2 = 3 * vertices[(k + 1) % len(vertices)]
+        ax, ay, az = coords[i1] - px, coords[i1+1] - py, coords[i1+2] - pz
+        bx, by, bz = coords[i2] - px, coords[i2+1] - py, coords[i2+2] - pz
+        lengths = math.sqrt(ax * ax + ay * ay + az * az) * math.sqrt(bx * bx + by * by + bz * bz)
+        if lengths == 0.0:
+            continue
+        cosAngle = (ax * bx + ay * by + az * bz) / lengths
+        angle = math.acos(min(1.0, max(-1.0, cosAngle)))
+        fx, fy, fz = faceNormals[faceIndex]
+        nx += fx * angle
+        ny += fy * angle
+        nz += fz * angle
+    length = math.sqrt(nx * nx + ny * ny + nz * nz)
+    # Like Blender, if there are no valid faces use the vertex position as normal
+    if length == 0.0:
+        nx, ny, nz = px, py, pz
+        length = math.sqrt(nx * nx + ny * ny + nz * nz) or 1.0
+    return ( int(nx / length * 32767.0) / 32767.0,
+             int(ny / length * 32767.0) / 32767.0,
+             int(nz / length * 32767.0) / 32767.0 )
+
+#---------------------------------
+# Keyframes reduction
+#---------------------------------
+
+# Removes the keyframes of the tracks of an animation which can be reproduced, within the
+# tolerances of tOptions, by interpolating the kept keyframes (linear for position and 
+# scale, slerp for rotation, as Urho does). An error in a bone moves all its children:
+# each bone of a chain gets a part of the position tolerance, so the errors summed down 
+# the chain stay within the tolerance, and the rotation and scale tolerances are reduced
+# so that they don't move the farthest child more than the bone part.
+def ReduceKeyframes(tAnimation, bonesMap, tOptions):
+    tolerances = ChainTolerances(bonesMap, tOptions)
+    defaultTolerances = (tOptions.reducePosTolerance, tOptions.reduceRotTolerance, 
+                         tOptions.reduceScaTolerance)
+    for tTrack in tAnimation.tracks:
+        ReduceTrack(tTrack, *tolerances.get(tTrack.name, defaultTolerances))
+
+# Returns {bone name: (position, rotation, scale tolerance)} for the bones of a skeleton
+def ChainTolerances(bonesMap, tOptions):
+    # Depth of each bone in its chain (1 for roots), parents are before their children
+    depths = {}
+    for name, tBone in bonesMap.items():
+        depths[name] = depths.get(tBone.parentName, 0) + 1
+    # Bones in the longest chain below each bone and distance of the farthest child
+    heights = {}
+    reaches = {}
+    for name, tBone in reversed(list(bonesMap.items())):
+        parentName = tBone.parentName
+        if parentName in bonesMap:
+            heights[parentName] = max(heights.get(parentName, 0), heights.get(name, 0) + 1)
+            reach = reaches.get(name, 0.0) + tBone.bindPosition.length
+            reaches[parentName] = max(reaches.get(parentName, 0.0), reach)
+
+    tolerances = {}
+    for name in bonesMap:
+        chainLength = depths[name] + heights.get(name, 0)
+        posTolerance = tOptions.reducePosTolerance / chainLength
+        rotTolerance = tOptions.reduceRotTolerance
+        scaTolerance = tOptions.reduceScaTolerance
+        reach = reaches.get(name, 0.0)
+        if reach > 0.0:
+            rotTolerance = min(rotTolerance, posTolerance / reach)
+            scaTolerance = min(scaTolerance, posTolerance / reach)
+        tolerances[name] = (posTolerance, rotTolerance, scaTolerance)
+    return tolerances
+
+# Segments with more frames than this are split in their middle instead of at their worst
+# keyframe (see ReduceTrack)
+REDUCE_SEGMENT_FRAMES = 32
+
+# Removes the keyframes of a track which can be interpolated from the kept keyframes.
+# The first and last keyframes are always kept, a segment between two kept keyframes
+# is split at its worst keyframe until all its keyframes are within the tolerances.
+# Searching the worst keyframe of long segments again and again is quadratic on smooth
+# curves, so a segment longer than REDUCE_SEGMENT_FRAMES is only checked, stopping at 
+# the first keyframe not tolerated, and split in its middle: the work is linear in the
+# frames, static tracks are still reduced to their first and last keyframes.
+def ReduceTrack(tTrack, posTolerance, rotTolerance, scaTolerance):
+    frames = tTrack.frames
+    if len(frames) < 3:
+        return
+
+    # The interpolation is done on tuples of floats, much faster than with mathutils
+    times = [frame.time for frame in frames]
+    positions = [frame.position and tuple(frame.position) for frame in frames]
+    rotations = [frame.rotation and tuple(frame.rotation) for frame in frames]
+    scales = [frame.scale and tuple(frame.scale) for frame in frames]
+    # The angle between two rotations is 2*acos(dot): instead of computing the angle 
+    # we compare sqrt(1-dot) with its value at the tolerance (1-cos(x) = 2*sin(x/2)^2)
+    rotBound = math.sqrt(2.0) * math.sin(rotTolerance / 4.0)
+
+    # Returns the first keyframe of a segment not tolerated, or its worst keyframe 
+    # with 'worst', None if all the keyframes are tolerated
+    def CheckSegment(first, last, worst):
+        startTime = times[first]
+        duration = times[last] - startTime
+        slerp = rotations[first] and SlerpFactors(rotations[first], rotations[last])
+        worstIndex = None
+        worstError = 1.0
+        for i in range(first + 1, last):
+            t = (times[i] - startTime) / duration if duration > 0.0 else 0.0
+            error = 0.0
+            if positions[i] is not None:
+                distance = LerpDistance(positions[first], positions[last], t, positions[i])
+                error = InterpolationError(distance, posTolerance)
+            if rotations[i] is not None:
+                dot = SlerpDot(slerp, t, rotations[i])
+                error = max(error, InterpolationError(math.sqrt(max(1.0 - dot, 0.0)), rotBound))
+            if scales[i] is not None:
+                distance = LerpDistance(scales[first], scales[last], t, scales[i])
+                error = max(error, InterpolationError(distance, scaTolerance))
+            if error > worstError:
+                if not worst:
+                    return i
+                worstIndex = i
+                worstError = error
+        return worstIndex
+
+    keep = [False] * len(frames)
+    keep[0] = keep[-1] = True
+    segments = [(0, len(frames) - 1)]
+    while segments:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+        if last - first > REDUCE_SEGMENT_FRAMES:
+            if CheckSegment(first, last, False) is None:
+                continue
+            split = (first + last) // 2
+        else:
+            split = CheckSegment(first, last, True)
+            if split is None:
+                continue
+        keep[split] = True
+        segments.append((first, split))
+        segments.append((split, last))
+    tTrack.frames = list(itertools.compress(frames, keep))
+
+# Distance between the linear interpolation of the tuples a, b at t and the tuple c
+def LerpDistance(a, b, t, c):
+    dx = a[0] + (b[0] - a[0]) * t - c[0]
+    dy = a[1] + (b[1] - a[1]) * t - c[1]
+    dz = a[2] + (b[2] - a[2]) * t - c[2]
+    return math.sqrt(dx * dx + dy * dy + dz * dz)
+
+# Returns the data to interpolate the quaternions a, b (tuples w, x, y, z) with 
+# SlerpDot, along the shortest path as Urho does
+def SlerpFactors(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    if dot < 0.0:
+        b = tuple(-y for y in b)
+        dot = -dot
+    # Nearly equal rotations, a linear interpolation is enough
+    if dot > 0.9995:
+        return (a, b, None, None)
+    angle = math.acos(dot)
+    return (a, b, angle, math.sin(angle))
+
+# Absolute value of the dot product of the quaternion q with the spherical interpolation
+# at t of the quaternions of 'slerp' (see SlerpFactors)
+def SlerpDot(slerp, t, q):
+    a, b, angle, sinAngle = slerp
+    if angle is None:
+        ka = 1.0 - t
+        kb = t
+    else:
+        ka = math.sin((1.0 - t) * angle) / sinAngle
+        kb = math.sin(t * angle) / sinAngle
+    w = a[0] * ka + b[0] * kb
+    x = a[1] * ka + b[1] * kb
+    y = a[2] * ka + b[2] * kb
+    z = a[3] * ka + b[3] * kb
+    length = math.sqrt(w * w + x * x + y * y + z * z)
+    return min(abs(w * q[0] + x * q[1] + y * q[2] + z * q[3]) / length, 1.0)
+
+# Error relative to the tolerance: > 1.0 when the error is not tolerated
+def InterpolationError(error, tolerance):
+    if tolerance > 0.0:
+        return error / tolerance
+    return float("inf") if error > 0.0 else 0.0
+
+#---------------------------------
+# Steps
+#---------------------------------
+
+# The long functions have a generator version (named ...Steps) which yields the fraction
+# of the work done (0.0 to 1.0) from time to time, so the export can run in time slices 
+# without blocking the UI and it can be canceled closing the generator.
+
+# Runs a generator of steps to its end, returns the value returned by the generator
+def RunSteps(steps):
+    try:
+        while True:
+            next(steps)
+    except StopIteration as e:
+        return e.value
+
+# Runs a generator of steps and yields its fractions (0.0 to 1.0) scaled in the range 
+# start to start+size, returns the value returned by the generator
+def ScaleSteps(steps, start, size):
+    try:
+        while True:
+            yield start + size * next(steps)
+    except StopIteration as e:
+        return e.value
+    finally:
+        steps.close()
+
+#---------------------------------
+# Decompose geometries
+#---------------------------------
+
+# Faces decomposed between two steps of DecomposeGeometrySteps
+STEP_FACES = 2000
+
+# Creates the vertices, geometries and LODs of a mesh from its TMeshData, adds them to 
+# tData. Tangents and indices optimization are postponed (see CompleteDecomposition).
+# name: the mesh name for the log
+# Returns the map (face index, vertex index) to TVertex index, used by morphs.
+def DecomposeGeometry(tMeshData, tData, tOptions, errorsDict, name):
+    return RunSteps(DecomposeGeometrySteps(tMeshData, tData, tOptions, errorsDict, name))
+
+# Same as DecomposeGeometry but as a generator: every STEP_FACES faces it yields the 
+# fraction of the faces done (0.0 to 1.0), so the caller can split the work in time 
+# slices. The map of the faces is the return value of the generator (use 'yield from'
+# or RunSteps).
+def DecomposeGeometrySteps(tMeshData, tData, tOptions, errorsDict, name):
+
+    try:
+        invalidUvIndices = errorsDict["invalid UV"]
+    except KeyError:
+        invalidUvIndices = set()
+        errorsDict["invalid UV"] = invalidUvIndices
+
+    verticesList = tData.verticesList
+    geometriesList = tData.geometriesList
+    materialGeometryMap = tData.materialGeometryMap
+
+    # Map the elements of a vertex (a tuple of tuples) to its index in verticesList
+    verticesMap = {}
+
+    # Vertices map: vertex Blender index to TVertex index
+    faceVertexMap = {}
+
+    # Here we store geometriesList indices of geometries with new vertices in its last LOD
+    # We use this to create a new LOD only once per geometry and to filter where we have
+    # to optimize and recalculate tangents
+    updatedGeometryIndices = set()
+
+    facesCount = len(tMeshData.faceVertices)
+
+    # generate a geometry per material slot (material index == geometry index)
+    # we *can* end up creating some TGeometry for a material that isn't used,
+    # but the indices remain correct, so our material indices in URHO match
+    # the slot order in Blender (which is the primary motivation behind this quirk)
+    for i in range(tMeshData.materialsCount):
+        geometriesList.append(TGeometry())
+        geometryIndex = i
+        materialIndex = i
+        materialGeometryMap[geometryIndex] = materialIndex
+        log.info("New Geometry{:d} created for material {:d}".format(geometryIndex, materialIndex))
+
+    for faceIndex, faceVertices in enumerate(tMeshData.faceVertices):
+
+        if faceIndex % STEP_FACES == 0 and faceIndex:
+            yield faceIndex / facesCount
+
+        # Skip if this face has less than 3 unique vertices
+        # (a frozenset is an immutable set of unique elements)
+        if len(frozenset(faceVertices)) < 3: 
+            continue
+
+        if tMeshData.faceHidden[faceIndex]:
+            continue
+
+        # Get face vertices UV, flat lists of 8 floats
+        faceUv = tMeshData.uvs and tMeshData.uvs[8*faceIndex : 8*faceIndex+8]
+        faceUv2 = tMeshData.uvs2 and tMeshData.uvs2[8*faceIndex : 8*faceIndex+8]
+
+        # Get face 4 vertices colors, lists of 3 floats
+        fcol = tMeshData.colorsRgb
+        faceRgbColor = fcol and [c[3*faceIndex : 3*faceIndex+3] for c in fcol]
+        fcol = tMeshData.colorsAlpha
+        faceAlphaColor = fcol and [c[3*faceIndex : 3*faceIndex+3] for c in fcol]
+        
+        # we use the material index directly
+        materialIndex = tMeshData.faceMaterials[faceIndex]
+        geometryIndex = materialIndex
+
+        # Get the geometry associated to the material
+        geometry = geometriesList[geometryIndex]
+        
+        # Get the last LOD level, or add a new one if requested in the options
+        lodLevelIndex = len(geometry.lodLevels)
+        if not geometry.lodLevels or geometryIndex not in tOptions.lodUpdatedGeometryIndices:
+            tLodLevel = TLodLevel()
+            tLodLevel.distance = tOptions.lodDistance
+            geometry.lodLevels.append(tLodLevel)
+            tOptions.lodUpdatedGeometryIndices.add(geometryIndex)
+            log.info("New LOD{:d} created for material {:d}".format(lodLevelIndex, materialIndex))
+        else:
+            tLodLevel = geometry.lodLevels[-1]
+
+        # Add the index of the geometry we are going to update
+        updatedGeometryIndices.add(geometryIndex)
+
+        indexSet = tLodLevel.indexSet
+        triangleList = tLodLevel.triangleList
+            
+        # Here we store all the indices of the face, then we decompose it into triangles
+        tempList = []
+
+        # if face is smooth use vertex normal else use face normal
+        faceSmooth = tMeshData.faceSmooth[faceIndex]
+        faceNormal = tMeshData.faceNormals[faceIndex]
+
+        for i, vertexIndex in enumerate(faceVertices):
+            # i: vertex index in the face (0..2 tris, 0..3 quad)
+            # vertexIndex: vertex index in Blender buffer
+
+            # We collect all the vertex elements as tuples (None if missing), 
+            # they form the row we use to search for equal vertices
+
+            # Vertex position
+            position = None
+            if tOptions.doGeometryPos:
+                position = tMeshData.positions[vertexIndex]
+
+            # Vertex normal
+            normal = None
+            if tOptions.doGeometryNor:
+                if faceSmooth:
+                    normal = tMeshData.vertexNormals[vertexIndex]
+                else:
+                    normal = faceNormal
+                
+            # Vertex UV coordinates
+            uv = None
+            if tOptions.doGeometryUV:
+                if faceUv:
+                    uv = (faceUv[2*i], faceUv[2*i+1])
+                elif tOptions.doForceElements:
+                    uv = (0.0, 0.0)
+            uv2 = None
+            if tOptions.doGeometryUV2:
+                if faceUv2:
+                    uv2 = (faceUv2[2*i], faceUv2[2*i+1])
+                elif tOptions.doForceElements:
+                    uv2 = (0.0, 0.0)
+
+            # Vertex color
+            color = None
+            if tOptions.doGeometryCol or tOptions.doGeometryColAlpha:
+                if faceRgbColor or faceAlphaColor:
+                    color = [0, 0, 0, 255]
+                    if faceRgbColor:
+                        # This is an array of 3 floats from 0.0 to 1.0
+                        rgb = faceRgbColor[i]
+                        # Approx 255*float to the closest int
+                        color[:3] = ( int(round(rgb[0] * 255.0)), 
+                                      int(round(rgb[1] * 255.0)), 
+                                      int(round(rgb[2] * 255.0)) )
+                    if faceAlphaColor:
+                        # For Alpha use Value of HSV
+                        alpha = max(faceAlphaColor[i])
+                        color[3] = int(round(alpha * 255.0))
+                    color = tuple(color)
+                elif tOptions.doForceElements:
+                    color = (0, 0, 0, 255)
+                    
+            # Vertex bones weights
+            weights = None
+            if tOptions.doGeometryWei and tMeshData.vertexWeights:
+                weights = tMeshData.vertexWeights[vertexIndex]
+
+            # All this code do is "tVertexIndex = verticesList.index(tVertex)", but we use
+            # a map from the row of the vertex elements to the vertex index. Tuples are
+            # hashed and compared element by element, so only equal vertices are merged.
+            row = (position, normal, uv, uv2, color, weights)
+            
+            try:
+                tVertexIndex = verticesMap[row]
+            except KeyError:
+                # The vertex is new, create it and add it to the list and its index to the map
+                tVertex = TVertex()
+                tVertex.blenderIndex = vertexIndex
+                if position:
+                    tVertex.pos = Vector(position)
+                if normal:
+                    tVertex.normal = Vector(normal)
+                if uv:
+                    tVertex.uv = Vector(uv)
+                if uv2:
+                    tVertex.uv2 = Vector(uv2)
+                tVertex.color = color
+                if weights:
+                    tVertex.weights = list(weights)
+
+                tVertexIndex = len(verticesList)
+                verticesList.append(tVertex)
+                verticesMap[row] = tVertexIndex
+
+            # Add the vertex index to the temp list to create triangles later
+            tempList.append(tVertexIndex)
+                        
+            # Map Blender face index and Blender vertex index to our TVertex index (this is used later by Morphs)
+            faceVertexMap[(faceIndex, vertexIndex)] = tVertexIndex
+            
+            # Save every unique vertex this LOD is using
+            indexSet.add(tVertexIndex)
+
+            # Create triangles
+            if i == 2:
+                triangle = (tempList[0], tempList[2], tempList[1])
+                triangleList.append(triangle)
+
+            if i == 3:
+                triangle = (tempList[0], tempList[3], tempList[2])
+                triangleList.append(triangle)
+        # end loop vertices
+    # end loop faces
+
+    
+    # Generate tangents for the last LOD of every geometry with new vertices (postponed)
+    if tOptions.doGeometryTan:
+        lodLevels = []
+        for geometryIndex in updatedGeometryIndices:
+            geometry = geometriesList[geometryIndex]
+            # Only the last LOD was modified (even if it wasn't a new LOD)
+            lodLevel = geometry.lodLevels[-1]
+            log.info("Generating tangents on {:d} indices for {:s} Geometry{:d}"
+                    .format(len(lodLevel.indexSet), name, geometryIndex) )
+            lodLevels.append(lodLevel)
+        tData.postponedTasks.append( (GenerateTangents, (lodLevels, verticesList, invalidUvIndices)) )
+            
+    # Optimize vertex index buffer for the last LOD of every geometry with new vertices (postponed)
+    if tOptions.doOptimizeIndices:
+        for geometryIndex in updatedGeometryIndices:
+            geometry = geometriesList[geometryIndex]
+            # Only the last LOD was modified (even if it wasn't a new LOD)
+            lodLevel = geometry.lodLevels[-1]
+            log.info("Optimizing {:d} indices for {:s} Geometry{:d}"
+                    .format(len(lodLevel.indexSet), name, geometryIndex) )
+            tData.postponedTasks.append( (OptimizeIndices, (lodLevel,)) )
+
+    return faceVertexMap
+
+# Runs the postponed tasks of the decomposition, it doesn't use Blender data
+def CompleteDecomposition(tData):
+    RunSteps(CompleteDecompositionSteps(tData))
+
+# Same as CompleteDecomposition but as a generator: after each task it yields the 
+# fraction of the tasks done
+def CompleteDecompositionSteps(tData):
+    tasksCount = len(tData.postponedTasks)
+    for taskIndex, (function, arguments) in enumerate(tData.postponedTasks):
+        if tData.stats:
+            with tData.stats.timer(function.__name__):
+                function(*arguments)
+        else:
+            function(*arguments)
+        yield (taskIndex + 1) / tasksCount
+    tData.postponedTasks = []
+
+# Map Blender vertex index to the list of the faces using it
+def VertexFaces(tMeshData, verticesCount):
+    vertexFaces = [[] for i in range(verticesCount)]
+    for faceIndex, faceVertices in enumerate(tMeshData.faceVertices):
+        for vertexIndex in faceVertices:
+            vertexFaces[vertexIndex].append(faceIndex)
+    return vertexFaces
+
+# Decomposes a shape key of a mesh already decomposed by DecomposeGeometry, the morph
+# is added to tData. Tangents are postponed (see CompleteDecomposition).
+# faceVertexMap: returned by DecomposeGeometry
+# vertexFaces: the faces using each vertex (see VertexFaces)
+# baseCoords, coords: flat lists of the coordinates (x, y, z) of the mesh vertices and
+#                     of the shape vertices, in Blender space (Z up)
+# posMatrix, normalMatrix: the transformations used to create the TMeshData
+# name: the shape name
+def DecomposeShape(tMeshData, tData, tOptions, faceVertexMap, vertexFaces, baseCoords, coords, 
+                   posMatrix, normalMatrix, name):
+
+    verticesList = tData.verticesList
+    morphsList = tData.morphsList
+
+    tMorph = TMorph(name)
+
+    # Blender vertices moved by the shape: indices of the changed coordinates / 3
+    changedCoords = itertools.compress(itertools.count(), map(operator.ne, coords, baseCoords))
+    movedVertices = set(i // 3 for i in changedCoords)
+    
+    # Faces using a moved vertex have a new normal, and so the vertices of these faces
+    movedFaces = set()
+    for vertexIndex in movedVertices:
+        movedFaces.update(vertexFaces[vertexIndex])
+    normalVertices = set()
+    for faceIndex in movedFaces:
+        normalVertices.update(tMeshData.faceVertices[faceIndex])
+    # Faces around the vertices with a new normal, we need their normals to 
+    # recalculate the vertex normals
+    normalFaces = set()
+    for vertexIndex in normalVertices:
+        normalFaces.update(vertexFaces[vertexIndex])
+    
+    # Recalculate normals, convert them and the new positions from Z up to Y up
+    rawFaceNormals = {}
+    for faceIndex in normalFaces:
+        rawFaceNormals[faceIndex] = TessfaceNormal(coords, tMeshData.faceVertices[faceIndex])
+    positions = {}
+    for vertexIndex in movedVertices:
+        position = posMatrix * Vector(coords[3*vertexIndex : 3*vertexIndex+3])
+        positions[vertexIndex] = (position.x, position.z, position.y)
+    vertexNormals = {}
+    for vertexIndex in normalVertices:
+        normal = VertexNormal(coords, vertexIndex, vertexFaces[vertexIndex], 
+                              tMeshData.faceVertices, rawFaceNormals)
+        normal = normalMatrix * Vector(normal)
+        vertexNormals[vertexIndex] = (normal.x, normal.z, normal.y)
+    faceNormals = {}
+    for faceIndex in movedFaces:
+        normal = normalMatrix * Vector(rawFaceNormals[faceIndex])
+        faceNormals[faceIndex] = (normal.x, normal.z, normal.y)
+    
+    # Only these faces can have morphed vertices: faces with moved vertices and, if 
+    # we export normals, faces with vertices with a new normal
+    if tOptions.doMorphNor:
+        morphFaces = normalFaces
+    else:
+        morphFaces = movedFaces
+    
+    # TODO: if set use 'vertex group' of the shape to filter affected vertices
+    
+    for faceIndex in sorted(morphFaces):
+        faceVertices = tMeshData.faceVertices[faceIndex]
+
+        # Skip faces we didn't decompose (hidden or degenerate)
+        if (faceIndex, faceVertices[0]) not in faceVertexMap:
+            continue
+
+        # TODO: add only affected triangles not faces, use morphed as a mask
+        morphed = False
+
+        # In this list we store vertex index and morphed vertex of each face, we'll add them
+        # to the morph only if at least one vertex on the face is affected by the moprh
+        tempList = []
+        
+        # If face is smooth use vertex normal else use face normal
+        faceSmooth = tMeshData.faceSmooth[faceIndex]
+        faceNormal = faceNormals.get(faceIndex) or tMeshData.faceNormals[faceIndex]
+        
+        # For each Blender vertex index in the face
+        for vertexIndex in faceVertices:
+
+            # Get the TVertex index corresponding to this Blender vertex index
+            tVertexIndex = faceVertexMap[(faceIndex, vertexIndex)]
+
+            # Get the original not morphed TVertex
+            tVertex = verticesList[tVertexIndex]
+               
+            # Create a new morphed vertex
+            # (note: this vertex stores absolute values, not relative to original values)
+            tMorphVertex = TVertex()
+
+            # Set Blender index
+            tMorphVertex.blenderIndex = vertexIndex
+
+            # Set Vertex position
+            position = positions.get(vertexIndex) or tMeshData.positions[vertexIndex]
+            tMorphVertex.pos = Vector(position)
+
+            # Set Vertex normal
+            if tOptions.doMorphNor:
+                if faceSmooth:
+                    normal = vertexNormals.get(vertexIndex) or tMeshData.vertexNormals[vertexIndex]
+                else:
+                    normal = faceNormal
+                tMorphVertex.normal = Vector(normal)
+            
+            # If we have UV, copy them to the TVertex, we only need them to calculate tangents
+            if tOptions.doMorphUV:
+                if tVertex.uv:
+                    tMorphVertex.uv = tVertex.uv
+                elif tOptions.doForceElements:
+                    tMorphVertex.uv = Vector((0.0, 0.0))
+            
+            # Save vertex index and morphed vertex, to be added later if at least one
+            # vertex in the face was morphed
+            tempList.append((tVertexIndex, tMorphVertex))
+            
+            # Check if the morph has effect
+            if tMorphVertex.isMorphed(tVertex):
+                morphed = True
+        
+        # If at least one vertex in the face was morphed
+        if morphed:
+            # Add vertices to the morph
+            for i, (tVertexIndex, tMorphVertex) in enumerate(tempList):
+                try:
+                    # Check if already present
+                    oldTMorphVertex = tMorph.vertexMap[tVertexIndex]
+                    if tMorphVertex != oldTMorphVertex:
+                        log.error('Different vertex {:d} of face {:d} of shape {:s}.'
+                            .format(tMorphVertex.blenderIndex, faceIndex, name) )
+                        continue
+                except KeyError:
+                    # Add a new morph vertex
+                    tMorph.vertexMap[tVertexIndex] = tMorphVertex
+                    
+                # Save how many unique vertex this LOD is using (for tangents calculation)
+                tMorph.indexSet.add(tVertexIndex)
+
+                # Create triangles (for tangents calculation)
+                if i == 2:
+                    triangle = (tempList[0][0], tempList[2][0], tempList[1][0])
+                    tMorph.triangleList.append(triangle)
+
+                if i == 3:
+                    triangle = (tempList[0][0], tempList[3][0], tempList[2][0])
+                    tMorph.triangleList.append(triangle)
+                
+    if tOptions.doMorphTan:
+        log.info("Generating morph tangents {:s}".format(name) )
+        tData.postponedTasks.append( (GenerateTangents, ((tMorph,), tMorph.vertexMap, None)) )
+
+    # If valid add the morph to the model list
+    if tMorph.vertexMap:
+        morphsList.append(tMorph)
+    else:
+        log.warning('Empty shape {:s}.'.format(name))
+
+#--------------------
+# Input from arrays
+#--------------------
+
+# Creates a TMeshData from plain sequences (lists, arrays or NumPy arrays), for meshes
+# not read from Blender. All the data must be already in Urho space (Y up, left hand).
+# positions: (x, y, z) of each vertex
+# faces: 3 (triangle) or 4 (quad) vertex indices of each face, the triangles are made
+#        like in Blender (0,2,1 and 0,3,2), so the faces must be clockwise
+# normals: (x, y, z) of each vertex, if None the faces are flat
+# uvs, uvs2: (u, v) of each face corner, in the order of the faces (V=0 is the top)
+# colors: (r, g, b) or (r, g, b, a) of each face corner, from 0.0 to 1.0
+# weights: list of tuples (bone index, weight) of each vertex
+# materials: material index of each face (default 0)
+def MeshDataFromArrays(positions, faces, normals = None, uvs = None, uvs2 = None, 
+                       colors = None, weights = None, materials = None):
+
+    tMeshData = TMeshData()
+
+    tMeshData.positions = [tuple(float(x) for x in p) for p in positions]
+    tMeshData.faceVertices = [tuple(int(i) for i in f) for f in faces]
+    facesCount = len(tMeshData.faceVertices)
+
+    coords = [x for p in tMeshData.positions for x in p]
+    tMeshData.faceNormals = [TessfaceNormal(coords, f) for f in tMeshData.faceVertices]
+    if normals is not None:
+        tMeshData.vertexNormals = [tuple(float(x) for x in n) for n in normals]
+        tMeshData.faceSmooth = [True] * facesCount
+    else:
+        tMeshData.faceSmooth = [False] * facesCount
+    tMeshData.faceHidden = [False] * facesCount
+
+    if materials is not None:
+        tMeshData.faceMaterials = [int(m) for m in materials]
+        tMeshData.materialsCount = max(tMeshData.faceMaterials) + 1 if facesCount else 1
+    else:
+        tMeshData.faceMaterials = [0] * facesCount
+
+    # Face corners to the TMeshData format: 8 floats per face for UV, 4 lists (one per
+    # corner) of 3 floats per face for colors
+    def CornersUv(cornersUv):
+        values = array.array('f', [0.0] * (8 * facesCount))
+        corners = iter(cornersUv)
+        for faceIndex, faceVertices in enumerate(tMeshData.faceVertices):
+            for i in range(len(faceVertices)):
+                u, v = next(corners)
+                values[8*faceIndex + 2*i] = u
+                values[8*faceIndex + 2*i + 1] = v
+        return values
+
+    if uvs is not None:
+        tMeshData.uvs = CornersUv(uvs)
+    if uvs2 is not None:
+        tMeshData.uvs2 = CornersUv(uvs2)
+
+    if colors is not None:
+        rgb = [[0.0] * (3 * facesCount) for i in range(4)]
+        alpha = [[0.0] * (3 * facesCount) for i in range(4)]
+        hasAlpha = False
+        corners = iter(colors)
+        for faceIndex, faceVertices in enumerate(tMeshData.faceVertices):
+            for i in range(len(faceVertices)):
+                color = [float(x) for x in next(corners)]
+                rgb[i][3*faceIndex : 3*faceIndex+3] = color[:3]
+                # Alpha is read as a grey color
+                if len(color) > 3:
+                    alpha[i][3*faceIndex : 3*faceIndex+3] = [color[3]] * 3
+                    hasAlpha = True
+        tMeshData.colorsRgb = rgb
+        if hasAlpha:
+            tMeshData.colorsAlpha = alpha
+
+    if weights is not None:
+        tMeshData.vertexWeights = [tuple((int(b), float(w)) for b, w in vertexWeights) or None
+                                   for vertexWeights in weights]
+
+    return tMeshData
+
+# Adds bones to tData from plain sequences, for skeletons not read from Blender.
+# names: name of each bone
+# parents: index of the parent of each bone, -1 (or None) for root bones, parents 
+#          must come before their children
+# matrices: bind transformation of each bone in model space (Urho space), 4x4 rows
+def AddBones(tData, names, parents, matrices):
+    bonesMap = tData.bonesMap
+    bindMatrices = [Matrix([[float(x) for x in row] for row in m]) for m in matrices]
+    for name, parentIndex, matrix in zip(names, parents, bindMatrices):
+        parentName = None
+        localMatrix = matrix
+        if parentIndex is not None and parentIndex >= 0:
+            parentName = names[parentIndex]
+            # Transformation in parent bone space
+            localMatrix = bindMatrices[parentIndex].inverted() * matrix
+        tBone = TBone(len(bonesMap), parentName, localMatrix.to_translation(), 
+                      localMatrix.to_quaternion(), localMatrix.to_scale(), matrix)
+        if name in bonesMap:
+            log.critical("Bone {:s} already present in the map.".format(name))
+            continue
+        bonesMap[name] = tBone
@@ -39,747 +39,76 @@ import bpy
 import bmesh
 import math
 import time
-from mathutils import Vector, Matrix, Quaternion
+import array
+from mathutils import Vector, Matrix, Quaternion, Euler
 from collections import OrderedDict
 import os
-import operator
-import heapq
 import logging
 import re
+import pickle
+import shutil
+import tempfile
+import subprocess
 
-log = logging.getLogger("ExportLogger")
-
-#------------------
-# Geometry classes
-#------------------
-
-# Vertex class
-class TVertex:
-    def __init__(self):
-        # Index of the vertex in the Blender buffer
-        self.blenderIndex = None
-        # Position of the vertex: Vector((0.0, 0.0, 0.0))
-        self.pos = None
-        # Normal of the vertex: Vector((0.0, 0.0, 0.0))
-        self.normal = None
-        # Color of the vertex: (0, 0, 0, 0)...(255, 255, 255, 255)
-        self.color = None
-        # UV coordinates of the vertex: Vector((0.0, 0.0))..Vector((1.0, 1.0))
-        self.uv = None
-        # UV2 coordinates of the vertex: Vector((0.0, 0.0))..Vector((1.0, 1.0))
-        self.uv2 = None
-        # Tangent of the vertex: Vector((0.0, 0.0, 0.0, 0.0))
-        self.tangent = None
-        # Bitangent of the vertex: Vector((0.0, 0.0, 0.0))
-        self.bitangent = None
-        # Bones weights: list of tuple(boneIndex, weight)
-        self.weights = None
-
-    # returns True is this vertex is a changed morph of vertex 'other'
-    def isMorphed(self, other):
-        # TODO: compare floats with a epsilon margin?
-        if other.pos is None:
-            return True
-        if self.pos and self.pos != other.pos:
-            return True
-        if self.normal and self.normal != other.normal:
-            return True
-        # We cannot use tangent, it is not calculated yet
-        if self.uv and self.uv != other.uv:
-            return True
-        return False
-
-    # used by the function index() of lists
-    def __eq__(self, other):
-        # TODO: can we do without color and weights?
-        # TODO: compare floats with a epsilon margin?
-        #return (self.__dict__ == other.__dict__)
-        return (self.pos == other.pos and 
-                self.normal == other.normal and 
-                self.uv == other.uv)
-
-    def isEqual(self, other):
-        # TODO: compare floats with a epsilon margin?
-        return self == other
-                
-    def __hash__(self):
-        hashValue = 0
-        if self.pos:
-            hashValue ^= hash(self.pos.x) ^ hash(self.pos.y) ^ hash(self.pos.z)
-        if self.normal:
-            hashValue ^= hash(self.normal.x) ^ hash(self.normal.y) ^ hash(self.normal.z)
-        if self.uv:
-            hashValue ^= hash(self.uv.x) ^ hash(self.uv.y)
-        return hashValue
-    
-    def __str__(self):
-        s  = "  coords: {: .3f} {: .3f} {: .3f}".format(self.pos.x, self.pos.y, self.pos.z)
-        s += "\n normals: {: .3f} {: .3f} {: .3f}".format(self.normal.x, self.normal.y, self.normal.z)
-        if self.color:
-            s += "\n   color: {:3d} {:3d} {:3d} {:3d}".format(self.color[0], self.color[1], self.color[2], self.color[3])
-        if self.uv:
-            s += "\n      uv: {: .3f} {: .3f}".format(self.uv[0], self.uv[1])
-        if self.uv2:
-            s += "\n     uv2: {: .3f} {: .3f}".format(self.uv2[0], self.uv2[1])
-        if self.tangent:
-            s += "\n tangent: {: .3f} {: .3f} {: .3f}".format(self.tangent.x, self.tangent.y, self.tangent.z)
-        if self.weights:
-            s += "\n weights: "
-            for w in self.weights:
-                s += "{:d} {:.3f}  ".format(w[0],w[1])
-        return s
-
-# Geometry LOD level class
-class TLodLevel:
-    def __init__(self):
-        self.distance = 0.0
-        # Set of all vertex indices use by this LOD
-        self.indexSet = set()
-        # List of triangles of the LOD (triples of vertex indices)
-        self.triangleList = []
-
-    def __str__(self):  
-        s = "  distance: {:.3f}\n".format(self.distance)
-        s += "  triangles: "
-        for i, t in enumerate(self.triangleList):
-            if i and (i % 5) == 0:
-                s += "\n             "
-            s += "{:3d} {:3d} {:3d} |".format(t[0],t[1],t[2])
-        return s
-    
-# Geometry class
-class TGeometry:
-    def __init__(self):
-        # List of TLodLevel
-        self.lodLevels = []
-
-    def __str__(self):
-        s = ""
-        for i, l in enumerate(self.lodLevels):
-            s += " {:d}\n".format(i) + str(l)
-        return s
-
-#------------------
-# Morph classes
-#------------------
-
-class TMorph:
-    def __init__(self, name):
-        # Morph name
-        self.name = name
-        # Set of all vertex indices use by this morph
-        self.indexSet = set()
-        # List of triangles of the morph (triples of vertex indices)
-        self.triangleList = []
-        # Maps vertex index to morphed TVertex
-        self.vertexMap = {}
-
-    def __str__(self):  
-        s = " name: {:s}\n".format(self.name)
-        s += " Vertices: "
-        for k, v in sorted(self.vertices.items()):
-            s += "\n  index: {:d}".format(k)
-            s += "\n" + str(v)
-        return s
-
-#-------------------
-# Materials classes
-#-------------------
-
-# NOTE: in Blender images names are unique
-
-class TMaterial:
-    def __init__(self, name):
-        # Material name
-        self.name = name
-        # Diffuse color (0.0, 0.0, 0.0)
-        self.diffuseColor = None
-        # Diffuse intesity (0.0)
-        self.diffuseIntensity = None
-        # Specular color (0.0, 0.0, 0.0)
-        self.specularColor = None
-        # Specular intesity (0.0)
-        self.specularIntensity = None
-        # Specular hardness (1.0)
-        self.specularHardness = None
-        # Opacity (1.0) 
-        self.opacity = None
-        # Material is two sided
-        self.twoSided = False
-        # Diffuse color texture filename (no path)
-        self.diffuseTexName = None
-        # Normal texture filename (no path)
-        self.normalTexName = None
-        # Specular texture filename (no path)
-        self.specularTexName = None
-        # Emissive texture filename (no path)
-        self.lightmapTexName = None
-        # This material is shadeless
-        self.shadeless = False
-
-    def __eq__(self, other):
-        if hasattr(other, 'name'):
-            return (self.name == other.name)
-        return (self.name == other)
-
-    def __str__(self):  
-        return (" name: {:s}\n"
-                " image: \"{:s}\""
-                .format(self.name, self.diffuseTexName) )
-
-
-#--------------------
-# Animations classes
-#--------------------
-
-class TBone:    
-    def __init__(self, index, parentName, position, rotation, scale, transform):
-        # Position of the bone in the OrderedDict
-        self.index = index
-        # Name of the parent bone
-        self.parentName = parentName
-        # Bone position in the parent bone tail space (you first apply this)
-        self.bindPosition = position
-        # Bone rotation in the parent bone tail space (and then this)
-        self.bindRotation = rotation
-        # Bone scale
-        self.bindScale = scale
-        # Bone transformation in object space
-        self.worldTransform = transform
-
-    def __str__(self):
-        s = " bind pos " + str(self.bindPosition)
-        s += "\n bind rot " + str(self.bindRotation) #+ "\n" + str(self.bindRotation.to_axis_angle())
-        #s += "\n" + str(self.worldTransform.inverted())
-        s += "\n" + str(self.worldTransform)
-        return s
-
-class TFrame:
-    def __init__(self, time, position, rotation, scale):
-        self.time = time
-        self.position = position
-        self.rotation = rotation
-        self.scale = scale
-        
-    def hasMoved(self, other):
-        return (self.position != other.position or self.rotation != other.rotation or self.scale != other.scale)
-
-class TTrack:
-    def __init__(self, name):
-        self.name = name
-        self.frames = []
-
-class TAnimation:
-    def __init__(self, name):
-        self.name = name
-        self.tracks = []
-
-#---------------------
-# Export data classes
-#---------------------
-
-class TData:
-    def __init__(self):
-        self.objectName = None
-        self.blenderObjectName = None
-        # List of all the TVertex of all the geometries
-        self.verticesList = []
-        # List of TGeometry, they contains triangles, triangles are made of vertex indices
-        self.geometriesList = []
-        # List of TMorph: a subset of the vertices list with modified position
-        self.morphsList = []
-        # List of TMaterial
-        self.materialsList = []
-        # Material name to geometry index map
-        self.materialGeometryMap = {}
-        # Ordered dictionary of TBone: bone name to TBone
-        self.bonesMap = OrderedDict()
-        # List of TAnimation
-        self.animationsList = []
-        # Dictionary container for errors
-        self.errorsDict = {}
-        # A map which stores whether or not a material is being used by an exported mesh
-        self.materialsUsed = { material : False for material in bpy.data.materials }
-        
-    def MarkUsedMaterials(self, object, mesh):
-        """mark materials used in the given object as being in use."""
-        for slot in object.material_slots:
-            # if the material in the slot is valid...
-            if slot.material:
-                self.materialsUsed[slot.material] = True
-
-           
-class TOptions:
-    def __init__(self):
-        self.lodUpdatedGeometryIndices = set()
-        self.lodDistance = None
-        self.doForceElements = False
-        self.mergeObjects = False
-        self.mergeNotMaterials = False
-        self.useLods = False
-        self.onlySelected = False
-        self.scale = 1.0
-        self.globalOrigin = True
-        self.bonesGlobalOrigin = False  #useless
-        self.actionsGlobalOrigin = False
-        self.applyModifiers = False
-        self.applySettings = 'PREVIEW'
-        self.doBones = True
-        self.doOnlyKeyedBones = False
-        self.doOnlyDeformBones = False
-        self.doOnlyVisibleBones = False
-        self.derigifyArmature = False
-        self.doAnimations = True
-        self.doAllActions = True
-        self.doUsedActions = False
-        self.doSelectedStrips = False
-        self.doSelectedTracks = False
-        self.doStrips = False
-        self.doTracks = False
-        self.doTimeline = False
-        self.doAnimationPos = True
-        self.doAnimationRot = True
-        self.doAnimationSca = True
-        self.doGeometries = True
-        self.doGeometryPos = True
-        self.doGeometryNor = True
-        self.doGeometryCol = True
-        self.doGeometryColAlpha = False
-        self.doGeometryUV  = True
-        self.doGeometryUV2 = False
-        self.doGeometryTan = True
-        self.doGeometryWei = True
-        self.doMorphs = True
-        self.doMorphNor = True
-        self.doMorphTan = True
-        self.doMorphUV = True
-        self.doOptimizeIndices = True
-        self.doMaterials = True
-        
-
-#--------------------
-# “Computing Tangent Space Basis Vectors for an Arbitrary Mesh” by Lengyel, Eric. 
-# Terathon Software 3D Graphics Library, 2001.
-# http://www.terathon.com/code/tangent.html
-#--------------------
-        
-def GenerateTangents(tLodLevels, tVertexList, invalidUvIndices):
-
-    if not tVertexList:
-        log.warning("No vertices, tangent generation cancelled.")
-        return
-
-    # Init the values
-    tangentOverwritten = 0    
-    for tLodLevel in reversed(tLodLevels):
-        if not tLodLevel.indexSet or not tLodLevel.triangleList:
-            log.warning("Empty LOD, tangent generation skipped.")
-            tLodLevels.remove(tLodLevel)
-            continue
-        
-        for vertexIndex in tLodLevel.indexSet:
-            vertex = tVertexList[vertexIndex]
-            
-            # Check if the tangent was already calculated (4 components) for this vertex and we're overwriting it
-            if vertex.tangent and len(vertex.tangent) == 4:
-                tangentOverwritten += 1
-                
-            # Check if we have all the needed data to do the calculations
-            if vertex.pos is None:
-                invalidUvIndices.add(vertex.blenderIndex)
-                log.warning("Missing position on vertex {:d}, tangent generation cancelled.".format(vertex.blenderIndex))
-                return
-            if vertex.normal is None:
-                invalidUvIndices.add(vertex.blenderIndex)
-                log.warning("Missing normal on vertex {:d}, tangent generation cancelled.".format(vertex.blenderIndex))
-                return
-            if vertex.uv is None:
-                invalidUvIndices.add(vertex.blenderIndex)
-                log.warning("Missing UV on vertex {:d}, tangent generation cancelled.".format(vertex.blenderIndex))
-                return
-            
-            # Init tangent (3 components) and bitangent vectors
-            vertex.tangent = Vector((0.0, 0.0, 0.0))
-            vertex.bitangent = Vector((0.0, 0.0, 0.0))
-
-    if tangentOverwritten:
-        log.warning("Overwriting {:d} tangents").format(tangentOverwritten)
-
-    # Calculate tangent and bitangent
-    invalidUV = False
-    for tLodLevel in tLodLevels:
-        for i, triangle in enumerate(tLodLevel.triangleList):
-            # For each triangle, we have 3 vertices vertex1, vertex2, vertex3, each of the have their UV coordinates, we want to 
-            # find two unit orthogonal vectors (tangent and bitangent) such as we can express each vertex position as a function
-            # of the vertex UV: 
-            #  VertexPosition = Tangent * f'(VertexUV) + BiTangent * f"(VertexUV)
-            # Actually we are going to express them relatively to a vertex choosen as origin (vertex1):
-            #  vertex - vertex1 = Tangent * (vertex.u - vertex1.u) + BiTangent * (vertex.v - vertex1.v)
-            # We have two equations, one for vertex2-vertex1 and one for vertex3-vertex1, if we put them in a system and solve it
-            # we can obtain Tangent and BiTangent:
-            #  [T; B] = [u1, v1; u2, v2]^-1 * [V2-V1; V3-V1]
-            
-            vertex1 = tVertexList[triangle[0]]
-            vertex2 = tVertexList[triangle[1]]
-            vertex3 = tVertexList[triangle[2]]
-
-            # First equation: [x1, y1, z1] = Tangent * u1 + BiTangent * v1
-            x1 = vertex2.pos.x - vertex1.pos.x
-            y1 = vertex2.pos.y - vertex1.pos.y
-            z1 = vertex2.pos.z - vertex1.pos.z
-
-            u1 = vertex2.uv.x - vertex1.uv.x
-            v1 = vertex2.uv.y - vertex1.uv.y
-
-            # Second equation: [x2, y2, z2] = Tangent * u2 + BiTangent * v2
-            x2 = vertex3.pos.x - vertex1.pos.x
-            y2 = vertex3.pos.y - vertex1.pos.y
-            z2 = vertex3.pos.z - vertex1.pos.z
-
-            u2 = vertex3.uv.x - vertex1.uv.x
-            v2 = vertex3.uv.y - vertex1.uv.y
-
-            # Determinant of the matrix [u1 v1; u2 v2]
-            d = u1 * v2 - u2 * v1
-            
-            # If the determinant is zero then the points (0,0), (u1,v1), (u2,v2) are in line, this means
-            # the area on the UV map of this triangle is null. This is an error, we must skip this triangle.
-            if d == 0:
-                invalidUvIndices.add(vertex1.blenderIndex)
-                invalidUvIndices.add(vertex2.blenderIndex)
-                invalidUvIndices.add(vertex3.blenderIndex)
-                invalidUV = True
-                continue
-
-            t = Vector( ((v2 * x1 - v1 * x2) / d, (v2 * y1 - v1 * y2) / d, (v2 * z1 - v1 * z2) / d) )
-            b = Vector( ((u1 * x2 - u2 * x1) / d, (u1 * y2 - u2 * y1) / d, (u1 * z2 - u2 * z1) / d) )
-            
-            vertex1.tangent += t;
-            vertex2.tangent += t;
-            vertex3.tangent += t;
-            
-            vertex1.bitangent += b;
-            vertex2.bitangent += b;
-            vertex3.bitangent += b;
-
-    if invalidUV:
-        log.error("Invalid UV, the area in the UV map is too small.")
-
-    # Gram-Schmidt orthogonalize normal, tangent and bitangent
-    for tLodLevel in tLodLevels:
-        for vertexIndex in tLodLevel.indexSet:
-            vertex = tVertexList[vertexIndex]
-            # Skip already calculated vertices
-            if len(vertex.tangent) == 4:
-                continue
-                
-            # Unit vector perpendicular to normal and in the same plane of normal and tangent
-            tOrtho = ( vertex.tangent - vertex.normal * vertex.normal.dot(vertex.tangent) ).normalized()
-            # Unit vector perpendicular to the plane of normal and tangent
-            bOrtho = vertex.normal.cross(vertex.tangent).normalized()
-
-            # Calculate handedness: if bOrtho and bitangent have the different directions, save the verse
-            # in tangent.w, so we can reconstruct bitangent by: tangent.w * normal.cross(tangent)
-            w = 1.0 if bOrtho.dot(vertex.bitangent) >= 0.0 else -1.0
-            
-            vertex.bitangent = bOrtho
-            vertex.tangent = Vector((tOrtho.x, tOrtho.y, tOrtho.z, w))
-
-
-        
-#--------------------
-# Linear-Speed Vertex Cache Optimisation algorithm by Tom Forsyth
-#  https://home.comcast.net/~tom_forsyth/papers/fast_vert_cache_opt.html
-#--------------------
-
-# This is an optimized version, but it is still slow.
-# (on an average pc, 5 minutes for 30K smooth vertices)
-
-#  We try to sort triangles in the index buffer so that we gain an optimal use
-#  of the hardware vertices cache.
-#  We assign a score to each triangle, we find the best and save it in a new 
-#  ordered list.
-#  The score of each triangle is the sum of the score of its vertices, and the
-#  score of a vertex is higher if it is:
-#  - used recently (it is still in the cache) but we also try to avoid the last
-#    triangle added (n this way we get better result),
-#  - lonely isolated vertices (otherwise the will be keep for last and drawing
-#    them will require an higher cost)
-#  The order of vertices in the triangle does not matter.
-#  We'll apply this optimization to each lod of each geometry.
-
-# These are the constants used in the algorithm:
-VERTEX_CACHE_SIZE = 32
-CACHE_DECAY_POWER = 1.5
-LAST_TRI_SCORE = 0.75
-VALENCE_BOOST_SCALE = 2.0
-VALENCE_BOOST_POWER = 0.5
-
-def CalculateScore(rank):
-
-    if rank.useCount == 0:
-        rank.score = -1.0
-        return
-
-    score = 0.0
-    cachePosition = rank.cachePosition
-    
-    if cachePosition < 0:
-        # Vertex is not in FIFO cache - no score
-        pass
-    elif cachePosition < 3:
-        # This vertex was used in the last triangle,
-        # so it has a fixed score, whichever of the three
-        # it's in. Otherwise, you can get very different
-        # answers depending on whether you add
-        # the triangle 1,2,3 or 3,1,2 - which is silly.
-        score = LAST_TRI_SCORE
-    else:
-        # Points for being high in the cache
-        score = 1.0 - float(rank.cachePosition - 3) / (VERTEX_CACHE_SIZE - 3)
-        score = pow(score, CACHE_DECAY_POWER)
-
-    # Bonus points for having a low number of tris still to
-    # use the vert, so we get rid of lone verts quickly
-    valenceBoost = VALENCE_BOOST_SCALE * pow(rank.useCount, -VALENCE_BOOST_POWER);
-    rank.score = score + valenceBoost;
-
-# Triangles score list sizes
-TRIANGLERANK_SIZE = 500
-TRIANGLERANK_MAX_SIZE = 505
-
-def OptimizeIndices(lodLevel):
-    
-    # Ranks are used to store data for each vertex
-    class Rank:
-        def __init__(self):
-            self.score = 0.0
-            self.useCount = 1
-            self.cachePosition = -1
-    
-    # Create a map: vertex index to its corresponding Rank
-    ranking = {}
-    
-    # This list contains the original triangles (not in optimal order), we'll move them 
-    # one by one in a new list following the optimal order
-    oldTriangles = lodLevel.triangleList
-
-    # For each vertex index of each triangle increment the use counter
-    # (we can find the same vertex index more than once)
-    for triangle in oldTriangles:
-        for index in triangle:
-            try:
-                ranking[index].useCount += 1
-            except KeyError:
-                ranking[index] = Rank()
-
-    # Calculate the first round of scores
-    # (Rank is mutable, so CalculateScore will be able to modify it)
-    for rank in ranking.values():        
-        CalculateScore(rank)
-
-    # Ths list will contain the triangles sorted in optimal order
-    newTriangles = []
-
-    # Cache of vertex indices
-    vertexCache = []
-    
-    # The original algorithm was:
-    # - scan all the old triangles and find the one with the best score;
-    # - move it to the new triangles;
-    # - move its vertices in the cache;
-    # - recalculate the score on all the vertices on the cache.
-    # The slowest part is the first step, scanning all the old triangles,
-    # but in the last step we update only a little subset of these triangles,
-    # and it is a waste to recalculate the triangle score of each old triamgle.
-    # So we do this:
-    # - create a map 'trianglesMap': vertex index to triangles;
-    # - keep a list 'trianglesRanking' of the best triangles;
-    # - at first this list is empty, we start adding triangles; we add tuples like
-    #   (score, triangle) and we keep track of the min score, we don't add triangles
-    #   with score lower than the min; for now we add triangles without bothering
-    #   about order; if the triangle is already present in the list we only update
-    #   its score (even if it is lower);
-    # - when the list is a little too big (TRIANGLERANK_MAX_SIZE), we sort the list 
-    #   by score and we only keep the best TRIANGLERANK_SIZE triangles, we update 
-    #   the min score;
-    # - after scanning all the old triangles, we take out from the list the best
-    #   triangle;
-    # - move it to the new triangles and remove it from the map;
-    # - move its vertices in the cache;
-    # - recalculate the score on all the vertices in the cache, if the score of one
-    #   vertex is changed, we use the map to find what triangles are affected and
-    #   we add them to the list (unordered and only if their score is > min);
-    # - now when we repeat we have the list already populated, so we don't need to
-    #   recalculate all old triangles scores, we only need to sort the list and take
-    #   out the best triangle.
-
-        
-    # Vertex index to triangle indices list map
-    trianglesMap = {}
-    # Populate the map
-    for triangle in oldTriangles:
-        for vertexIndex in triangle:
-            try:
-                triangleList = trianglesMap[vertexIndex]
-            except KeyError:
-                triangleList = []
-                trianglesMap[vertexIndex] = triangleList
-            triangleList.append(triangle)
-
-    class TrianglesRanking:
-        def __init__(self):
-            self.ranklist = []
-            self.min = None
-            self.isSorted = True
-    
-        def update(self, triangle):            
-            # Sum the score of all its vertex. 
-            # >> This is the slowest part of the algorithm <<
-            triangleScore = ranking[triangle[0]].score + ranking[triangle[1]].score + ranking[triangle[2]].score
-            # If needed, add it to the list
-            if not self.ranklist:
-                self.ranklist.append( (triangleScore, triangle) )
-                self.min = triangleScore
-            else:
-                # We add only triangles with score > min
-                if triangleScore > self.min:
-                    found = False
-                    # Search of the triangle is already present in the list
-                    for i, rank in enumerate(self.ranklist):
-                        if triangle == rank[1]:
-                            if triangleScore != rank[0]:
-                                self.ranklist[i] = (triangleScore, triangle)
-                                self.isSorted = False
-                            found = True
-                            break
-                    # It is a new triangle
-                    if not found:
-                        self.ranklist.append( (triangleScore, triangle) )
-                        self.isSorted = False
-
-        def sort(self):
-            if self.isSorted:
-                return
-            #self.ranklist = sorted(self.ranklist, key=operator.itemgetter(0), reverse=True)[:TRIANGLERANK_SIZE]
-            self.ranklist = heapq.nlargest(TRIANGLERANK_SIZE, self.ranklist, key = operator.itemgetter(0))
-            self.min = self.ranklist[-1][0]
-            self.isSorted = True
-        
-        def popBest(self):
-            bestTriangle = self.ranklist[0][1]
-            del self.ranklist[0]
-            return bestTriangle
-
-    trianglesRanking = TrianglesRanking()
-
-    # Progress counter
-    progressCur = 0
-    progressTot = 0.01 * len(oldTriangles)
-
-    if DEBUG: ttt = time.time() #!TIME
-
-    # While there still are unsorted triangles
-    while oldTriangles:
-        # Print progress
-        if (progressCur & 0x7F) == 0:
-            print("{:.3f}%\r".format(progressCur / progressTot), end='' )
-        progressCur += 1
-        
-        # When the list is empty, we need to scan all the old triangles
-        if not trianglesRanking.ranklist:
-            for triangle in oldTriangles:
-                # We add the triangle but we don't search for the best one
-                trianglesRanking.update(triangle)
-                # If the list is too big, sort and truncate it
-                if len(trianglesRanking.ranklist) > TRIANGLERANK_MAX_SIZE:
-                    trianglesRanking.sort()
-
-        if trianglesRanking:
-            # Only if needed, we sort and truncate
-            trianglesRanking.sort()
-            # We take the best triangles out of the list
-            bestTriangle = trianglesRanking.popBest()
-        else:
-            log.error("Could not find next triangle")
-            return        
-        
-        # Move the best triangle to the output list
-        oldTriangles.remove(bestTriangle)
-        newTriangles.append(bestTriangle)
-            
-        # Model the LRU cache behaviour
-        # Recreate the cache removing the vertices of the best triangle
-        vertexCache = [i for i in vertexCache if i not in bestTriangle]
-        
-        for vertexIndex in bestTriangle:
-            # Then push them to the front
-            vertexCache.insert(0, vertexIndex)
-            # Decrement the use counter of its vertices
-            ranking[vertexIndex].useCount -= 1
-            # Remove best triangle from the map
-            triangleList = trianglesMap[vertexIndex]
-            triangleList.remove(bestTriangle)
-
-        # Update positions & scores of all vertices in the cache
-        # Give position -1 if vertex is going to be erased
-        for i, vertexIndex in enumerate(vertexCache):
-            rank = ranking[vertexIndex]
-            if (i > VERTEX_CACHE_SIZE):
-                rank.cachePosition = -1
-            else:
-                rank.cachePosition = i
-            # Calculate the new score
-            oldScore = rank.score
-            CalculateScore(rank)
-            # If the score is changed
-            if oldScore != rank.score:
-                # Add to the list all the triangles affected
-                triangleList = trianglesMap[vertexIndex]
-                for triangle in triangleList:   
-                    trianglesRanking.update(triangle)
-                
-        # Finally erase the extra vertices
-        vertexCache[:] = vertexCache[:VERTEX_CACHE_SIZE]
-
-    if DEBUG: print("[TIME2] {:.4f}".format(time.time() - ttt) ) #!TIME
-
-    # Rewrite the index data now
-    lodLevel.triangleList = newTriangles
+from .core import (TMeshData, TMaterial, TBone, TFrame, TTrack, TAnimation, TData, TOptions, 
+                   DecomposeGeometrySteps, VertexFaces, DecomposeShape, ReduceKeyframes, PackAnimation, 
+                   UnpackAnimation, RunSteps, ScaleSteps)
+from .cache import OpenCache, DecompositionKey, AnimationKey, Dumps, ANIMATION_CACHE_EXTENSION
+from .telemetry import ObjectStats
 
+log = logging.getLogger("ExportLogger")
 
 #--------------------
 # Decompose armatures
 #--------------------
 
-def SetRestPosePosition(context, armatureObj):
-    if not armatureObj:
-        return None
-        
-    # Force the armature in the rest position (warning: https://developer.blender.org/T24674)
-    # This should reset bones matrices ok, but for sure it is not resetting the mesh tessfaces
-    # positions
-    savedPosePosition = armatureObj.data.pose_position
-    armatureObj.data.pose_position = 'REST'
-    
-    # This should help to recalculate all the mesh vertices, it is needed by decomposeMesh
-    # and maybe it helps decomposeArmature (but no problem was seen there)
-    # TODO: find the correct way, for sure it is not this
-    objects = context.scene.objects
-    savedObjectActive = objects.active
-    objects.active = armatureObj
-    if bpy.ops.object.mode_set.poll():
-        bpy.ops.object.mode_set(mode='EDIT', toggle=False)
-    if bpy.ops.object.mode_set.poll():
-        bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
-    objects.active = savedObjectActive
-        
-    return savedPosePosition
-
-def RestorePosePosition(armatureObj, savedValue):
-    if not armatureObj:
-        return
-    armatureObj.data.pose_position = savedValue
+# Keeps the armatures in the rest position for the whole export. Each armature is
+# switched to REST once, when first needed, and restored once at the end. The mesh 
+# vertices are recalculated with a scene update (it was done with an EDIT/OBJECT mode 
+# toggle for each object, but the operators force full updates and undo pushes).
+# (warning: https://developer.blender.org/T24674)
+class RestPoseState:
+    def __init__(self, scene):
+        self.scene = scene
+        # Armature data name -> (armature data, pose position before the export)
+        self.saved = {}
+        # The scene must be updated before using the meshes
+        self.changed = False
+
+    def SetPosition(self, armatureObj, position):
+        armature = armatureObj.data
+        if armature.name not in self.saved:
+            self.saved[armature.name] = (armature, armature.pose_position)
+        if armature.pose_position != position:
+            armature.pose_position = position
+            self.changed = True
+
+    # Sets the armature in the rest position and updates the scene if needed
+    def Rest(self, armatureObj):
+        if armatureObj:
+            self.SetPosition(armatureObj, 'REST')
+        self.Update()
+
+    # Sets the armature in its position before the export (to sample the animations)
+    def Pose(self, armatureObj):
+        if armatureObj and armatureObj.data.name in self.saved:
+            armature, savedPosition = self.saved[armatureObj.data.name]
+            self.SetPosition(armatureObj, savedPosition)
+        self.Update()
+
+    def Update(self):
+        if self.changed:
+            self.scene.update()
+            self.changed = False
+
+    # Restores all the armatures
+    def Restore(self):
+        for armature, savedPosition in self.saved.values():
+            if armature.pose_position != savedPosition:
+                armature.pose_position = savedPosition
+                self.changed = True
+        self.saved.clear()
+        self.Update()
 
 def DerigifyArmature(armature):
 
@@ -890,15 +219,8 @@ def DerigifyArmature(armature):
 # else:
 #   poseMatrix = upAxis.matrix.inverted() * origin.matrix * poseMatrix  
 
-def DecomposeArmature(scene, armatureObj, meshObj, tData, tOptions):
-    
-    bonesMap = tData.bonesMap
-
-    # 'armature.pose.bones' contains bones data for the current frame
-    # 'armature.data.bones' contains bones data for the rest position (not true?)
-    armature = armatureObj.data
-
-    # Check that armature and children objects have scale, rotation applied and the same origin
+# Check that armature and children objects have scale, rotation applied and the same origin
+def CheckArmature(armatureObj, meshObj, tOptions):
     if armatureObj.scale != Vector((1.0, 1.0, 1.0)):
         log.warning('You should apply scale to armature {:s}'.format(armatureObj.name))
     if armatureObj.rotation_quaternion != Quaternion((1.0, 0.0, 0.0, 0.0)):
@@ -911,6 +233,16 @@ def DecomposeArmature(scene, armatureObj, meshObj, tData, tOptions):
         log.warning('Object {:s} should have the same origin as its armature {:s}'
                     .format(meshObj.name, armatureObj.name))
 
+def DecomposeArmature(scene, armatureObj, meshObj, tData, tOptions):
+    
+    bonesMap = tData.bonesMap
+
+    # 'armature.pose.bones' contains bones data for the current frame
+    # 'armature.data.bones' contains bones data for the rest position (not true?)
+    armature = armatureObj.data
+
+    CheckArmature(armatureObj, meshObj, tOptions)
+
     if not armature.bones:
         log.warning('Armature {:s} has no bones'.format(armatureObj.name))
         return
@@ -1010,42 +342,118 @@ def DecomposeArmature(scene, armatureObj, meshObj, tData, tOptions):
 # Decompose animations
 #--------------------
 
-def DecomposeActions(scene, armatureObj, tData, tOptions):
+# Data path of the F-curves of the pose bones channels: bone name, channel
+FCURVE_BONE_PATH = re.compile(r'pose\.bones\["(.+)"\]\.(\w+)$')
+
+# Samples the pose of a bone evaluating the F-curves of an action, without setting the 
+# frame. It can be used only for bones which pose relative to the parent depends only on 
+# their channels (see DirectBones).
+class FCurveBoneSampler:
+    def __init__(self, poseBone, channels, parentMatrix):
+        bone = poseBone.bone
+        # Rest matrix relative to the parent (or to the armature with parentMatrix)
+        if bone.parent:
+            self.restMatrix = bone.parent.matrix_local.inverted() * bone.matrix_local
+        else:
+            self.restMatrix = parentMatrix * bone.matrix_local
+        self.rotationMode = poseBone.rotation_mode
+        # F-curve (or None) of each component of each channel, with the value of an 
+        # identity matrix_basis for the components without F-curve
+        self.location = list(zip(channels.get('location', [None] * 3), (0.0, 0.0, 0.0)))
+        self.scale = list(zip(channels.get('scale', [None] * 3), (1.0, 1.0, 1.0)))
+        if self.rotationMode == 'QUATERNION':
+            self.rotation = zip(channels.get('rotation_quaternion', [None] * 4), (1.0, 0.0, 0.0, 0.0))
+        elif self.rotationMode == 'AXIS_ANGLE':
+            self.rotation = zip(channels.get('rotation_axis_angle', [None] * 4), (0.0, 0.0, 1.0, 0.0))
+        else:
+            self.rotation = zip(channels.get('rotation_euler', [None] * 3), (0.0, 0.0, 0.0))
+        self.rotation = list(self.rotation)
+
+    # Pose matrix relative to the parent at a frame
+    def matrix(self, time):
+        loc = [fcurve.evaluate(time) if fcurve else value for fcurve, value in self.location]
+        rot = [fcurve.evaluate(time) if fcurve else value for fcurve, value in self.rotation]
+        sca = [fcurve.evaluate(time) if fcurve else value for fcurve, value in self.scale]
+        if self.rotationMode == 'QUATERNION':
+            rotMatrix = Quaternion(rot).normalized().to_matrix().to_4x4()
+        elif self.rotationMode == 'AXIS_ANGLE':
+            axis = Vector(rot[1:])
+            if axis.length > 0.0:
+                rotMatrix = Matrix.Rotation(rot[0], 4, axis.normalized())
+            else:
+                rotMatrix = Matrix.Identity(4)
+        else:
+            rotMatrix = Euler(rot, self.rotationMode).to_matrix().to_4x4()
+        scaMatrix = Matrix.Identity(4)
+        scaMatrix[0][0], scaMatrix[1][1], scaMatrix[2][2] = sca
+        return self.restMatrix * Matrix.Translation(loc) * rotMatrix * scaMatrix
+
+# Returns the F-curves of the pose bones in an action, only for the bones which pose 
+# relative to their parent is fully determined by the action: no constraints, no drivers,
+# not moved by an IK chain, not connected to the parent and inheriting all its transformation.
+# The result is {bone name: {channel: [F-curve or None for each component]}}, bones 
+# without F-curves are included with an empty dict.
+def DirectBones(armatureObj, action):
+    poseBones = armatureObj.pose.bones
+    excluded = set()
+    for poseBone in poseBones:
+        bone = poseBone.bone
+        if poseBone.constraints or bone.use_connect or not bone.use_local_location \
+                or not bone.use_inherit_rotation or not bone.use_inherit_scale:
+            excluded.add(poseBone.name)
+        # IK moves the parents in the chain too (chain_count 0 is all the chain)
+        for constraint in poseBone.constraints:
+            if constraint.type in ('IK', 'SPLINE_IK'):
+                parent = poseBone.parent
+                count = constraint.chain_count - 1
+                while parent and count != 0:
+                    excluded.add(parent.name)
+                    parent = parent.parent
+                    count -= 1
+    animationData = armatureObj.animation_data
+    if animationData:
+        for driver in animationData.drivers:
+            mo = FCURVE_BONE_PATH.match(driver.data_path)
+            if mo:
+                excluded.add(mo.group(1))
 
-    # Class for storing a NlaStrip, its previous strip and its parent track
-    class NlaStripLink:
-        def __init__(self, strip, previous, track):
-            self.name = strip.name
-            self.strip = strip
-            self.previous = previous
-            self.track = track
-            
-    bonesMap = tData.bonesMap
-    animationsList = tData.animationsList
-    
-    if not armatureObj.animation_data:
-        log.warning('Armature {:s} has no animation data'.format(armatureObj.name))
-        return
-                        
-    originMatrix = Matrix.Identity(4)
-    if tOptions.actionsGlobalOrigin:
-        originMatrix = armatureObj.matrix_world
-        if tOptions.globalOrigin and originMatrix != Matrix.Identity(4):
-            # Blender moves/rotates the armature together with the mesh, so if you set a global origin
-            # for Mesh and Actions you'll have twice the transformations. Set only one global origin.
-            log.warning("Use local origin for the object otherwise trasformations are applied twice")
-    
-    # Save current action and frame, we'll restore them later
-    savedAction = armatureObj.animation_data.action
-    savedFrame = scene.frame_current
-    savedUseNla = armatureObj.animation_data.use_nla
-    
+    bonesChannels = {poseBone.name: {} for poseBone in poseBones if poseBone.name not in excluded}
+    for fcurve in action.fcurves:
+        mo = FCURVE_BONE_PATH.match(fcurve.data_path)
+        if not mo:
+            continue
+        channels = bonesChannels.get(mo.group(1))
+        if channels is None:
+            continue
+        channel = mo.group(2)
+        if channel == 'rotation_quaternion' or channel == 'rotation_axis_angle':
+            size = 4
+        elif channel in ('location', 'rotation_euler', 'scale'):
+            size = 3
+        else:
+            continue
+        components = channels.setdefault(channel, [None] * size)
+        if 0 <= fcurve.array_index < size:
+            components[fcurve.array_index] = fcurve
+    return bonesChannels
+
+# Class for storing a NlaStrip, its previous strip and its parent track
+class NlaStripLink:
+    def __init__(self, strip, previous, track):
+        self.name = strip.name
+        self.strip = strip
+        self.previous = previous
+        self.track = track
+
+# Returns the animation objects of an armature to export: NLA tracks, NlaStripLink, 
+# actions or the armature itself (for the timeline). The list is always in the same
+# order for the same Blender data.
+def AnimationObjects(armatureObj, tOptions):
     # Here we collect every animation objects we want to export
     animationObjects = []
 
     # Scan all the Tracks not muted of the armature
     for track in armatureObj.animation_data.nla_tracks:
-        track.is_solo = False
         if track.mute:
             continue
         # Add Track
@@ -1072,11 +480,108 @@ def DecomposeActions(scene, armatureObj, tData, tOptions):
     if tOptions.doTimeline:
         animationObjects.append(armatureObj)
 
+    return animationObjects
+
+# Returns the actions sampled by the animation objects of an armature (see AnimationObjects
+# and DecomposeAnimations), in the same order for the same Blender data
+def AnimationActions(armatureObj, tOptions):
+    actions = []
+    animationData = armatureObj.animation_data
+    if not animationData:
+        return actions
+
+    def AddAction(action):
+        if action and action not in actions:
+            actions.append(action)
+
+    for object in AnimationObjects(armatureObj, tOptions):
+        if isinstance(object, bpy.types.Action):
+            AddAction(object)
+        elif isinstance(object, NlaStripLink):
+            AddAction(object.strip.action)
+        elif isinstance(object, bpy.types.NlaTrack):
+            for strip in object.strips:
+                AddAction(strip.action)
+        else:
+            # Timeline: all the tracks, or the current action if there are no tracks
+            if not animationData.nla_tracks:
+                AddAction(animationData.action)
+            for track in animationData.nla_tracks:
+                for strip in track.strips:
+                    AddAction(strip.action)
+    return actions
+
+# Decomposes the animations of an armature. It is a generator: after each frame it yields
+# the fraction of the work done (0.0 to 1.0). It changes the current action, the NLA 
+# tracks, the frame and the pose of the armature, they are restored at the end even if 
+# the generator is closed before (export cancelled). With animationIndices only the 
+# animation objects at these indices (see AnimationObjects) are decomposed. With 
+# missingKeys (a dict) only the animations in the cache are loaded, the others are not
+# sampled and their cache keys are added to missingKeys by animation object index.
+def DecomposeActions(scene, armatureObj, tData, tOptions, animationIndices = None, missingKeys = None):
+
+    if not armatureObj.animation_data:
+        log.warning('Armature {:s} has no animation data'.format(armatureObj.name))
+        return
+
+    # Save current action and frame, we'll restore them later
+    animationData = armatureObj.animation_data
+    savedAction = animationData.action
+    savedFrame = scene.frame_current
+    savedUseNla = animationData.use_nla
+    # Save the solo of the tracks, the mute of the strips and the pose of the bones
+    savedSolo = [(track, track.is_solo) for track in animationData.nla_tracks]
+    savedMute = [(strip, strip.mute) for track in animationData.nla_tracks for strip in track.strips]
+    savedPose = [(poseBone, poseBone.matrix_basis.copy()) for poseBone in armatureObj.pose.bones]
+
+    try:
+        yield from DecomposeAnimations(scene, armatureObj, tData, tOptions, savedAction, animationIndices,
+                                       missingKeys)
+    finally:
+        # Restore initial pose, tracks, action and frame
+        for poseBone, matrix in savedPose:
+            poseBone.matrix_basis = matrix
+        for track, solo in savedSolo:
+            track.is_solo = solo
+        for strip, mute in savedMute:
+            strip.mute = mute
+        # (in action edit mode the action cannot be changed, then it is still the saved one)
+        if animationData.action != savedAction:
+            animationData.action = savedAction
+        animationData.use_nla = savedUseNla
+        scene.frame_set(savedFrame)
+
+# Generator used by DecomposeActions, savedAction is the action of the armature before 
+# the export
+def DecomposeAnimations(scene, armatureObj, tData, tOptions, savedAction, animationIndices, missingKeys):
+
+    bonesMap = tData.bonesMap
+    animationsList = tData.animationsList
+    
+    originMatrix = Matrix.Identity(4)
+    if tOptions.actionsGlobalOrigin:
+        originMatrix = armatureObj.matrix_world
+        if tOptions.globalOrigin and originMatrix != Matrix.Identity(4):
+            # Blender moves/rotates the armature together with the mesh, so if you set a global origin
+            # for Mesh and Actions you'll have twice the transformations. Set only one global origin.
+            log.warning("Use local origin for the object otherwise trasformations are applied twice")
+
+    for track in armatureObj.animation_data.nla_tracks:
+        track.is_solo = False
+    animationObjects = AnimationObjects(armatureObj, tOptions)
+
+    # Cache of the sampled animations
+    cache = None
+    if tOptions.cachePath:
+        cache = OpenCache(tOptions.cachePath, tOptions.cacheSize, ANIMATION_CACHE_EXTENSION)
+
     if not animationObjects:
         log.warning('Armature {:s} has no animation to export'.format(armatureObj.name))
         return
     
-    for object in animationObjects:
+    for animationIndex, object in enumerate(animationObjects):
+        if animationIndices is not None and animationIndex not in animationIndices:
+            continue
         tAnimation = TAnimation(object.name)
     
         # Frame when the animation starts
@@ -1187,15 +692,30 @@ def DecomposeActions(scene, armatureObj, tData, tOptions):
         if not bones:
             log.warning("No bones for animation {:s}".format(object.name))
             continue
+
+        # Search the animation in the cache (None: animation without tracks)
+        if cache:
+            cacheKey = AnimationKey(scene, armatureObj, type(object).__name__, object.name, 
+                                    startframe, endframe, actionSet, not isinstance(object, bpy.types.Action),
+                                    bones, bonesMap, tOptions)
+            cachedData = cache.load(cacheKey)
+            if cachedData:
+                data, = cachedData
+                if data:
+                    animationsList.append(UnpackAnimation(data))
+                RestoreAnimationObject(object, oldTrackValue, oldStripValue)
+                continue
+            if missingKeys is not None:
+                missingKeys[animationIndex] = cacheKey
+                RestoreAnimationObject(object, oldTrackValue, oldStripValue)
+                continue
         
         # Reset position/rotation/scale of each bone
         for poseBone in armatureObj.pose.bones:
             poseBone.matrix_basis = Matrix.Identity(4)
 
-        # Progress counter
-        progressCur = 0
-        progressTot = 0.01 * len(bones) * (endframe-startframe)/scene.frame_step
-    
+        # Collect the tracks to sample: (track, pose bone, parent pose bone)
+        tracksList = []
         for boneName in bones:
             if not boneName in bonesMap:
                 log.warning("Skeleton does not contain bone {:s}".format(boneName))
@@ -1205,31 +725,63 @@ def DecomposeActions(scene, armatureObj, tData, tOptions):
                 log.warning("Pose does not contain bone {:s}".format(boneName))
                 continue
             
-            tTrack = TTrack(boneName)
-            
             # Get the Blender pose bone (bpy.types.PoseBone)
             poseBone = armatureObj.pose.bones[boneName]
-            parent = poseBone.parent
-        
-            # For each frame
-            for time in range( startframe, endframe, scene.frame_step):
-                
-                if (progressCur % 10) == 0:
-                    print("{:.3f}%\r".format(progressCur / progressTot), end='' )
-                progressCur += 1
-                
-                # Set frame
+            tracksList.append( (TTrack(boneName), poseBone, poseBone.parent, None) )
+
+        # Root bones are relative to the armature, convert Z up to Y up. With the actions
+        # global origin the armature transform can be animated, then it is updated at 
+        # each frame.
+        rootMatrix = Matrix.Rotation(math.radians(-90.0), 4, 'X' ) * originMatrix
+
+        # An action alone can be sampled evaluating the F-curves of the bones which depend
+        # only on the action (not the root bones if the armature is the origin, its 
+        # transform can be animated)
+        if isinstance(object, bpy.types.Action):
+            bonesChannels = DirectBones(armatureObj, object)
+            for i, (tTrack, poseBone, parent, sampler) in enumerate(tracksList):
+                channels = bonesChannels.get(poseBone.name)
+                if channels is not None and (parent or not tOptions.actionsGlobalOrigin):
+                    sampler = FCurveBoneSampler(poseBone, channels, rootMatrix)
+                    tracksList[i] = (tTrack, poseBone, parent, sampler)
+        # The frame is set only if some bones need the scene evaluation
+        directCount = sum(1 for track in tracksList if track[3])
+        setFrame = directCount < len(tracksList)
+        if directCount:
+            log.info("Sampling {:d} of {:d} bones from the F-curves".format(directCount, len(tracksList)))
+
+        # For each frame: setting a frame evaluates the whole scene, so we set it
+        # only once and then we sample all the bones
+        for time in range( startframe, endframe, scene.frame_step):
+            
+            yield (animationIndex + (time - startframe) / (endframe - startframe)) / len(animationObjects)
+            
+            # Set frame
+            if setFrame:
                 scene.frame_set(time)
+                if tOptions.actionsGlobalOrigin:
+                    rootMatrix = Matrix.Rotation(math.radians(-90.0), 4, 'X' ) * armatureObj.matrix_world
             
-                # This matrix is referred to the armature (object space)
-                poseMatrix = poseBone.matrix.copy()
-
-                if parent:
+            # Inverted matrices of the parent bones in this frame, a parent
+            # can have more children
+            parentInverted = {}
+            
+            for tTrack, poseBone, parent, sampler in tracksList:
+                
+                if sampler:
+                    # Already relative to the parent (or to the armature)
+                    poseMatrix = sampler.matrix(time)
+                elif parent:
                     # Bone matrix relative to its parent bone
-                    poseMatrix = parent.matrix.inverted() * poseMatrix
+                    try:
+                        parentMatrix = parentInverted[parent.name]
+                    except KeyError:
+                        parentMatrix = parent.matrix.inverted()
+                        parentInverted[parent.name] = parentMatrix
+                    poseMatrix = parentMatrix * poseBone.matrix
                 else:
                     # Root bone matrix relative to the armature
-                    poseMatrix = Matrix.Rotation(math.radians(-90.0), 4, 'X' ) * originMatrix * poseMatrix
+                    poseMatrix = rootMatrix * poseBone.matrix
 
                 if tOptions.scale != 1.0:
                     poseMatrix.translation *= tOptions.scale
@@ -1253,28 +805,165 @@ def DecomposeActions(scene, armatureObj, tData, tOptions):
                     
                 tFrame = TFrame((time - frameOffset) / scene.render.fps, tl, ql, sl)
                 
-                if not tTrack.frames or tTrack.frames[-1].hasMoved(tFrame):
+                # The reduction removes also the frames which have not moved, but 
+                # it keeps the last one before a movement
+                if tOptions.doReduceKeyframes or not tTrack.frames or tTrack.frames[-1].hasMoved(tFrame):
                     tTrack.frames.append(tFrame)
-                
+
+        # Add the tracks in the bones order
+        for tTrack, poseBone, parent, sampler in tracksList:
             if tTrack.frames:
                 tAnimation.tracks.append(tTrack)
 
         if tAnimation.tracks:
+            if tOptions.doReduceKeyframes:
+                frames = sum(len(tTrack.frames) for tTrack in tAnimation.tracks)
+                ReduceKeyframes(tAnimation, bonesMap, tOptions)
+                log.info("Keyframes reduced from {:d} to {:d}".format(frames, 
+                         sum(len(tTrack.frames) for tTrack in tAnimation.tracks)))
             animationsList.append(tAnimation)
+
+        # Save the animation in the cache, compact and also when it has no tracks
+        if cache:
+            cache.save(cacheKey, (PackAnimation(tAnimation) if tAnimation.tracks else None,))
         
-        if isinstance(object, bpy.types.NlaTrack):
-            object.is_solo = oldTrackValue
-            
-        if isinstance(object, NlaStripLink):
-            object.track.is_solo = oldTrackValue
-            if object.previous:
-                object.previous.mute = oldStripValue
+        RestoreAnimationObject(object, oldTrackValue, oldStripValue)
 
-    # Restore initial action and frame
-    armatureObj.animation_data.action = savedAction
-    armatureObj.animation_data.use_nla = savedUseNla
-    scene.frame_set(savedFrame)
+    if cache and animationIndices is None:
+        log.info("Animation cache: {:d} loaded, {:d} sampled".format(cache.hits, cache.misses))
 
+# Restores the solo and mute values changed to decompose an animation object
+def RestoreAnimationObject(object, oldTrackValue, oldStripValue):
+    if isinstance(object, bpy.types.NlaTrack):
+        object.is_solo = oldTrackValue
+        
+    if isinstance(object, NlaStripLink):
+        object.track.is_solo = oldTrackValue
+        if object.previous:
+            object.previous.mute = oldStripValue
+
+# Script executed by the background Blender processes baking the animations
+BAKE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bake.py")
+
+# Seconds of a wait for the bake processes, then DecomposeActionsParallel yields
+BAKE_WAIT_TIME = 0.05
+
+# Same as DecomposeActions but the animation objects are split among tOptions.bakeProcesses
+# background Blender processes working on the saved .blend file (see bake.py). Each process
+# returns its animations packed, they are added to tData in the order of the animation 
+# objects. The processes don't use the cache: the animations in the cache are loaded here
+# and the baked ones are saved here, so only one process writes the cache. If the file is
+# not saved or a process fails, the animations are decomposed here. If it is closed before
+# the end, the processes are killed.
+def DecomposeActionsParallel(scene, armatureObj, tData, tOptions):
+
+    animationsCount = 0
+    if armatureObj.animation_data:
+        animationsCount = len(AnimationObjects(armatureObj, tOptions))
+    processesCount = min(tOptions.bakeProcesses, animationsCount)
+    if processesCount < 2:
+        yield from DecomposeActions(scene, armatureObj, tData, tOptions)
+        return
+    if not bpy.data.filepath or bpy.data.is_dirty:
+        log.warning("Save the file to bake the animations in more processes")
+        yield from DecomposeActions(scene, armatureObj, tData, tOptions)
+        return
+
+    # Animations of each animation object index
+    indexAnimations = {}
+    # Cache keys of the animations to bake, by animation object index
+    cacheKeys = {}
+    cache = None
+    if tOptions.cachePath:
+        cache = OpenCache(tOptions.cachePath, tOptions.cacheSize, ANIMATION_CACHE_EXTENSION)
+    if cache:
+        yield from DecomposeIndexActions(scene, armatureObj, tData.bonesMap, tOptions, 
+                                         range(animationsCount), indexAnimations, cacheKeys)
+        log.info("Animation cache: {:d} loaded, {:d} to bake".format(len(indexAnimations), len(cacheKeys)))
+    bakeIndices = [index for index in range(animationsCount) if index not in indexAnimations]
+    processesCount = min(processesCount, len(bakeIndices))
+
+    # Indices of the animation objects to decompose in this process
+    localIndices = []
+    tempPath = None
+    # The temporary folder is kept when there are errors, for the logs of the processes
+    keepTempPath = False
+    processes = []
+    try:
+        if processesCount < 2:
+            localIndices = bakeIndices
+        else:
+            log.info("Baking {:d} animations of {:s} in {:d} processes".format(len(bakeIndices), 
+                     armatureObj.name, processesCount))
+            tempPath = tempfile.mkdtemp(prefix = "urho_bake_")
+            for i in range(processesCount):
+                indices = bakeIndices[i::processesCount]
+                inputFilename = os.path.join(tempPath, "input{:d}".format(i))
+                outputFilename = os.path.join(tempPath, "output{:d}".format(i))
+                logFilename = os.path.join(tempPath, "log{:d}".format(i))
+                with open(inputFilename, "wb") as file:
+                    file.write(Dumps( (armatureObj.name, indices, tOptions, tData.bonesMap) ))
+                command = [bpy.app.binary_path, "-b", bpy.data.filepath, "-S", scene.name, 
+                           "--python", BAKE_SCRIPT, "--", inputFilename, outputFilename]
+                with open(logFilename, "w") as logFile:
+                    process = subprocess.Popen(command, stdout = logFile, stderr = subprocess.STDOUT)
+                processes.append( (process, indices, outputFilename, logFilename) )
+
+        while processes:
+            running = sum(1 for process, _, _, _ in processes if process.poll() is None)
+            if not running:
+                break
+            yield 1.0 - running / processesCount
+            time.sleep(BAKE_WAIT_TIME)
+
+        for process, indices, outputFilename, logFilename in processes:
+            try:
+                with open(outputFilename, "rb") as file:
+                    animations, records = pickle.load(file)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                log.error("Bake process failed (exit code {:d}), see {:s}".format(process.returncode, logFilename))
+                localIndices.extend(indices)
+                keepTempPath = True
+                continue
+            for level, message in records:
+                log.log(level, message)
+            # One packed animation for each index, none if it has no tracks
+            indexData = dict(animations)
+            for index in indices:
+                data = indexData.get(index)
+                indexAnimations[index] = [UnpackAnimation(data)] if data else []
+                if index in cacheKeys:
+                    cache.save(cacheKeys[index], (data,))
+
+        if localIndices:
+            if processes:
+                log.warning("Baking {:d} animations in this process".format(len(localIndices)))
+            yield from DecomposeIndexActions(scene, armatureObj, tData.bonesMap, tOptions, 
+                                             localIndices, indexAnimations)
+
+        # Same order of DecomposeActions
+        for index in sorted(indexAnimations):
+            tData.animationsList.extend(indexAnimations[index])
+    finally:
+        for process, _, _, _ in processes:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        if tempPath and not keepTempPath:
+            shutil.rmtree(tempPath, ignore_errors = True)
+
+# Decomposes the animation objects at the indices one at a time (to know the index of 
+# their animations) and adds their animations to indexAnimations. With missingKeys only
+# the animations in the cache are loaded (see DecomposeActions).
+def DecomposeIndexActions(scene, armatureObj, bonesMap, tOptions, indices, indexAnimations, 
+                          missingKeys = None):
+    for i, index in enumerate(indices):
+        indexData = TData()
+        indexData.bonesMap = bonesMap
+        steps = DecomposeActions(scene, armatureObj, indexData, tOptions, {index}, missingKeys)
+        yield from ScaleSteps(steps, i / len(indices), 1.0 / len(indices))
+        if missingKeys is None or index not in missingKeys:
+            indexAnimations[index] = indexData.animationsList
 
 #--------------------
 # Decompose materials
@@ -1320,32 +1009,160 @@ def DecomposeMaterial(scene, material):
     
     return tMaterial
     
+#--------------------
+# Extract mesh data
+#--------------------
+
+# Reads a collection attribute with a single API call, returns a flat list
+def ReadCollection(collection, attribute, itemSize, default = 0.0):
+    values = [default] * (len(collection) * itemSize)
+    collection.foreach_get(attribute, values)
+    return values
+
+# Reads a tessface UV layer, returns an array of 8 floats per face (u1,v1..u4,v4)
+# with flipped V coordinates
+def ReadUvLayer(uvLayer):
+    values = ReadCollection(uvLayer, "uv_raw", 8)
+    for i in range(1, len(values), 2):
+        values[i] = 1.0 - values[i]
+    return array.array('f', values)
+
+# Reads from the mesh and its tessfaces all the data we need, with one API call per
+# attribute, and applies the matrices once for each vertex and face
+def ExtractMeshData(mesh, posMatrix, normalMatrix, uvs, uvs2, colorsRgb, colorsAlpha):
+
+    tMeshData = TMeshData()
+
+    verticesCount = len(mesh.vertices)
+    facesCount = len(mesh.tessfaces)
+
+    # Positions and normals, converted from Z up to Y up
+    coords = ReadCollection(mesh.vertices, "co", 3)
+    normals = ReadCollection(mesh.vertices, "normal", 3)
+    for i in range(0, 3 * verticesCount, 3):
+        position = posMatrix * Vector(coords[i:i+3])
+        tMeshData.positions.append( (position.x, position.z, position.y) )
+        normal = normalMatrix * Vector(normals[i:i+3])
+        tMeshData.vertexNormals.append( (normal.x, normal.z, normal.y) )
+
+    faces = mesh.tessfaces
+    normals = ReadCollection(faces, "normal", 3)
+    for i in range(0, 3 * facesCount, 3):
+        normal = normalMatrix * Vector(normals[i:i+3])
+        tMeshData.faceNormals.append( (normal.x, normal.z, normal.y) )
+
+    # Each face has 4 vertex indices, in triangles the last one is zero (Blender
+    # never puts the zero index as the last vertex of a quad)
+    verticesRaw = ReadCollection(faces, "vertices_raw", 4, 0)
+    for i in range(0, 4 * facesCount, 4):
+        if verticesRaw[i+3]:
+            tMeshData.faceVertices.append( tuple(verticesRaw[i:i+4]) )
+        else:
+            tMeshData.faceVertices.append( tuple(verticesRaw[i:i+3]) )
+
+    tMeshData.faceSmooth = ReadCollection(faces, "use_smooth", 1, False)
+    tMeshData.faceMaterials = ReadCollection(faces, "material_index", 1, 0)
+    tMeshData.faceHidden = ReadCollection(faces, "hide", 1, False)
+
+    # Urho UV origin is top-left, Blender is bottom-left: flip V. We store UV as 
+    # 32 bits floats, the same precision of the Vector they will become
+    if uvs:
+        tMeshData.uvs = ReadUvLayer(uvs)
+    if uvs2:
+        tMeshData.uvs2 = ReadUvLayer(uvs2)
+
+    if colorsRgb:
+        tMeshData.colorsRgb = [ReadCollection(colorsRgb, "color" + str(i), 3) for i in range(1, 5)]
+    if colorsAlpha:
+        tMeshData.colorsAlpha = [ReadCollection(colorsAlpha, "color" + str(i), 3) for i in range(1, 5)]
+
+    return tMeshData
+
+# Returns the bones weights of each vertex of the mesh: a tuple of tuple(bone index, 
+# weight) or None. Only the vertices of the visible faces are read.
+def ExtractWeights(mesh, meshObj, tMeshData, bonesMap, tOptions):
+
+    # Mesh vertex groups
+    meshVertexGroups = meshObj.vertex_groups
+
+    # Errors helpers
+    notBonesGroups = set()
+    missingGroups = set()
+    overrideBones = set()
+    missingBones = set()
+
+    vertexWeights = [None] * len(mesh.vertices)
+
+    usedVertices = set()
+    for faceIndex, faceVertices in enumerate(tMeshData.faceVertices):
+        if not tMeshData.faceHidden[faceIndex] and len(frozenset(faceVertices)) >= 3:
+            usedVertices.update(faceVertices)
+
+    for vertexIndex in sorted(usedVertices):
+        weights = []
+        # Scan all the vertex group associated to the vertex, type: VertexGroupElement(bpy_struct)
+        for g in mesh.vertices[vertexIndex].groups:
+            # The group name should be the bone name, but it can also be an user made vertex group
+            try:
+                boneName = meshVertexGroups[g.group].name
+                try:
+                    boneIndex = bonesMap[boneName].index
+                    if g.weight > 0.0 or not weights:
+                        weights.append( (boneIndex, g.weight) )
+                except KeyError:
+                    notBonesGroups.add(boneName)
+            except IndexError:
+                missingGroups.add(str(g.group))
+        # If the mesh has a bone for parent use it for a 100% weight skinning
+        if meshObj.parent_type == 'BONE' and meshObj.parent_bone:
+            boneName = meshObj.parent_bone
+            # We shouldn't have any skinning on the vertex
+            if weights:
+                overrideBones.add(boneName)
+            try:
+                boneIndex = bonesMap[boneName].index
+                weights.append( (boneIndex, 1.0) )
+            except KeyError:
+                missingBones.add(boneName)
+        # If we found no bone weight (not even one with weight zero) leave it equal to None
+        if weights:
+            vertexWeights[vertexIndex] = tuple(weights)
+        elif tOptions.doForceElements:
+            vertexWeights[vertexIndex] = ((0, 0.0),)
+
+    if notBonesGroups:
+        log.info("These groups are not used for bone deforms: {:s}".format( ", ".join(notBonesGroups) ))
+    if missingGroups:
+        log.warning("These group indices are missing: {:s}".format( ", ".join(missingGroups) ))
+    if overrideBones:
+        log.warning("These parent bones will override the deforms: {:s}".format( ", ".join(overrideBones) ))
+    if missingBones:
+        log.warning("These parent bones are missing in the armature: {:s}".format( ", ".join(missingBones) ))
+
+    return vertexWeights
+
 #---------------------------------
 # Decompose geometries and morphs
 #---------------------------------
 
+# Reads the mesh data of a Blender object and decomposes it with DecomposeGeometry, 
+# then decomposes its shape keys. It is a generator, it yields the fraction of the work
+# done (0.0 to 1.0).
 def DecomposeMesh(scene, meshObj, tData, tOptions, errorsDict):
 
-    try:
-        invalidUvIndices = errorsDict["invalid UV"]
-    except KeyError:
-        invalidUvIndices = set()
-        errorsDict["invalid UV"] = invalidUvIndices
-
-    verticesList = tData.verticesList
-    geometriesList = tData.geometriesList
-    materialsList = tData.materialsList
-    materialGeometryMap = tData.materialGeometryMap
-    morphsList = tData.morphsList
-    bonesMap = tData.bonesMap
-    
-
-    verticesMap = {}
-    
     # Create a Mesh datablock with modifiers applied
     # (note: do not apply if not needed, it loses precision)
     mesh = meshObj.to_mesh(scene, tOptions.applyModifiers, tOptions.applySettings)
-    
+    try:
+        yield from DecomposeMeshData(scene, meshObj, mesh, tData, tOptions, errorsDict)
+    finally:
+        bpy.data.meshes.remove(mesh)
+
+# Generator used by DecomposeMesh, mesh is the Mesh datablock with the modifiers applied
+def DecomposeMeshData(scene, meshObj, mesh, tData, tOptions, errorsDict):
+
+    bonesMap = tData.bonesMap
+
     # make a note of which materials are used
     tData.MarkUsedMaterials(meshObj, mesh)
     
@@ -1364,23 +1181,9 @@ def DecomposeMesh(scene, meshObj, tData, tOptions, errorsDict):
     if tOptions.scale != 1.0:
         posMatrix = Matrix.Scale(tOptions.scale, 4) * posMatrix 
 
-    # Vertices map: vertex Blender index to TVertex index
-    faceVertexMap = {}
-
-    # Here we store geometriesList indices of geometries with new vertices in its last LOD
-    # We use this to create a new LOD only once per geometry and to filter where we have
-    # to optimize and recalculate tangents
-    updatedGeometryIndices = set()
-
     # Mesh vertex groups
     meshVertexGroups = meshObj.vertex_groups
     
-    # Errors helpers
-    notBonesGroups = set()
-    missingGroups = set()
-    overrideBones = set()
-    missingBones = set()
-
     # Python trick: C = A and B, if A is False (None, empty list) then C=A, if A is
     # True (object, populated list) then C=B
     
@@ -1434,25 +1237,6 @@ def DecomposeMesh(scene, meshObj, tData, tOptions, errorsDict):
         if not mesh.materials:
             log.warning("Object {:s} has no materials data".format(meshObj.name))
 
-    # Progress counter
-    progressCur = 0
-    progressTot = 0.01 * len(mesh.tessfaces)
-
-    # even if no material slots exist, our minimum count is forced to 1
-    # to ensure at least one geometry instance.
-    numMaterials = max(len(meshObj.material_slots), 1)
-    
-    # generate a geometry per material slot (material index == geometry index)
-    # we *can* end up creating some TGeometry for a material that isn't used,
-    # but the indices remain correct, so our material indices in URHO match
-    # the slot order in Blender (which is the primary motivation behind this quirk)
-    for i in range(numMaterials):
-        geometriesList.append(TGeometry())
-        geometryIndex = i
-        materialIndex = i
-        materialGeometryMap[geometryIndex] = materialIndex
-        log.info("New Geometry{:d} created for material {:d}".format(geometryIndex, materialIndex))
-
     # map group index to a bone
     if tOptions.doGeometryWei:
         # from addons/io_scene_x/export.x.py
@@ -1480,236 +1264,16 @@ def DecomposeMesh(scene, meshObj, tData, tOptions, errorsDict):
             print(usedGroups)
             raise
     
-    for face in mesh.tessfaces:
-
-        if (progressCur % 10) == 0:
-            print("{:.3f}%\r".format(progressCur / progressTot), end='' )
-        progressCur += 1
-
-        # Skip if this face has less than 3 unique vertices
-        # (a frozenset is an immutable set of unique elements)
-        if len(frozenset(face.vertices)) < 3: 
-            face.hide = True
-            continue
-
-        if face.hide:
-            continue
-
-        # Get face vertices UV, type: MeshTextureFace(bpy_struct)
-        faceUv = uvs and uvs[face.index]
-        faceUv2 = uvs2 and uvs2[face.index]
-
-        # Get face 4 vertices colors
-        fcol = colorsRgb and colorsRgb[face.index]
-        faceRgbColor = fcol and (fcol.color1, fcol.color2, fcol.color3, fcol.color4)
-        fcol = colorsAlpha and colorsAlpha[face.index]
-        faceAlphaColor = fcol and (fcol.color1, fcol.color2, fcol.color3, fcol.color4)
-        
-        # we use the material index directly
-        materialIndex = face.material_index     
-        geometryIndex = materialIndex
-
-        # Get the geometry associated to the material
-        geometry = geometriesList[geometryIndex]
-        
-        # Get the last LOD level, or add a new one if requested in the options
-        lodLevelIndex = len(geometry.lodLevels)
-        if not geometry.lodLevels or geometryIndex not in tOptions.lodUpdatedGeometryIndices:
-            tLodLevel = TLodLevel()
-            tLodLevel.distance = tOptions.lodDistance
-            geometry.lodLevels.append(tLodLevel)
-            tOptions.lodUpdatedGeometryIndices.add(geometryIndex)
-            log.info("New LOD{:d} created for material {:d}".format(lodLevelIndex, materialIndex))
-        else:
-            tLodLevel = geometry.lodLevels[-1]
+    # Read all the mesh data we need
+    tMeshData = ExtractMeshData(mesh, posMatrix, normalMatrix, uvs, uvs2, colorsRgb, colorsAlpha)
 
-        # Add the index of the geometry we are going to update
-        updatedGeometryIndices.add(geometryIndex)
-
-        indexSet = tLodLevel.indexSet
-        triangleList = tLodLevel.triangleList
-            
-        # Here we store all the indices of the face, then we decompose it into triangles
-        tempList = []
-
-        for i, vertexIndex in enumerate(face.vertices):
-            # i: vertex index in the face (0..2 tris, 0..3 quad)
-            # vertexIndex: vertex index in Blender buffer
-
-            # Blender vertex
-            vertex = mesh.vertices[vertexIndex]
-
-            position = posMatrix * vertex.co
-                
-            # if face is smooth use vertex normal else use face normal
-            if face.use_smooth:
-                normal = vertex.normal
-            else:
-                normal = face.normal
-            normal = normalMatrix * normal
-            
-            # Create a new vertex
-            tVertex = TVertex()
-            
-            # Set Blender index
-            tVertex.blenderIndex = vertexIndex
-
-            # Set Vertex position
-            if tOptions.doGeometryPos:
-                tVertex.pos = Vector((position.x, position.z, position.y))
-
-            # Set Vertex normal
-            if tOptions.doGeometryNor:
-                tVertex.normal = Vector((normal.x, normal.z, normal.y))
-                
-            # Set Vertex UV coordinates
-            if tOptions.doGeometryUV:
-                if faceUv:
-                    uv = faceUv.uv[i]
-                    tVertex.uv = Vector((uv[0], 1.0 - uv[1]))
-                elif tOptions.doForceElements:
-                    tVertex.uv = Vector((0.0, 0.0))
-            if tOptions.doGeometryUV2:
-                if faceUv2:
-                    uv2 = faceUv.uv[i]
-                    tVertex.uv2 = Vector((uv2[0], 1.0 - uv2[1]))
-                elif tOptions.doForceElements:
-                    tVertex.uv2 = Vector((0.0, 0.0))
-
-            # Set Vertex color
-            if tOptions.doGeometryCol or tOptions.doGeometryColAlpha:
-                color = [0, 0, 0, 255]
-                if faceRgbColor or faceAlphaColor:
-                    if faceRgbColor:
-                        # This is an array of 3 floats from 0.0 to 1.0
-                        rgb = faceRgbColor[i]
-                        # Approx 255*float to the closest int
-                        color[:3] = ( int(round(rgb.r * 255.0)), 
-                                      int(round(rgb.g * 255.0)), 
-                                      int(round(rgb.b * 255.0)) )
-                    if faceAlphaColor:
-                        # For Alpha use Value of HSV
-                        alpha = faceAlphaColor[i]
-                        color[3] = int(round(alpha.v * 255.0))
-                    tVertex.color = tuple(color)
-                elif tOptions.doForceElements:
-                    tVertex.color = tuple(color)
-                    
-            # Set Vertex bones weights
-            if tOptions.doGeometryWei:
-                weights = []
-                # Scan all the vertex group associated to the vertex, type: VertexGroupElement(bpy_struct)
-                for g in vertex.groups:
-                    # The group name should be the bone name, but it can also be an user made vertex group
-                    try:
-                        boneName = meshVertexGroups[g.group].name
-                        try:
-                            boneIndex = bonesMap[boneName].index
-                            if g.weight > 0.0 or not weights:
-                                weights.append( (boneIndex, g.weight) )
-                        except KeyError:
-                            notBonesGroups.add(boneName)
-                    except IndexError:
-                        missingGroups.add(str(g.group))
-                # If the mesh has a bone for parent use it for a 100% weight skinning
-                if meshObj.parent_type == 'BONE' and meshObj.parent_bone:
-                    boneName = meshObj.parent_bone
-                    # We shouldn't have any skinning on the vertex
-                    if weights:
-                        overrideBones.add(boneName)
-                    try:
-                        boneIndex = bonesMap[boneName].index
-                        weights.append( (boneIndex, 1.0) )
-                    except KeyError:
-                        missingBones.add(boneName)
-                # If we found no bone weight (not even one with weight zero) leave the list equal to None
-                if weights:
-                    tVertex.weights = weights
-                elif tOptions.doForceElements:
-                    tVertex.weights = [(0, 0.0)]
-               
-                     
-            # All this code do is "tVertexIndex = verticesMapList.index(tVertex)", but we use
-            # a map to speed up.
-
-            # Get an hash of the vertex (different vertices with the same hash are ok)
-            vertexHash = hash(tVertex)
-            
-            try:
-                # Get a list of vertex indices with the same hash
-                verticesMapList = verticesMap[vertexHash]
-            except KeyError:
-                # If the hash is not mapped, create a new list (we should use sets but lists are faster)
-                verticesMapList = []
-                verticesMap[vertexHash] = verticesMapList
-            
-            # For each index in the list, test if it is the same as the current tVertex.
-            # If Position, Normal and UV must be the same get its index.
-            ## tVertexIndex = next((j for j in verticesMapList if verticesList[j] == tVertex), None)
-            tVertexIndex = None
-            for j in verticesMapList:
-                if verticesList[j].isEqual(tVertex):
-                    tVertexIndex = j
-                    break
-
-            # If we cannot find it, the vertex is new, add it to the list, and its index to the map list
-            if tVertexIndex is None:
-                tVertexIndex = len(verticesList)
-                verticesList.append(tVertex)
-                verticesMapList.append(tVertexIndex)
-
-
-            # Add the vertex index to the temp list to create triangles later
-            tempList.append(tVertexIndex)
-                        
-            # Map Blender face index and Blender vertex index to our TVertex index (this is used later by Morphs)
-            faceVertexMap[(face.index, vertexIndex)] = tVertexIndex
-            
-            # Save every unique vertex this LOD is using
-            indexSet.add(tVertexIndex)
-
-            # Create triangles
-            if i == 2:
-                triangle = (tempList[0], tempList[2], tempList[1])
-                triangleList.append(triangle)
+    # even if no material slots exist, our minimum count is forced to 1
+    # to ensure at least one geometry instance.
+    tMeshData.materialsCount = max(len(meshObj.material_slots), 1)
 
-            if i == 3:
-                triangle = (tempList[0], tempList[3], tempList[2])
-                triangleList.append(triangle)
-        # end loop vertices
-    # end loop faces
+    if tOptions.doGeometryWei:
+        tMeshData.vertexWeights = ExtractWeights(mesh, meshObj, tMeshData, bonesMap, tOptions)
 
-    if notBonesGroups:
-        log.info("These groups are not used for bone deforms: {:s}".format( ", ".join(notBonesGroups) ))
-    if missingGroups:
-        log.warning("These group indices are missing: {:s}".format( ", ".join(missingGroups) ))
-    if overrideBones:
-        log.warning("These parent bones will override the deforms: {:s}".format( ", ".join(overrideBones) ))
-    if missingBones:
-        log.warning("These parent bones are missing in the armature: {:s}".format( ", ".join(missingBones) ))
-    
-    # Generate tangents for the last LOD of every geometry with new vertices
-    if tOptions.doGeometryTan:
-        lodLevels = []
-        for geometryIndex in updatedGeometryIndices:
-            geometry = geometriesList[geometryIndex]
-            # Only the last LOD was modified (even if it wasn't a new LOD)
-            lodLevel = geometry.lodLevels[-1]
-            log.info("Generating tangents on {:d} indices for {:s} Geometry{:d}"
-                    .format(len(lodLevel.indexSet), meshObj.name, geometryIndex) )
-            lodLevels.append(lodLevel)
-        GenerateTangents(lodLevels, verticesList, invalidUvIndices)
-            
-    # Optimize vertex index buffer for the last LOD of every geometry with new vertices
-    if tOptions.doOptimizeIndices:
-        for geometryIndex in updatedGeometryIndices:
-            geometry = geometriesList[geometryIndex]
-            # Only the last LOD was modified (even if it wasn't a new LOD)
-            lodLevel = geometry.lodLevels[-1]
-            log.info("Optimizing {:d} indices for {:s} Geometry{:d}"
-                    .format(len(lodLevel.indexSet), meshObj.name, geometryIndex) )
-            OptimizeIndices(lodLevel)
-    
     # Check if we need and can work on shape keys (morphs)
     shapeKeys = meshObj.data.shape_keys
     keyBlocks = []
@@ -1719,151 +1283,73 @@ def DecomposeMesh(scene, meshObj, tData, tOptions, errorsDict):
         else:
             keyBlocks = shapeKeys.key_blocks
 
+    # Steps for the progress: the geometry and then a step for each shape key
+    stepsCount = max(len(keyBlocks), 1)
+
+    # Create vertices, geometries and LODs
+    steps = DecomposeGeometrySteps(tMeshData, tData, tOptions, errorsDict, meshObj.name)
+    faceVertexMap = yield from ScaleSteps(steps, 0.0, 1.0 / stepsCount)
+
+    if keyBlocks:
+        # Positions of the mesh vertices, the shapes are compared against them to find
+        # which vertices each shape moves
+        verticesCount = len(mesh.vertices)
+        baseCoords = ReadCollection(mesh.vertices, "co", 3)
+        
+        # Map Blender vertex index to the list of the faces using it
+        vertexFaces = VertexFaces(tMeshData, verticesCount)
+
     # Decompose shape keys (morphs)
     for j, block in enumerate(keyBlocks):
         # Skip 'Basis' shape key
         if j == 0:
             continue
         
-        tMorph = TMorph(block.name)
-        
         log.info("Decomposing shape: {:s} ({:d} vertices)".format(block.name, len(block.data)) )
 
-        # Make a temporary copy of the mesh
-        shapeMesh = mesh.copy()
-        
-        if len(shapeMesh.vertices) != len(block.data):
+        if verticesCount != len(block.data):
             log.error("Vertex count mismatch on shape {:s}.".format(block.name))
             continue
         
-        # Appy the shape
-        for i, data in enumerate(block.data):
-            shapeMesh.vertices[i].co = data.co
-
-        # Recalculate normals
-        shapeMesh.update(calc_edges = True, calc_tessface = True)
-        ##shapeMesh.calc_tessface()
-        ##shapeMesh.calc_normals()
-        
-        # TODO: if set use 'vertex group' of the shape to filter affected vertices
-        # TODO: can we use mesh tessfaces and not shapeMesh tessfaces ?
+        # Read the shape positions, we don't apply them to a copy of the mesh but we 
+        # recalculate the normals only where the shape has effect
+        coords = ReadCollection(block.data, "co", 3)
         
-        for face in shapeMesh.tessfaces:
-            if face.hide:
-                continue
+        DecomposeShape(tMeshData, tData, tOptions, faceVertexMap, vertexFaces, baseCoords, coords,
+                       posMatrix, normalMatrix, block.name)
 
-            # TODO: add only affected triangles not faces, use morphed as a mask
-            morphed = False
-
-            # In this list we store vertex index and morphed vertex of each face, we'll add them
-            # to the morph only if at least one vertex on the face is affected by the moprh
-            tempList = []
-            
-            # For each Blender vertex index in the face
-            for vertexIndex in face.vertices:
-
-                # Get the Blender morphed vertex
-                vertex = shapeMesh.vertices[vertexIndex]
-                
-                position = posMatrix * vertex.co
-                
-                # If face is smooth use vertex normal else use face normal
-                if face.use_smooth:
-                    normal = vertex.normal
-                else:
-                    normal = face.normal
-                normal = normalMatrix * normal
-
-                # Try to find the TVertex index corresponding to this Blender vertex index
-                try:
-                    tVertexIndex = faceVertexMap[(face.index, vertexIndex)]
-                except KeyError:
-                    log.error("Cannot find vertex {:d} of face {:d} of shape {:s}."
-                              .format(vertexIndex, face.index, block.name) )
-                    continue
-
-                # Get the original not morphed TVertex
-                tVertex = verticesList[tVertexIndex]
-                   
-                # Create a new morphed vertex
-                # (note: this vertex stores absolute values, not relative to original values)
-                tMorphVertex = TVertex()
-
-                # Set Blender index
-                tMorphVertex.blenderIndex = vertexIndex
-
-                # Set Vertex position
-                tMorphVertex.pos = Vector((position.x, position.z, position.y))
-
-                # Set Vertex normal
-                if tOptions.doMorphNor:
-                    tMorphVertex.normal = Vector((normal.x, normal.z, normal.y))
-                
-                # If we have UV, copy them to the TVertex, we only need them to calculate tangents
-                if tOptions.doMorphUV:
-                    if tVertex.uv:
-                        tMorphVertex.uv = tVertex.uv
-                    elif tOptions.doForceElements:
-                        tVertex.uv = Vector(0.0, 0.0)
-                
-                # Save vertex index and morphed vertex, to be added later if at least one
-                # vertex in the face was morphed
-                tempList.append((tVertexIndex, tMorphVertex))
-                
-                # Check if the morph has effect
-                if tMorphVertex.isMorphed(tVertex):
-                    morphed = True
-            
-            # If at least one vertex in the face was morphed
-            if morphed:
-                # Add vertices to the morph
-                for i, (tVertexIndex, tMorphVertex) in enumerate(tempList):
-                    try:
-                        # Check if already present
-                        oldTMorphVertex = tMorph.vertexMap[tVertexIndex]
-                        if tMorphVertex != oldTMorphVertex:
-                            log.error('Different vertex {:d} of face {:d} of shape {:s}.'
-                                .format(vertexIndex, face.index, block.name) )
-                            continue
-                    except KeyError:
-                        # Add a new morph vertex
-                        tMorph.vertexMap[tVertexIndex] = tMorphVertex
-                        
-                    # Save how many unique vertex this LOD is using (for tangents calculation)
-                    tMorph.indexSet.add(tVertexIndex)
-
-                    # Create triangles (for tangents calculation)
-                    if i == 2:
-                        triangle = (tempList[0][0], tempList[2][0], tempList[1][0])
-                        tMorph.triangleList.append(triangle)
-
-                    if i == 3:
-                        triangle = (tempList[0][0], tempList[3][0], tempList[2][0])
-                        tMorph.triangleList.append(triangle)
-                    
-        if tOptions.doMorphTan:
-            log.info("Generating morph tangents {:s}".format(block.name) )
-            GenerateTangents((tMorph,), tMorph.vertexMap, None)
-
-        # If valid add the morph to the model list
-        if tMorph.vertexMap:
-            morphsList.append(tMorph)
-        else:
-            log.warning('Empty shape {:s}.'.format(block.name))
-
-        # Delete the temporary copy 
-        bpy.data.meshes.remove(shapeMesh)
-
-    bpy.data.meshes.remove(mesh)    
-
-    return
+        yield (j + 1) / stepsCount
 
 #--------------------
 # Scan objects
 #--------------------
 
+# Returns the armature of a mesh object: its parent armature or the armature of its 
+# Armature modifier, None if not found
+def FindArmature(obj):
+    # Check if obj has an armature parent, if it is attached to a bone (like hair to head bone)
+    # we'll skin it to the bone with 100% weight (but it shouldn't have bone vertex groups)
+    if obj.parent and obj.parent.type == 'ARMATURE':
+        return obj.parent
+    # Check if there is an Armature modifier
+    for modifier in obj.modifiers:
+        if modifier.type == 'ARMATURE' and modifier.object and modifier.object.type == 'ARMATURE':
+            return modifier.object
+    return None
+
+# TData fields saved in the decomposition cache (the materials are decomposed later 
+# and the names depend on the export)
+CACHED_TDATA_FIELDS = ('verticesList', 'geometriesList', 'morphsList', 'materialGeometryMap', 
+                       'bonesMap', 'animationsList', 'errorsDict', 'postponedTasks')
+
 # Scan and decompose objects
 def Scan(context, tDataList, tOptions):
+    RunSteps(ScanSteps(context, tDataList, tOptions))
+
+# Same as Scan but as a generator: it yields the fraction of the objects decomposed 
+# (0.0 to 1.0), often enough to run it in time slices. If it is closed before the end,
+# the armatures and the animations are restored.
+def ScanSteps(context, tDataList, tOptions):
     
     scene = context.scene
     
@@ -1907,17 +1393,18 @@ def Scan(context, tDataList, tOptions):
         assert(lodName)
         meshes.append( (obj, lodName, lodDistance) )
 
+    # Keep only the requested objects and the objects decomposed in the same TData
+    if tOptions.onlyObjects is not None:
+        lodNames = set(lodName for obj, lodName, lodDistance in meshes if obj.name in tOptions.onlyObjects)
+        if tOptions.mergeObjects:
+            if not lodNames:
+                meshes = []
+        else:
+            meshes = [m for m in meshes if m[1] in lodNames]
+        noWork = not meshes
+
     if tOptions.useLods and noLod:
         log.warning("No LODs found")
-            # Decompose geometries
-            if tOptions.doGeometries:
-                DecomposeMesh(scene, obj, tData, tOptions, tData.errorsDict)
-    
-    # decompose any materials that were referenced by our exported objects
-    if tOptions.doMaterials:
-        for material, isUsed in tData.materialsUsed.items():
-            if isUsed:
-                tData.materialsList.append( DecomposeMaterial(scene, material ) )
         
     if noWork:
         log.warning("No objects to work on")
@@ -1934,103 +1421,199 @@ def Scan(context, tDataList, tOptions):
         # Sort by object name = LOD name
         meshes.sort(key=lambda x: x[1])
 
+    # Objects decomposed in the same TData: when merging all the objects, with LODs all 
+    # the objects with the same LOD name, else only the object itself
+    cache = None
+    if tOptions.cachePath:
+        cache = OpenCache(tOptions.cachePath, tOptions.cacheSize)
+        groupsObjects = {}
+        for obj, lodName, lodDistance in meshes:
+            groupName = None if tOptions.mergeObjects else lodName
+            groupsObjects.setdefault(groupName, []).append(obj)
+    # Key of the current TData if it must be saved in the cache when completed
+    cacheKey = None
+    # The current TData was loaded from the cache
+    cacheLoaded = False
+
+    # Objects not merged with the same armature have a TData each, but their skeleton 
+    # and animations are the same: the armature is decomposed only for the first one
+    # and copied in the others. Armature name -> the first TData with the armature
+    armaturesTData = {}
+    # TData with the animations of an armature already in another TData, the animations
+    # are removed at the end so each animation is written only once
+    sharedAnimationsTData = []
+
+    # Armatures in the rest position, restored when all the objects are decomposed
+    restPose = RestPoseState(scene)
+
     # Decompose objects
     tData = None
     lodCurrentName = None
-    for obj, lodName, lodDistance in meshes:
+    try:
+        for meshIndex, (obj, lodName, lodDistance) in enumerate(meshes):
+
+            yield meshIndex / len(meshes)
             
-        log.info("---- Decomposing {:s} ----".format(obj.name))
+            log.info("---- Decomposing {:s} ----".format(obj.name))
         
-        # Are we creating a new container (TData) for a new mesh?
-        # When merging is always False, when using LODs is True when changing object but False when adding a LOD.
-        createNew = True
-
-        if tOptions.mergeObjects:
-            createNew = False
-            if tData and tOptions.mergeNotMaterials:
-                # To create a new geometry in the same tData for each material of each object, clear the 'Material to Geometry' dict
-                tData.materialGeometryMap.clear()
-            # If we are merging objects, use the current selected object name (only if it is a mesh)
-            if context.selected_objects:
-                selectedObject = context.selected_objects[0]
-                if selectedObject.type == 'MESH' and selectedObject.name:
-                    lodName = selectedObject.name
+            # Are we creating a new container (TData) for a new mesh?
+            # When merging is always False, when using LODs is True when changing object but False when adding a LOD.
+            createNew = True
 
-        if tOptions.useLods:
             if tOptions.mergeObjects:
-                # Merging objects: never create a new mesh, add a new LOD when distance changes
-                if tOptions.lodDistance is None:
-                    # This is the first LOD of the merge
-                    if lodDistance != 0.0:
-                        log.warning("First LOD should have 0.0 distance (found {:.3f})".format(lodDistance))
-                elif tOptions.lodDistance != lodDistance:
-                    # This is a lower LOD of the merge
-                    tOptions.lodUpdatedGeometryIndices.clear() # request new LOD
-                    assert(lodDistance >= tOptions.lodDistance)
-                tOptions.lodDistance = lodDistance
-                log.info("Merging as {:s} LOD with distance {:.3f}".format(lodName, lodDistance))
-            else:
-                # Multiple objects: create a new mesh (and new LOD) when name changes, add a new LOD when distance changes
-                if lodCurrentName is None or lodCurrentName != lodName:
-                    # This is the first LOD of a new object
-                    tOptions.lodIndex = 0
-                    lodCurrentName = lodName
-                    if lodDistance != 0.0:
-                        log.warning("First LOD should have 0.0 distance (found {:.3f})".format(lodDistance))
+                createNew = False
+                if tData and tOptions.mergeNotMaterials:
+                    # To create a new geometry in the same tData for each material of each object, clear the 'Material to Geometry' dict
+                    tData.materialGeometryMap.clear()
+                # If we are merging objects, use the current selected object name (only if it is a mesh)
+                if context.selected_objects:
+                    selectedObject = context.selected_objects[0]
+                    if selectedObject.type == 'MESH' and selectedObject.name:
+                        lodName = selectedObject.name
+
+            if tOptions.useLods:
+                if tOptions.mergeObjects:
+                    # Merging objects: never create a new mesh, add a new LOD when distance changes
+                    if tOptions.lodDistance is None:
+                        # This is the first LOD of the merge
+                        if lodDistance != 0.0:
+                            log.warning("First LOD should have 0.0 distance (found {:.3f})".format(lodDistance))
+                    elif tOptions.lodDistance != lodDistance:
+                        # This is a lower LOD of the merge
+                        tOptions.lodUpdatedGeometryIndices.clear() # request new LOD
+                        assert(lodDistance >= tOptions.lodDistance)
+                    tOptions.lodDistance = lodDistance
+                    log.info("Merging as {:s} LOD with distance {:.3f}".format(lodName, lodDistance))
                 else:
-                    # This is a lower LOD of the same object
-                    createNew = False
-                    tOptions.lodUpdatedGeometryIndices.clear() # request new LOD
-                    if lodDistance <= tOptions.lodDistance:
-                        log.warning("Wrong LOD sequence: {:d} then {:d}".format(tOptions.lodDistance, lodDistance) )
-                tOptions.lodDistance = lodDistance
-                log.info("Added as {:s} LOD with distance {:.3f}".format(lodName, lodDistance))
+                    # Multiple objects: create a new mesh (and new LOD) when name changes, add a new LOD when distance changes
+                    if lodCurrentName is None or lodCurrentName != lodName:
+                        # This is the first LOD of a new object
+                        tOptions.lodIndex = 0
+                        lodCurrentName = lodName
+                        if lodDistance != 0.0:
+                            log.warning("First LOD should have 0.0 distance (found {:.3f})".format(lodDistance))
+                    else:
+                        # This is a lower LOD of the same object
+                        createNew = False
+                        tOptions.lodUpdatedGeometryIndices.clear() # request new LOD
+                        if lodDistance <= tOptions.lodDistance:
+                            log.warning("Wrong LOD sequence: {:d} then {:d}".format(tOptions.lodDistance, lodDistance) )
+                    tOptions.lodDistance = lodDistance
+                    log.info("Added as {:s} LOD with distance {:.3f}".format(lodName, lodDistance))
     
-        # Create a new container where to save decomposed data
-        if not tData or createNew:
-            tData = TData()
-            tData.objectName = lodName
-            if not tOptions.mergeObjects:
-                tData.blenderObjectName = obj.name
-            tDataList.append(tData)
-            tOptions.lodUpdatedGeometryIndices.clear() # request new LOD
-            tOptions.lodDistance = 0.0
+            # Create a new container where to save decomposed data
+            if not tData or createNew:
+                # Save the completed container in the cache
+                if cacheKey:
+                    with tData.stats.timer("CacheSave"):
+                        cache.save(cacheKey, {k: getattr(tData, k) for k in CACHED_TDATA_FIELDS})
+                    cacheKey = None
+                tData = TData()
+                tData.objectName = lodName
+                tData.stats = ObjectStats(lodName)
+                if not tOptions.mergeObjects:
+                    tData.blenderObjectName = obj.name
+                tDataList.append(tData)
+                tOptions.lodUpdatedGeometryIndices.clear() # request new LOD
+                tOptions.lodDistance = 0.0
+            
+                # Search the container in the cache, if found we skip the decomposition of 
+                # all its objects
+                cacheLoaded = False
+                if cache:
+                    with tData.stats.timer("CacheLoad"):
+                        groupObjects = groupsObjects[None if tOptions.mergeObjects else lodName]
+                        armatures = [tOptions.doBones and FindArmature(o) for o in groupObjects]
+                        actions = [AnimationActions(a, tOptions) if a and tOptions.doAnimations else []
+                                   for a in armatures]
+                        cacheKey = DecompositionKey(scene, groupObjects, armatures, actions, tOptions)
+                        cachedFields = cache.load(cacheKey)
+                    if cachedFields:
+                        log.info("Loaded {:s} from the cache".format(lodName))
+                        for k in CACHED_TDATA_FIELDS:
+                            setattr(tData, k, cachedFields[k])
+                        tData.stats.count("cached")
+                        cacheKey = None
+                        cacheLoaded = True
         
-        # First we need to populate the skeleton, then animations and then geometries
-        armatureObj = None
-        if tOptions.doBones:
-            # Check if obj has an armature parent, if it is attached to a bone (like hair to head bone)
-            # we'll skin it to the bone with 100% weight (but it shouldn't have bone vertex groups)
-            if obj.parent and obj.parent.type == 'ARMATURE':
-                armatureObj = obj.parent
-            else:
-                # Check if there is an Armature modifier
-                for modifier in obj.modifiers:
-                    if modifier.type == 'ARMATURE' and modifier.object and modifier.object.type == 'ARMATURE':
-                        armatureObj = modifier.object
-                        break
-            # Decompose armature and animations
-            if armatureObj:
-                if not tData.bonesMap or not tOptions.mergeObjects:
-                    savedValue = SetRestPosePosition(context, armatureObj)
-                    DecomposeArmature(scene, armatureObj, obj, tData, tOptions)
-                    RestorePosePosition(armatureObj, savedValue)
-                if tOptions.doAnimations and (not tData.animationsList or not tOptions.mergeObjects):
-                    DecomposeActions(scene, armatureObj, tData, tOptions)
-            else:
-                log.warning("Object {:s} has no armature".format(obj.name) )
+            armatureObj = None
+            if tOptions.doBones:
+                armatureObj = FindArmature(obj)
+            # The first TData with this armature, None if this is the first object with it
+            armatureTData = None
+            if armatureObj and not tOptions.mergeObjects:
+                armatureTData = armaturesTData.get(armatureObj.name)
+                if armatureTData is None:
+                    armaturesTData[armatureObj.name] = tData
+                elif armatureTData is not tData and tOptions.doAnimations:
+                    sharedAnimationsTData.append(tData)
+
+            if cacheLoaded:
+                tData.MarkUsedMaterials(obj, None)
+                continue
 
-        # Decompose geometries
-        if tOptions.doGeometries:
-            savedValue = SetRestPosePosition(context, armatureObj)
-            DecomposeMesh(scene, obj, tData, tOptions, tData.errorsDict)                
-            RestorePosePosition(armatureObj, savedValue)
+            # First we need to populate the skeleton, then animations and then geometries
+            stats = tData.stats
+            if tOptions.doBones:
+                # Decompose armature and animations
+                if armatureTData is tData:
+                    # A lower LOD of an object with the same armature, already decomposed
+                    CheckArmature(armatureObj, obj, tOptions)
+                elif armatureTData:
+                    # Already decomposed in this export, copy them
+                    log.info("Armature {:s} already decomposed with {:s}".format(armatureObj.name, armatureTData.objectName))
+                    CheckArmature(armatureObj, obj, tOptions)
+                    tData.bonesMap = OrderedDict(armatureTData.bonesMap)
+                    if tOptions.doAnimations:
+                        tData.animationsList = list(armatureTData.animationsList)
+                    stats.count("sharedArmature")
+                elif armatureObj:
+                    if not tData.bonesMap or not tOptions.mergeObjects:
+                        with stats.timer("SetRestPosePosition"):
+                            restPose.Rest(armatureObj)
+                        with stats.timer("DecomposeArmature"):
+                            DecomposeArmature(scene, armatureObj, obj, tData, tOptions)
+                    if tOptions.doAnimations and (not tData.animationsList or not tOptions.mergeObjects):
+                        with stats.timer("SetPosePosition"):
+                            restPose.Pose(armatureObj)
+                        # The animations take the first half of the object progress
+                        steps = DecomposeActionsParallel(scene, armatureObj, tData, tOptions)
+                        for fraction in stats.timeSteps("DecomposeActions", steps):
+                            yield (meshIndex + 0.5 * fraction) / len(meshes)
+                else:
+                    log.warning("Object {:s} has no armature".format(obj.name) )
+
+            # Decompose geometries
+            if tOptions.doGeometries:
+                with stats.timer("SetRestPosePosition"):
+                    restPose.Rest(armatureObj)
+                steps = DecomposeMesh(scene, obj, tData, tOptions, tData.errorsDict)
+                for fraction in stats.timeSteps("DecomposeMesh", steps):
+                    yield (meshIndex + 0.5 + 0.5 * fraction) / len(meshes)
+    finally:
+        restPose.Restore()
+    
+    # Save the last container in the cache
+    if cacheKey:
+        with tData.stats.timer("CacheSave"):
+            cache.save(cacheKey, {k: getattr(tData, k) for k in CACHED_TDATA_FIELDS})
+    if cache:
+        log.info("Cache: {:d} loaded, {:d} decomposed".format(cache.hits, cache.misses))
+        # Delete the old files once, after the objects and the animations are saved
+        cache.evict()
+
+    # Remove the animations already in another TData (after the cache is saved, so the
+    # cache doesn't depend on which objects are exported together)
+    for tData in sharedAnimationsTData:
+        tData.animationsList = []
             
     # decompose any materials that were referenced by our exported objects
     if tOptions.doMaterials:
-        for material, isUsed in tData.materialsUsed.items():
-            if isUsed:
-                tData.materialsList.append( DecomposeMaterial(scene, material ) )
+        for tData in tDataList:
+            for material in bpy.data.materials:
+                if tData.materialsUsed.get(material):
+                    with tData.stats.timer("DecomposeMaterial"):
+                        tData.materialsList.append( DecomposeMaterial(scene, material ) )
 
 
 
@@ -14,6 +14,8 @@ import operator
 import struct
 import array
 import os
+import sys
+import tempfile
 
 import logging
 log = logging.getLogger("ExportLogger")
@@ -135,7 +137,26 @@ class MaskError(Exception):
 
 # --- Model classes ---
 
+# From a list of tuples (bone index, weight) returns a list of 4 tuples with the
+# greatest weights, normalized. Missing tuples are (0, 0.0).
+def NormalizeWeights(weights):
+    # Sort tuples (index, weight) by decreasing weight
+    sortedList = sorted(weights, key = operator.itemgetter(1), reverse = True)
+    # Sum the first 4 weights
+    totalWeight = sum([t[1] for t in sortedList[:4]])
+    # Keep only the first 4 tuples, normalize weights, add at least 4 tuples
+    normalized = []
+    for i in range(4):
+        t = (0, 0.0)
+        if totalWeight and i < len(sortedList):
+            t = sortedList[i]
+            t = (t[0], t[1] / totalWeight)
+        normalized.append(t) 
+    return normalized
+
 class UrhoVertex:
+    __slots__ = ('index', 'pos', 'normal', 'color', 'uv', 'uv2', 'tangent', 'weights')
+
     def __init__(self, tVertex, uVertexBuffer):
         # Note: cannot pass elementMask directly because it is immutable
         mask = 0
@@ -165,21 +186,10 @@ class UrhoVertex:
         self.tangent = tVertex.tangent
         if tVertex.tangent:
             mask |= ELEMENT_TANGENT
-        # TODO: move it out of here
         # List of 4 tuples: bone index (unsigned byte), blend weight (float)
         self.weights = []
         if not tVertex.weights is None:
-            # Sort tuples (index, weight) by decreasing weight
-            sortedList = sorted(tVertex.weights, key = operator.itemgetter(1), reverse = True)
-            # Sum the first 4 weights
-            totalWeight = sum([t[1] for t in sortedList[:4]])
-            # Keep only the first 4 tuples, normalize weights, add at least 4 tuples
-            for i in range(4):
-                t = (0, 0.0)
-                if totalWeight and i < len(sortedList):
-                    t = sortedList[i]
-                    t = (t[0], t[1] / totalWeight)
-                self.weights.append(t) 
+            self.weights = NormalizeWeights(tVertex.weights)
             mask |= ELEMENT_BLEND
 
         # Update buffer mask
@@ -337,6 +347,8 @@ class UrhoModel:
 # --- Animation classes ---
 
 class UrhoKeyframe:
+    __slots__ = ('time', 'position', 'rotation', 'scale')
+
     def __init__(self, tKeyframe, uTrack):
         # Note: cannot pass mask directly because it is immutable
         mask = 0
@@ -442,6 +454,12 @@ class UrhoExportOptions:
     def __init__(self):
         self.splitSubMeshes = False
         self.useStrictLods = True
+        # Remove from each track the channels which never leave the bind pose, and the 
+        # tracks without channels
+        self.stripBindChannels = False
+        # Max difference from the bind pose (position and scale in Urho units, rotation 
+        # in radians)
+        self.bindEpsilon = 1e-4
                 
 
 #--------------------
@@ -450,26 +468,78 @@ class UrhoExportOptions:
 
 class BinaryFileWriter:
 
-    # We try to write the file with a single API call to avoid
-    # the Editor crashing while reading a not completed file.
-    # We set the buffer to 1Mb (if unspecified is 64Kb, and it is
-    # 8Kb with multiple file.write calls)
+    # We never write directly the file to avoid the Editor crashing 
+    # while reading a not completed file. Data is accumulated in a 
+    # buffer and streamed in chunks to a temporary file in the same
+    # directory, when the file is complete the temporary file replaces
+    # the destination file in a single operation.
 
     # Constructor.
-    def __init__(self):
+    def __init__(self, chunkSize = 1024 * 1024):
         self.filename = None
+        self.tempFilename = None
+        self.file = None
         self.buffer = None
+        # Size of the buffer before we write it to the temporary file
+        self.chunkSize = chunkSize
     
-    # Open file stream.
-    def open(self, filename):
+    # Open file stream. If the final size of the file is known, the space
+    # for the temporary file is allocated now. The temporary file has an 
+    # unique name, more writers can write the same file at the same time.
+    def open(self, filename, size = None):
         self.filename = filename
+        fd, self.tempFilename = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(filename)),
+                                                 prefix = os.path.basename(filename) + ".", suffix = ".tmp")
+        self.file = os.fdopen(fd, "wb")
+        # mkstemp creates the file readable only by the user, use the default permissions
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(self.tempFilename, 0o666 & ~umask)
         self.buffer = array.array('B')
+        if size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(self.file.fileno(), 0, size)
+            except OSError:
+                pass
         return True
 
+    # Writes the buffer to the temporary file
+    def flush(self):
+        self.buffer.tofile(self.file)
+        del self.buffer[:]
+
+    # Writes the remaining data and replaces the destination file. On errors the 
+    # temporary file is deleted and the exception is raised. It can be called more
+    # times, only the first does something.
     def close(self):
-        file = open(self.filename, "wb", 1024 * 1024)
-        self.buffer.tofile(file)
-        file.close()
+        if self.file is None:
+            return
+        try:
+            self.flush()
+            # If we allocated too much space, cut the exceeding part
+            self.file.truncate()
+            self.file.close()
+            self.file = None
+            os.replace(self.tempFilename, self.filename)
+        except:
+            self.discard()
+            raise
+        self.tempFilename = None
+
+    # Closes and deletes the temporary file, the destination file is unchanged
+    def discard(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+        if self.tempFilename is not None:
+            try:
+                os.remove(self.tempFilename)
+            except OSError:
+                pass
+            self.tempFilename = None
 
     # Writes an ASCII string without terminator
     def writeAsciiStr(self, v):
@@ -499,6 +569,126 @@ class BinaryFileWriter:
     def writeFloat(self, v):
         self.buffer.extend(struct.pack("<f", v))
 
+    # Writes a bytes object (or a bytearray, a memoryview)
+    def writeBytes(self, v):
+        self.buffer.frombytes(v)
+        if len(self.buffer) >= self.chunkSize:
+            self.flush()
+
+    # Writes an array of numbers, little endian
+    def writeArray(self, v):
+        if sys.byteorder != "little":
+            v = array.array(v.typecode, v)
+            v.byteswap()
+        self.writeBytes(v.tobytes())
+
+#--------------------
+# Records packing
+#--------------------
+
+# Number of records (vertices, keyframes) packed with a single struct call
+PACK_BATCH_SIZE = 4096
+
+# Elements of a vertex record, in the order they are written. For each element: its
+# mask (0 if always present), struct format, function returning the element values.
+VERTEX_ELEMENTS = (
+    (ELEMENT_POSITION, "3f", operator.attrgetter("pos")),
+    (ELEMENT_NORMAL,   "3f", operator.attrgetter("normal")),
+    (ELEMENT_COLOR,    "4B", operator.attrgetter("color")),
+    (ELEMENT_UV1,      "2f", operator.attrgetter("uv")),
+    (ELEMENT_UV2,      "2f", operator.attrgetter("uv2")),
+    (ELEMENT_TANGENT,  "4f", operator.attrgetter("tangent")),
+    (ELEMENT_BWEIGHTS, "4f", lambda v: [w[1] for w in v.weights]),
+    (ELEMENT_BINDICES, "4B", lambda v: [w[0] for w in v.weights]) )
+
+# Elements of a morph vertex record (the tangent has no W)
+MORPH_VERTEX_ELEMENTS = (
+    (0,                "I",  lambda v: (v.index,)),
+    (ELEMENT_POSITION, "3f", operator.attrgetter("pos")),
+    (ELEMENT_NORMAL,   "3f", operator.attrgetter("normal")),
+    (ELEMENT_TANGENT,  "3f", lambda v: v.tangent[:3]) )
+
+# Elements of an animation keyframe record (the rotation is W, X, Y, Z)
+KEYFRAME_ELEMENTS = (
+    (0,                "f",  lambda k: (k.time,)),
+    (TRACK_POSITION,   "3f", operator.attrgetter("position")),
+    (TRACK_ROTATION,   "4f", operator.attrgetter("rotation")),
+    (TRACK_SCALE,      "3f", operator.attrgetter("scale")) )
+
+# Packs records made of the elements selected by a mask. The struct of a record is
+# built once for each mask and the records are packed in batches with one call.
+class RecordPacker:
+    def __init__(self, elements, mask):
+        formats = []
+        # Functions returning the values of each element in the record
+        self.getters = []
+        for elementMask, format, getter in elements:
+            if not elementMask or (mask & elementMask):
+                formats.append(format)
+                self.getters.append(getter)
+        # Struct format of one record
+        self.format = "".join(formats)
+        # Size in bytes of one record
+        self.size = struct.calcsize("<" + self.format)
+        # Struct of a full batch of records
+        self.batchStruct = struct.Struct("<" + self.format * PACK_BATCH_SIZE)
+
+    # Writes the records of all the items, one batch at a time
+    def write(self, fw, items):
+        # Buffer of a batch, reused by all the batches
+        data = bytearray(self.batchStruct.size)
+        getters = self.getters
+        for start in range(0, len(items), PACK_BATCH_SIZE):
+            batch = items[start : start + PACK_BATCH_SIZE]
+            values = []
+            for item in batch:
+                for getter in getters:
+                    values.extend(getter(item))
+            if len(batch) == PACK_BATCH_SIZE:
+                batchStruct = self.batchStruct
+            else:
+                batchStruct = struct.Struct("<" + self.format * len(batch))
+            batchStruct.pack_into(data, 0, *values)
+            fw.writeBytes(memoryview(data)[:batchStruct.size])
+
+# Cache of the RecordPacker of each elements tuple and mask
+recordPackers = {}
+
+def GetRecordPacker(elements, mask):
+    try:
+        return recordPackers[(elements, mask)]
+    except KeyError:
+        packer = RecordPacker(elements, mask)
+        recordPackers[(elements, mask)] = packer
+        return packer
+
+
+# Returns the size in bytes of the model file, see UrhoWriteModel
+def UrhoModelFileSize(model):
+    size = 4 + 4
+    for buffer in model.vertexBuffers:
+        size += 4 * 4 + len(buffer.vertices) * GetRecordPacker(VERTEX_ELEMENTS, buffer.elementMask).size
+    size += 4
+    for buffer in model.indexBuffers:
+        size += 4 * 2 + len(buffer.indexes) * buffer.indexSize
+    size += 4
+    for geometry in model.geometries:
+        size += 4 + 4 * len(geometry.boneMap) + 4 + 4 * 6 * len(geometry.lodLevels)
+    size += 4
+    for morph in model.morphs:
+        size += len(bytes(morph.name, "ascii")) + 1 + 4
+        for morphBuffer in morph.vertexBufferMap.values():
+            mask = (morphBuffer.elementMask & MORPH_ELEMENTS)
+            size += 4 * 3 + len(morphBuffer.vertices) * GetRecordPacker(MORPH_VERTEX_ELEMENTS, mask).size
+    size += 4
+    for bone in model.bones:
+        size += len(bytes(bone.name, "ascii")) + 1 + 4 + 4 * (3 + 4 + 3 + 12) + 1
+        if bone.collisionMask & BONE_BOUNDING_SPHERE:
+            size += 4
+        if bone.collisionMask & BONE_BOUNDING_BOX:
+            size += 4 * 6
+    size += 4 * 6 + 4 * 3 * len(model.geometries)
+    return size
 
 def UrhoWriteModel(model, filename):
 
@@ -508,11 +698,21 @@ def UrhoWriteModel(model, filename):
 
     fw = BinaryFileWriter()
     try:
-        fw.open(filename)
+        fw.open(filename, UrhoModelFileSize(model))
     except Exception as e:
-        log.error("Cannot open file {:s} {:s}".format(filename, e))
+        log.error("Cannot open file {:s} {:s}".format(filename, str(e)))
         return
 
+    try:
+        UrhoWriteModelData(fw, model)
+        fw.close()
+    except Exception as e:
+        fw.discard()
+        log.error("Cannot write file {:s} {:s}".format(filename, str(e)))
+
+# Writes the content of a model file
+def UrhoWriteModelData(fw, model):
+
     # File Identifier
     fw.writeAsciiStr("UMDL")
     
@@ -533,29 +733,7 @@ def UrhoWriteModel(model, filename):
         else:
             fw.writeUInt(0)
         # Vertex data (vertex count * vertex size)
-        for vertex in buffer.vertices:
-            if mask & ELEMENT_POSITION:
-                fw.writeVector3(vertex.pos)
-            if mask & ELEMENT_NORMAL:
-                fw.writeVector3(vertex.normal)
-            if mask & ELEMENT_COLOR:
-                for i in range(4):
-                    fw.writeUByte(vertex.color[i])
-            if mask & ELEMENT_UV1:
-                for i in range(2):
-                    fw.writeFloat(vertex.uv[i])
-            if mask & ELEMENT_UV2:
-                for i in range(2):
-                    fw.writeFloat(vertex.uv2[i])
-            if mask & ELEMENT_TANGENT:
-                fw.writeVector3(vertex.tangent)
-                fw.writeFloat(vertex.tangent.w)
-            if mask & ELEMENT_BWEIGHTS:
-                for i in range(4):
-                    fw.writeFloat(vertex.weights[i][1])
-            if mask & ELEMENT_BINDICES:
-                for i in range(4):
-                    fw.writeUByte(vertex.weights[i][0])
+        GetRecordPacker(VERTEX_ELEMENTS, mask).write(fw, buffer.vertices)
 
     # Number of index buffers
     fw.writeUInt(len(model.indexBuffers))
@@ -566,11 +744,10 @@ def UrhoWriteModel(model, filename):
         # Index size (2 for 16-bit indices, 4 for 32-bit indices)
         fw.writeUInt(buffer.indexSize)
         # Index data (index count * index size)
-        for i in buffer.indexes:
-            if buffer.indexSize == 2:
-                fw.writeUShort(i)
-            else:
-                fw.writeUInt(i)
+        if buffer.indexSize == 2:
+            fw.writeArray(array.array('H', buffer.indexes))
+        else:
+            fw.writeArray(array.array('I', buffer.indexes))
 
     # Number of geometries
     fw.writeUInt(len(model.geometries))
@@ -616,19 +793,8 @@ def UrhoWriteModel(model, filename):
             fw.writeUInt(mask)
             # Vertex count
             fw.writeUInt(len(morphBuffer.vertices))
-            # For each vertex:
-            for vertex in morphBuffer.vertices:
-                # Moprh vertex index
-                fw.writeUInt(vertex.index)
-                # Moprh vertex Position
-                if mask & ELEMENT_POSITION:
-                    fw.writeVector3(vertex.pos)
-                # Moprh vertex Normal
-                if mask & ELEMENT_NORMAL:
-                    fw.writeVector3(vertex.normal)
-                # Moprh vertex Tangent
-                if mask & ELEMENT_TANGENT:
-                    fw.writeVector3(vertex.tangent)
+            # For each vertex: index, position, normal, tangent
+            GetRecordPacker(MORPH_VERTEX_ELEMENTS, mask).write(fw, morphBuffer.vertices)
                     
     # Number of bones (may be 0)
     fw.writeUInt(len(model.bones))
@@ -668,8 +834,6 @@ def UrhoWriteModel(model, filename):
     for geometry in model.geometries:
         # Geometry center
         fw.writeVector3(geometry.center)
-    
-    fw.close()
 
     
 def UrhoWriteAnimation(animation, filename):
@@ -682,9 +846,19 @@ def UrhoWriteAnimation(animation, filename):
     try:
         fw.open(filename)
     except Exception as e:
-        log.error("Cannot open file {:s} {:s}".format(filename, e))
+        log.error("Cannot open file {:s} {:s}".format(filename, str(e)))
         return
 
+    try:
+        UrhoWriteAnimationData(fw, animation)
+        fw.close()
+    except Exception as e:
+        fw.discard()
+        log.error("Cannot write file {:s} {:s}".format(filename, str(e)))
+
+# Writes the content of an animation file
+def UrhoWriteAnimationData(fw, animation):
+
     # File Identifier
     fw.writeAsciiStr("UANI")
     # Animation name
@@ -706,21 +880,8 @@ def UrhoWriteAnimation(animation, filename):
         
         # Number of tracks
         fw.writeUInt(len(track.keyframes))
-        # For each keyframe
-        for keyframe in track.keyframes:
-            # Time position in seconds: float
-            fw.writeFloat(keyframe.time)
-            # Keyframe position
-            if mask & TRACK_POSITION:
-                fw.writeVector3(keyframe.position)
-            # Keyframe rotation
-            if mask & TRACK_ROTATION:
-                fw.writeQuaternion(keyframe.rotation)
-            # Keyframe scale
-            if mask & TRACK_SCALE:
-                fw.writeVector3(keyframe.scale)
-
-    fw.close()
+        # For each keyframe: time position in seconds, position, rotation, scale
+        GetRecordPacker(KEYFRAME_ELEMENTS, mask).write(fw, track.keyframes)
 
         
 def UrhoWriteMaterial(material, filename, useStandardDirs):
@@ -829,10 +990,108 @@ def UrhoWriteMaterialsList(materialsIndices, materialsFilenames, filename):
 # NOTE: if we use index() we must have __EQ__ in the class.
 # NOTE: don't use index(), it's slow.
 
+#--------------------
+# Bones partition
+#--------------------
+
+# Part of the triangles of a LOD level, it is used like a TLodLevel
+class UrhoLodLevelPart:
+    def __init__(self, distance):
+        # Distance above which we draw this LOD
+        self.distance = distance
+        # Set of all vertex indices used by the triangles of this part
+        self.indexSet = set()
+        # List of triangles (triples of vertex indices)
+        self.triangleList = []
+
+# Splits the triangles of the LOD levels of a geometry in parts, each part uses at most
+# MAX_SKIN_MATRICES bones so it can be drawn with hardware skinning. Returns a list of 
+# parts, each part is a list of LOD levels (the same number of the geometry, but some
+# can be empty). If the geometry doesn't need to be split returns its LOD levels as the
+# only part.
+def PartitionBones(lodLevels, verticesList):
+
+    # Map vertex index to the set of bones used by the vertex (only the bones with a
+    # weight, after the weights are reduced to 4)
+    vertexBones = {}
+    usedBones = set()
+    for lodLevel in lodLevels:
+        for tVertexIndex in lodLevel.indexSet:
+            if tVertexIndex in vertexBones:
+                continue
+            bones = frozenset()
+            weights = verticesList[tVertexIndex].weights
+            if weights:
+                bones = frozenset(b for b, w in NormalizeWeights(weights) if w > 0.0)
+            vertexBones[tVertexIndex] = bones
+            usedBones.update(bones)
+
+    if len(usedBones) <= MAX_SKIN_MATRICES:
+        return [lodLevels]
+
+    # List of parts, each one is a list of UrhoLodLevelPart
+    parts = []
+    # Set of the bones used by each part
+    partsBones = []
+    
+    for i, lodLevel in enumerate(lodLevels):
+        # Add the new LOD level to all the parts
+        for part in parts:
+            part.append(UrhoLodLevelPart(lodLevel.distance))
+
+        # Put each triangle in the first part which can contain its bones (the triangles
+        # are in the optimized order so near triangles go in the same part). In the next
+        # LODs first search a part which already has all the bones (usually the part of
+        # the same area in the first LOD), so we rarely need a part without the first LODs.
+        for triangle in lodLevel.triangleList:
+            triangleBones = vertexBones[triangle[0]] | vertexBones[triangle[1]] | vertexBones[triangle[2]]
+            partIndex = None
+            if i > 0:
+                partIndex = next((p for p, bones in enumerate(partsBones) if triangleBones <= bones), None)
+            if partIndex is None:
+                partIndex = next((p for p, bones in enumerate(partsBones) 
+                                  if len(bones | triangleBones) <= MAX_SKIN_MATRICES), None)
+            if partIndex is None:
+                # No part has enough room, add a new part. Its previous LODs are empty, so the
+                # part is not drawn at their distances (UrhoExport calculates its center on 
+                # its first LOD with triangles)
+                partIndex = len(parts)
+                parts.append([UrhoLodLevelPart(l.distance) for l in lodLevels[:i+1]])
+                partsBones.append(set())
+            
+            partsBones[partIndex].update(triangleBones)
+            lodLevelPart = parts[partIndex][i]
+            lodLevelPart.triangleList.append(triangle)
+            lodLevelPart.indexSet.update(triangle)
+
+    return parts
+
 #--------------------
 # Urho exporter
 #--------------------
 
+# Returns the mask of the channels of a track which are equal (within epsilon) to the 
+# bind pose of its bone in all the keyframes. At runtime these channels would only 
+# set the bone to its bind pose.
+def BindChannelsMask(uTrack, tBone, epsilon):
+    mask = uTrack.mask
+    keyframes = uTrack.keyframes
+    if mask & TRACK_POSITION:
+        position = tBone.bindPosition
+        if any((k.position - position).length > epsilon for k in keyframes):
+            mask &= ~TRACK_POSITION
+    if mask & TRACK_ROTATION:
+        # Angle between quaternions: 2 * acos(|dot|)
+        minDot = cos(epsilon / 2.0)
+        rotation = tBone.bindRotation
+        if any(abs(k.rotation.dot(rotation)) < minDot for k in keyframes):
+            mask &= ~TRACK_ROTATION
+    if mask & TRACK_SCALE:
+        scale = tBone.bindScale
+        if any((k.scale - scale).length > epsilon for k in keyframes):
+            mask &= ~TRACK_SCALE
+    return mask
+
 def UrhoExport(tData, uExportOptions, uExportData, errorsDict):
 
     try:
@@ -890,6 +1149,12 @@ def UrhoExport(tData, uExportOptions, uExportData, errorsDict):
     if uExportOptions.splitSubMeshes or (totalVertices > 65535 and maxLodVertices <= 65535):
         useOneBuffer = False
 
+    # If the bones in the skeleton are too many for the hardware skinning, each geometry
+    # uses its own bones indices, so it cannot share vertices with other geometries
+    remapBones = (len(uModel.bones) > MAX_SKIN_MATRICES)
+    if remapBones:
+        useOneBuffer = False
+
     # Urho lod vertex buffer
     vertexBuffer = None
     # Urho lod index buffer
@@ -900,192 +1165,186 @@ def UrhoExport(tData, uExportOptions, uExportData, errorsDict):
     # Maps old vertex index to Urho vertex buffer index and Urho vertex index
     modelIndexMap = {}
     
+    # Index of the TGeometry of each UrhoGeometry
+    geometrySources = []
+
     # For each geometry
-    for tGeometry in tData.geometriesList:
+    for tGeometryIndex, tGeometry in enumerate(tData.geometriesList):
+
+        # Split the geometry in parts if it uses too many bones
+        parts = [tGeometry.lodLevels]
+        if remapBones:
+            parts = PartitionBones(tGeometry.lodLevels, tData.verticesList)
+            if len(parts) > 1:
+                log.info("Object {:s} Geometry{:d} split in {:d} parts with at most {:d} bones"
+                         .format(uModel.name, tGeometryIndex, len(parts), MAX_SKIN_MATRICES))
         
-        uGeometry = UrhoGeometry()
-        uModel.geometries.append(uGeometry)
-        geomIndex = len(uModel.geometries) - 1
-
-        # Start value for geometry center (one for each geometry)
-        center = Vector((0.0, 0.0, 0.0))
+        # For each part (each one is a new Urho geometry)
+        for lodLevels in parts:
         
-        # For each LOD level
-        for i, tLodLevel in enumerate(tGeometry.lodLevels):
-            uLodLevel = UrhoLodLevel()
-            uGeometry.lodLevels.append(uLodLevel)
+            uGeometry = UrhoGeometry()
+            uModel.geometries.append(uGeometry)
+            geomIndex = len(uModel.geometries) - 1
+            geometrySources.append(tGeometryIndex)
+
+            # Start value for geometry center (one for each geometry)
+            center = Vector((0.0, 0.0, 0.0))
+            # First LOD with triangles, a part of a geometry split by bones can have the 
+            # first LODs empty. The center and the new vertices check start from this LOD.
+            firstLod = next((i for i, l in enumerate(lodLevels) if l.triangleList), 0)
+        
+            # For each LOD level
+            for i, tLodLevel in enumerate(lodLevels):
+                uLodLevel = UrhoLodLevel()
+                uGeometry.lodLevels.append(uLodLevel)
             
-            if i == 0 and tLodLevel.distance != 0.0:
-                # Note: if we miss a LOD, its range will be covered by the following LOD (which is this one),
-                # this can can overlapping between LODs of different geometries
-                log.error("First LOD of object {:s} Geometry{:d} must have 0.0 distance (found {:.3f})"
-                          .format(uModel.name, geomIndex, tLodLevel.distance))
-
-            uLodLevel.distance = tLodLevel.distance
-            uLodLevel.primitiveType = TRIANGLE_LIST
-
-            # If needed add a new vertex buffer (only for first LOD of a geometry)
-            if vertexBuffer is None or (i == 0 and not useOneBuffer):
-                vertexBuffer = UrhoVertexBuffer()
-                uModel.vertexBuffers.append(vertexBuffer)
-                uVerticesMap = {}
-
-            # If needed add a new index buffer (only for first LOD of a geometry)
-            if indexBuffer is None or (i == 0 and not useOneBuffer):
-                indexBuffer = UrhoIndexBuffer()
-                uModel.indexBuffers.append(indexBuffer)
-                uLodLevel.startIndex = 0
-            else:
-                uLodLevel.startIndex = len(indexBuffer.indexes)    
+                if i == 0 and tLodLevel.distance != 0.0:
+                    # Note: if we miss a LOD, its range will be covered by the following LOD (which is this one),
+                    # this can can overlapping between LODs of different geometries
+                    log.error("First LOD of object {:s} Geometry{:d} must have 0.0 distance (found {:.3f})"
+                              .format(uModel.name, geomIndex, tLodLevel.distance))
+
+                uLodLevel.distance = tLodLevel.distance
+                uLodLevel.primitiveType = TRIANGLE_LIST
+
+                # If needed add a new vertex buffer (only for first LOD of a geometry)
+                if vertexBuffer is None or (i == 0 and not useOneBuffer):
+                    vertexBuffer = UrhoVertexBuffer()
+                    uModel.vertexBuffers.append(vertexBuffer)
+                    uVerticesMap = {}
+
+                # If needed add a new index buffer (only for first LOD of a geometry)
+                if indexBuffer is None or (i == 0 and not useOneBuffer):
+                    indexBuffer = UrhoIndexBuffer()
+                    uModel.indexBuffers.append(indexBuffer)
+                    uLodLevel.startIndex = 0
+                else:
+                    uLodLevel.startIndex = len(indexBuffer.indexes)    
 
-            # Set how many indices the LOD level will use
-            uLodLevel.countIndex = len(tLodLevel.triangleList) * 3
-            # Set lod vertex and index buffers
-            uLodLevel.vertexBuffer = len(uModel.vertexBuffers) - 1
-            uLodLevel.indexBuffer = len(uModel.indexBuffers) - 1
+                # Set how many indices the LOD level will use
+                uLodLevel.countIndex = len(tLodLevel.triangleList) * 3
+                # Set lod vertex and index buffers
+                uLodLevel.vertexBuffer = len(uModel.vertexBuffers) - 1
+                uLodLevel.indexBuffer = len(uModel.indexBuffers) - 1
             
-            # Maps old vertex index to new vertex index in the new Urho buffer
-            indexMap = {}
+                # Maps old vertex index to new vertex index in the new Urho buffer
+                indexMap = {}
             
-            # Errors helpers
-            warningNewVertices = False
+                # Errors helpers
+                warningNewVertices = False
 
-            # Add vertices to the vertex buffer
-            for tVertexIndex in tLodLevel.indexSet:
+                # Add vertices to the vertex buffer
+                for tVertexIndex in tLodLevel.indexSet:
             
-                tVertex = tData.verticesList[tVertexIndex]
-
-                # Create a Urho vertex
-                try:
-                    uVertex = UrhoVertex(tVertex, vertexBuffer)
-                except MaskError as e:
-                    if not tVertex.blenderIndex is None:
-                        errorsIndices.add(tVertex.blenderIndex)
-                    log.warning("Incompatible vertex element mask in object {:s} ({:s})".format(uModel.name, e))
+                    tVertex = tData.verticesList[tVertexIndex]
+
+                    # Create a Urho vertex
+                    try:
+                        uVertex = UrhoVertex(tVertex, vertexBuffer)
+                    except MaskError as e:
+                        if not tVertex.blenderIndex is None:
+                            errorsIndices.add(tVertex.blenderIndex)
+                        log.warning("Incompatible vertex element mask in object {:s} ({:s})".format(uModel.name, e))
                                 
-                # All that this code do is "uVertexIndex = vertexBuffer.vertices.index(uVertex)", but we use
-                # a map to speed up.
+                    # All that this code do is "uVertexIndex = vertexBuffer.vertices.index(uVertex)", but we use
+                    # a map to speed up.
             
-                # Get an hash of the vertex (more vertices can have the same hash)
-                uVertexHash = hash(uVertex)
+                    # Get an hash of the vertex (more vertices can have the same hash)
+                    uVertexHash = hash(uVertex)
             
-                try:
-                    # Get the list of vertices indices with the same hash
-                    uVerticesMapList = uVerticesMap[uVertexHash]
-                except KeyError:
-                    # If the hash is not mapped, create a new list (we could use a set but a list is faster)
-                    uVerticesMapList = []
-                    uVerticesMap[uVertexHash] = uVerticesMapList
+                    try:
+                        # Get the list of vertices indices with the same hash
+                        uVerticesMapList = uVerticesMap[uVertexHash]
+                    except KeyError:
+                        # If the hash is not mapped, create a new list (we could use a set but a list is faster)
+                        uVerticesMapList = []
+                        uVerticesMap[uVertexHash] = uVerticesMapList
                 
-                uVertexIndex = None
-                if i == 0 or uExportOptions.useStrictLods:
-                    # For each index in the list, get the corresponding vertex and test if it is equal to tVertex.
-                    # If Position, Normal and UV are the same, it must be the same vertex, get its index.
-                    for ivl in uVerticesMapList:
-                        if vertexBuffer.vertices[ivl].AlmostEqual(uVertex):
-                            uVertexIndex = ivl
-                            break
-                else:
-                    # For successive LODs, we are more permissive, the vertex position must be the same, but for
-                    # the normal and UV we will search the best match in the vertices available.
-                    bestLodError = INFINITY
-                    for ivl in uVerticesMapList:
-                        lodError = vertexBuffer.vertices[ivl].LodError(uVertex)
-                        if lodError < bestLodError:
-                            bestLodError = lodError
-                            uVertexIndex = ivl
-
-                # If we cannot find it, the vertex is new, add it to the list, and its index to the map list
-                if uVertexIndex is None:
-                    uVertexIndex = len(vertexBuffer.vertices)
-                    vertexBuffer.vertices.append(uVertex)
-                    uVerticesMapList.append(uVertexIndex)
-                    if i != 0:
-                        warningNewVertices = True
+                    uVertexIndex = None
+                    if i <= firstLod or uExportOptions.useStrictLods:
+                        # For each index in the list, get the corresponding vertex and test if it is equal to tVertex.
+                        # If Position, Normal and UV are the same, it must be the same vertex, get its index.
+                        for ivl in uVerticesMapList:
+                            if vertexBuffer.vertices[ivl].AlmostEqual(uVertex):
+                                uVertexIndex = ivl
+                                break
+                    else:
+                        # For successive LODs, we are more permissive, the vertex position must be the same, but for
+                        # the normal and UV we will search the best match in the vertices available.
+                        bestLodError = INFINITY
+                        for ivl in uVerticesMapList:
+                            lodError = vertexBuffer.vertices[ivl].LodError(uVertex)
+                            if lodError < bestLodError:
+                                bestLodError = lodError
+                                uVertexIndex = ivl
+
+                    # If we cannot find it, the vertex is new, add it to the list, and its index to the map list
+                    if uVertexIndex is None:
+                        uVertexIndex = len(vertexBuffer.vertices)
+                        vertexBuffer.vertices.append(uVertex)
+                        uVerticesMapList.append(uVertexIndex)
+                        if i > firstLod:
+                            warningNewVertices = True
                 
-                # Populate the 'old tVertex index' to 'new uVertex index' map
-                if not tVertexIndex in indexMap:
-                    indexMap[tVertexIndex] = uVertexIndex
-                elif indexMap[tVertexIndex] != uVertexIndex:
-                    log.error("Conflict in vertex index map of object {:s}".format(uModel.name))
+                    # Populate the 'old tVertex index' to 'new uVertex index' map
+                    if not tVertexIndex in indexMap:
+                        indexMap[tVertexIndex] = uVertexIndex
+                    elif indexMap[tVertexIndex] != uVertexIndex:
+                        log.error("Conflict in vertex index map of object {:s}".format(uModel.name))
                 
-                '''    
-                # Limit weights count to 4 and normalize them
-                if (vertexBuffer.elementMask & ELEMENT_BLEND) == ELEMENT_BLEND:
-                    # Sort tuples (index, weight) by decreasing weight
-                    sortedList = sorted(uVertex.weights, key = operator.itemgetter(1), reverse = True)
-                    # Cleat the vertex weights list and delete the old tuples (maybe)
-                    uVertex.weights[:] = []
-                    # Sum the first 4 weights
-                    totalWeight = sum([t[1] for t in sortedList[:4]])
-                    # Keep only the first 4 tuples, map index, normalize weights, add at least 4 tuples
-                    for i in range(4):
-                        t = (0, 0.0)
-                        if i < len(sortedList):
-                            t = sortedList[i]
-                            t = (t[0], t[1] / totalWeight)
-                        uVertex.weights.append(t) 
-                '''
+                    '''    
+                    # Limit weights count to 4 and normalize them
+                    if (vertexBuffer.elementMask & ELEMENT_BLEND) == ELEMENT_BLEND:
+                        # Sort tuples (index, weight) by decreasing weight
+                        sortedList = sorted(uVertex.weights, key = operator.itemgetter(1), reverse = True)
+                        # Cleat the vertex weights list and delete the old tuples (maybe)
+                        uVertex.weights[:] = []
+                        # Sum the first 4 weights
+                        totalWeight = sum([t[1] for t in sortedList[:4]])
+                        # Keep only the first 4 tuples, map index, normalize weights, add at least 4 tuples
+                        for i in range(4):
+                            t = (0, 0.0)
+                            if i < len(sortedList):
+                                t = sortedList[i]
+                                t = (t[0], t[1] / totalWeight)
+                            uVertex.weights.append(t) 
+                    '''
                 
-                # Update the model bounding box (common to all geometries)
-                if vertexBuffer.elementMask & ELEMENT_POSITION:
-                    uModel.boundingBox.merge(uVertex.pos)
+                    # Update the model bounding box (common to all geometries)
+                    if vertexBuffer.elementMask & ELEMENT_POSITION:
+                        uModel.boundingBox.merge(uVertex.pos)
 
-            if warningNewVertices:
-                log.warning("LOD {:d} of object {:s} Geometry{:d} has new vertices.".format(i, uModel.name, geomIndex))
+                if warningNewVertices:
+                    log.warning("LOD {:d} of object {:s} Geometry{:d} has new vertices.".format(i, uModel.name, geomIndex))
                             
-            # Add the local vertex map to the global map
-            for oldIndex, newIndex in indexMap.items():
-                # We create a map: Map[old index] = Set( Tuple(new buffer index, new vertex index) )
-                # Search if this vertex index was already mapped, get its Set or add a new one.
-                # We need a Set because a vertex can be copied in more than one vertex buffer.
-                try:
-                    vbviSet = modelIndexMap[oldIndex]
-                except KeyError:
-                    vbviSet = set()
-                    modelIndexMap[oldIndex] = vbviSet
-                # Add a tuple to the Set: new buffer index, new vertex index
-                vbvi = (uLodLevel.vertexBuffer, newIndex)
-                vbviSet.add(vbvi)
+                # Add the local vertex map to the global map
+                for oldIndex, newIndex in indexMap.items():
+                    # We create a map: Map[old index] = Set( Tuple(new buffer index, new vertex index) )
+                    # Search if this vertex index was already mapped, get its Set or add a new one.
+                    # We need a Set because a vertex can be copied in more than one vertex buffer.
+                    try:
+                        vbviSet = modelIndexMap[oldIndex]
+                    except KeyError:
+                        vbviSet = set()
+                        modelIndexMap[oldIndex] = vbviSet
+                    # Add a tuple to the Set: new buffer index, new vertex index
+                    vbvi = (uLodLevel.vertexBuffer, newIndex)
+                    vbviSet.add(vbvi)
                 
-            # Add indices to the index buffer
-            centerCount = 0
-            for triangle in tLodLevel.triangleList:
-                for tVertexIndex in triangle:
-                    uVertexIndex = indexMap[tVertexIndex]
-                    indexBuffer.indexes.append(uVertexIndex)
-                    # Update geometry center (only for the first LOD)
-                    if (i == 0) and (vertexBuffer.elementMask & ELEMENT_POSITION):
-                        centerCount += 1
-                        center += vertexBuffer.vertices[uVertexIndex].pos;
-
-            # Update geometry center (only for the first LOD)
-            if i == 0 and centerCount:
-                uGeometry.center = center / centerCount;
-                        
-            # If this geometry has bone weights but the number of total bones is over the limit 
-            # then let's hope our geometry uses only a subset of the total bones within the limit.
-            # If this is true then we can remap the original bone index, which can be over the 
-            # limit, to a local, in this geometry, bone index within the limit.
-            if (len(uModel.bones) > MAX_SKIN_MATRICES and 
-               (vertexBuffer.elementMask & ELEMENT_BLEND) == ELEMENT_BLEND):
-                # For each vertex in the buffer
-                for vertex in vertexBuffer.vertices:
-                    for i, (boneIndex, weight) in enumerate(vertex.weights):
-                        # Search if the bone is already present in the map
-                        try:
-                            newBoneIndex = uGeometry.boneMap.index(boneIndex)
-                        except ValueError:
-                            # New bone, add it in the map
-                            newBoneIndex = len(uGeometry.boneMap)
-                            if newBoneIndex < MAX_SKIN_MATRICES:
-                                uGeometry.boneMap.append(boneIndex)
-                            else:
-                                log.error("Too many bones in object {:s} geometry {:d}.".format(uModel.name, i))
-                                newBoneIndex = 0
-                                weight = 0.0
-                        # Change from the global bone index to the local bone index
-                        vertex.weights[i] = (newBoneIndex, weight)
+                # Add indices to the index buffer
+                centerCount = 0
+                for triangle in tLodLevel.triangleList:
+                    for tVertexIndex in triangle:
+                        uVertexIndex = indexMap[tVertexIndex]
+                        indexBuffer.indexes.append(uVertexIndex)
+                        # Update geometry center (only for the first LOD with triangles)
+                        if (i == firstLod) and (vertexBuffer.elementMask & ELEMENT_POSITION):
+                            centerCount += 1
+                            center += vertexBuffer.vertices[uVertexIndex].pos;
+
+                # Update geometry center (only for the first LOD with triangles)
+                if i == firstLod and centerCount:
+                    uGeometry.center = center / centerCount;
 
     if tData.geometriesList and uModel.boundingBox.min is None:
         uModel.boundingBox.min = Vector((0.0, 0.0, 0.0))
@@ -1129,6 +1388,39 @@ def UrhoExport(tData, uExportOptions, uExportData, errorsDict):
                     uBone.collisionMask |= BONE_BOUNDING_BOX
                     uBone.boundingBox.merge(boneVertexPos)
 
+    # If the bones are too many for the hardware skinning, remap the skeleton bone index
+    # to a local bone index in each geometry. PartitionBones has already split the
+    # geometries so that each one uses a subset of bones within the limit.
+    if remapBones:
+        for geomIndex, uGeometry in enumerate(uModel.geometries):
+            if not uGeometry.lodLevels:
+                continue
+            # Each geometry has its own vertex buffer
+            vertexBuffer = uModel.vertexBuffers[uGeometry.lodLevels[0].vertexBuffer]
+            if ((vertexBuffer.elementMask or 0) & ELEMENT_BLEND) != ELEMENT_BLEND:
+                continue
+            # Map the skeleton bone index to the local bone index
+            boneIndexMap = {}
+            for vertex in vertexBuffer.vertices:
+                for i, (boneIndex, weight) in enumerate(vertex.weights):
+                    # Bones without weight are not needed in the map
+                    if weight == 0.0:
+                        vertex.weights[i] = (0, 0.0)
+                        continue
+                    try:
+                        newBoneIndex = boneIndexMap[boneIndex]
+                    except KeyError:
+                        # New bone, add it in the map
+                        newBoneIndex = len(uGeometry.boneMap)
+                        if newBoneIndex < MAX_SKIN_MATRICES:
+                            boneIndexMap[boneIndex] = newBoneIndex
+                            uGeometry.boneMap.append(boneIndex)
+                        else:
+                            log.error("Too many bones in object {:s} Geometry{:d}.".format(uModel.name, geomIndex))
+                            newBoneIndex = 0
+                            weight = 0.0
+                    # Change from the global bone index to the local bone index
+                    vertex.weights[i] = (newBoneIndex, weight)
     
     for tMorph in tData.morphsList:
         uMorph = UrhoVertexMorph()
@@ -1189,6 +1481,8 @@ def UrhoExport(tData, uExportOptions, uExportData, errorsDict):
         uAnimation = UrhoAnimation()
         uAnimation.name = tAnimation.name
         uAnimation.length = None
+        # First track removed by the stripping and its mask before
+        strippedTrack = None
         
         for tTrack in tAnimation.tracks:
             uTrack = UrhoTrack()
@@ -1205,13 +1499,33 @@ def UrhoExport(tData, uExportOptions, uExportData, errorsDict):
             # Make sure keyframes are sorted from beginning to end
             uTrack.keyframes.sort(key = operator.attrgetter('time'))
 
-            # Add only tracks with keyframes
-            if uTrack.keyframes and uTrack.mask:
+            if not uTrack.keyframes or not uTrack.mask:
+                continue
+
+            # Update animation length (also with the tracks removed below)
+            length = uTrack.keyframes[-1].time
+            if uAnimation.length is None or uAnimation.length < length:
+                uAnimation.length = length
+
+            if uExportOptions.stripBindChannels:
+                tBone = tData.bonesMap.get(uTrack.name)
+                if tBone:
+                    mask = uTrack.mask
+                    uTrack.mask &= ~BindChannelsMask(uTrack, tBone, uExportOptions.bindEpsilon)
+                    if not uTrack.mask and strippedTrack is None:
+                        strippedTrack = (uTrack, mask)
+
+            # Add only tracks with channels
+            if uTrack.mask:
                 uAnimation.tracks.append(uTrack)
-                # Update animation length
-                length = uTrack.keyframes[-1].time
-                if uAnimation.length is None or uAnimation.length < length:
-                    uAnimation.length = length
+
+        # An animation always at the bind pose (e.g. a static pose) keeps its first track,
+        # the file is needed even if it doesn't move the bones
+        if not uAnimation.tracks and strippedTrack:
+            uTrack, uTrack.mask = strippedTrack
+            uAnimation.tracks.append(uTrack)
+            log.warning("Animation {:s} is always at the bind pose, only track {:s} is kept"
+                        .format(uAnimation.name, uTrack.name))
         
         # Add only animations with tracks
         if uAnimation.tracks:
@@ -1271,6 +1585,10 @@ def UrhoExport(tData, uExportOptions, uExportData, errorsDict):
 
         uMaterials.append(uMaterial)
 
+    # If a geometry was split in parts, each part uses the material of the original geometry
+    if len(geometrySources) != len(tData.geometriesList) and len(uModel.materialsIndices) >= len(tData.geometriesList):
+        uModel.materialsIndices = [uModel.materialsIndices[i] for i in geometrySources]
+
        
 
  
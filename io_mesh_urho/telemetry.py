@@ -0,0 +1,183 @@
+
+#
+# This script is licensed as public domain.
+#
+
+# Telemetry of an export: for each exported object (TData) the time and the calls of
+# each stage (the stages are named as the functions: DecomposeMesh, GenerateTangents,
+# UrhoExport, UrhoWriteModel...) and some counters (vertices, triangles, bones, frames,
+# bytes written...). It is always on, the cost is two time() calls for each stage.
+# It doesn't use Blender data, the stats of an object go with its TData in the export
+# processes and come back with the result.
+
+import time
+import json
+from collections import OrderedDict
+
+import logging
+log = logging.getLogger("ExportLogger")
+
+# Measures a stage: with stats.timer("DecomposeMesh"): ...
+class StageTimer:
+    __slots__ = ('stats', 'stage', 'startTime')
+
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+        self.startTime = None
+
+    def __enter__(self):
+        self.startTime = time.time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stats.add(self.stage, time.time() - self.startTime)
+        return False
+
+# Stats of an exported object
+class ObjectStats:
+    def __init__(self, name):
+        # Name of the exported object (TData.objectName)
+        self.name = name
+        # Seconds spent in each stage: stage name -> seconds
+        self.times = OrderedDict()
+        # Calls of each stage: stage name -> count
+        self.calls = OrderedDict()
+        # Counters: counter name -> value
+        self.counters = OrderedDict()
+
+    # Returns a timer to measure a stage in a 'with' statement
+    def timer(self, stage):
+        return StageTimer(self, stage)
+
+    # Runs a generator of steps as a stage: it yields the values of the steps and returns
+    # the value of the generator. Only the time spent in the steps is measured, not the
+    # time the caller waits between them (the modal export returns to the UI).
+    # Use: result = yield from stats.timeSteps("DecomposeActions", DecomposeActions(...))
+    def timeSteps(self, stage, steps):
+        seconds = 0.0
+        try:
+            while True:
+                startTime = time.time()
+                try:
+                    value = next(steps)
+                finally:
+                    seconds += time.time() - startTime
+                yield value
+        except StopIteration as e:
+            return e.value
+        finally:
+            # Close the steps if we are closed before their end
+            steps.close()
+            self.add(stage, seconds)
+
+    # Adds a call of a stage
+    def add(self, stage, seconds):
+        self.times[stage] = self.times.get(stage, 0.0) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    # Adds a value to a counter
+    def count(self, name, value = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    # Total time of the stages
+    def totalTime(self):
+        return sum(self.times.values())
+
+    # Returns the stage with the most time or None
+    def slowestStage(self):
+        if not self.times:
+            return None
+        return max(self.times, key = self.times.get)
+
+    # Ratios of the counters:
+    # indicesPerVertex: triangle corners per decomposed vertex, how many times each
+    #                   vertex is shared (the deduplication of equal vertices)
+    # bufferVerticesPerVertex: vertices in the Urho buffers per decomposed vertex, above
+    #                   1.0 when LODs or bones splits duplicate the vertices
+    def ratios(self):
+        ratios = OrderedDict()
+        vertices = self.counters.get("vertices")
+        if vertices:
+            ratios["indicesPerVertex"] = 3.0 * self.counters.get("triangles", 0) / vertices
+            if "bufferVertices" in self.counters:
+                ratios["bufferVerticesPerVertex"] = self.counters["bufferVertices"] / vertices
+        return ratios
+
+    def report(self):
+        return OrderedDict([
+            ("name", self.name),
+            ("time", self.totalTime()),
+            ("stages", OrderedDict((stage, {"time": self.times[stage], "calls": self.calls[stage]})
+                                   for stage in self.times)),
+            ("counters", self.counters),
+            ("ratios", self.ratios()) ])
+
+# Stats of an export
+class ExportStats:
+    def __init__(self):
+        # Time when the export started
+        self.startTime = time.time()
+        # Wall time of the phases of the export (Scan, ExportModels, WriteMaterials)
+        self.phases = ObjectStats(None)
+        # List of ObjectStats of the exported objects
+        self.objects = []
+        # Total time of the export (set by finish)
+        self.totalTime = None
+
+    # Returns a timer to measure a phase in a 'with' statement
+    def timer(self, phase):
+        return self.phases.timer(phase)
+
+    # Runs a generator of steps as a phase (see ObjectStats.timeSteps)
+    def timeSteps(self, phase, steps):
+        return self.phases.timeSteps(phase, steps)
+
+    # Adds the stats of an exported object
+    def addObject(self, objectStats):
+        if objectStats is not None:
+            self.objects.append(objectStats)
+
+    def finish(self):
+        self.totalTime = time.time() - self.startTime
+
+    # Sum of the stages of all the objects
+    def stages(self):
+        stages = OrderedDict()
+        for objectStats in self.objects:
+            for stage, seconds in objectStats.times.items():
+                values = stages.setdefault(stage, {"time": 0.0, "calls": 0})
+                values["time"] += seconds
+                values["calls"] += objectStats.calls[stage]
+        return stages
+
+    # Sum of the counters of all the objects
+    def counters(self):
+        counters = OrderedDict()
+        for objectStats in self.objects:
+            for name, value in objectStats.counters.items():
+                counters[name] = counters.get(name, 0) + value
+        return counters
+
+    # The objects with the greatest time
+    def slowestObjects(self, count):
+        return sorted(self.objects, key = lambda o: o.totalTime(), reverse = True)[:count]
+
+    def report(self):
+        return OrderedDict([
+            ("date", time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.startTime))),
+            ("time", self.totalTime),
+            ("phases", self.phases.times),
+            ("stages", self.stages()),
+            ("counters", self.counters()),
+            ("objects", [o.report() for o in self.slowestObjects(len(self.objects))]) ])
+
+    # Writes the report in a JSON file
+    def write(self, filename):
+        try:
+            with open(filename, "w") as file:
+                json.dump(self.report(), file, indent = 1)
+        except Exception as e:
+            log.error("Cannot write report {:s} {:s}".format(filename, str(e)))
+            return False
+        return True
@@ -0,0 +1,21 @@
+#
+# This script is licensed as public domain.
+#
+
+# Tests of the parts of the exporter which don't use Blender (core.py, export_urho.py),
+# run them with Python 3 from the main folder:
+#   python3 -m pytest tests
+# Outside Blender the mathutils module is the pure Python stand-in of the benchmark.
+
+import sys
+import os
+import importlib.util
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.join(ROOT_PATH, "benchmark"))
+sys.path.insert(0, os.path.join(ROOT_PATH, "io_mesh_urho"))
+
+if importlib.util.find_spec("mathutils") is None:
+    import mathutils_stub
+    sys.modules["mathutils"] = mathutils_stub
@@ -0,0 +1,213 @@
+#
+# This script is licensed as public domain.
+#
+
+import pytest
+from mathutils import Matrix
+
+from core import (TData, TOptions, MeshDataFromArrays, DecomposeGeometry, DecomposeShape, VertexFaces,
+                  TessfaceNormal, VertexNormal)
+
+# Grid of n x n quads on the XZ plane, normals up
+def GridMesh(n):
+    positions = [(float(column), 0.0, float(row)) for row in range(n + 1) for column in range(n + 1)]
+    faces = []
+    for row in range(n):
+        for column in range(n):
+            a = row * (n + 1) + column
+            faces.append( (a, a + 1, a + n + 2, a + n + 1) )
+    normals = [(0.0, 1.0, 0.0)] * len(positions)
+    return positions, faces, normals
+
+# UV of the face corners mapping the grid to the whole texture
+def GridUv(positions, faces, n):
+    return [(positions[i][0] / n, positions[i][2] / n) for face in faces for i in face]
+
+# Two quads with an edge in common, but with the vertices of the edge duplicated
+TWIN_POSITIONS = [(0, 0, 0), (1, 0, 0), (1, 0, 1), (0, 0, 1),
+                  (1, 0, 0), (2, 0, 0), (2, 0, 1), (1, 0, 1)]
+TWIN_FACES = [(0, 1, 2, 3), (4, 5, 6, 7)]
+TWIN_NORMALS = [(0.0, 1.0, 0.0)] * 8
+
+def Decompose(tMeshData, tOptions = None):
+    tData = TData()
+    faceVertexMap = DecomposeGeometry(tMeshData, tData, tOptions or TOptions(), {}, "test")
+    return tData, faceVertexMap
+
+#--------------------
+# Welding
+#--------------------
+
+def test_weld_grid():
+    positions, faces, normals = GridMesh(2)
+    uvs = GridUv(positions, faces, 2)
+    tData, faceVertexMap = Decompose(MeshDataFromArrays(positions, faces, normals, uvs))
+
+    assert [tuple(v.pos) for v in tData.verticesList] == [
+        (0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (1.0, 0.0, 1.0), (0.0, 0.0, 1.0), (2.0, 0.0, 0.0),
+        (2.0, 0.0, 1.0), (1.0, 0.0, 2.0), (0.0, 0.0, 2.0), (2.0, 0.0, 2.0)]
+    assert [tuple(v.uv) for v in tData.verticesList] == [
+        (0.0, 0.0), (0.5, 0.0), (0.5, 0.5), (0.0, 0.5), (1.0, 0.0),
+        (1.0, 0.5), (0.5, 1.0), (0.0, 1.0), (1.0, 1.0)]
+    lodLevel = tData.geometriesList[0].lodLevels[0]
+    assert list(lodLevel.triangleList) == [
+        (0, 2, 1), (0, 3, 2), (1, 5, 4), (1, 2, 5), (3, 6, 2), (3, 7, 6), (2, 8, 5), (2, 6, 8)]
+    assert lodLevel.indexSet == set(range(9))
+    # The center vertex is shared by the four faces
+    assert [faceVertexMap[(faceIndex, 4)] for faceIndex in range(4)] == [2, 2, 2, 2]
+
+def test_weld_flat_faces():
+    # Coplanar flat faces have the same normal, their vertices are shared
+    positions, faces, normals = GridMesh(2)
+    tData, faceVertexMap = Decompose(MeshDataFromArrays(positions, faces))
+    assert len(tData.verticesList) == 9
+    assert tuple(tData.verticesList[0].normal) == (0.0, -1.0, 0.0)
+
+def test_uv_seams():
+    # Each face has the whole texture, no vertex can be shared
+    positions, faces, normals = GridMesh(2)
+    uvs = [(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)] * len(faces)
+    tData, faceVertexMap = Decompose(MeshDataFromArrays(positions, faces, normals, uvs))
+    assert len(tData.verticesList) == 16
+
+def test_weld_duplicated_vertices():
+    tData, faceVertexMap = Decompose(MeshDataFromArrays(TWIN_POSITIONS, TWIN_FACES, TWIN_NORMALS))
+    assert [v.blenderIndex for v in tData.verticesList] == [0, 1, 2, 3, 5, 6]
+    assert list(tData.geometriesList[0].lodLevels[0].triangleList) == [
+        (0, 2, 1), (0, 3, 2), (1, 5, 4), (1, 2, 5)]
+
+def test_weld_needs_all_elements_equal():
+    weights = [((0, 1.0),)] * 8
+    tData, faceVertexMap = Decompose(MeshDataFromArrays(TWIN_POSITIONS, TWIN_FACES, TWIN_NORMALS,
+                                                        weights = weights))
+    assert len(tData.verticesList) == 6
+
+    weights = [((0, 1.0),)] * 4 + [((1, 1.0),)] * 4
+    tData, faceVertexMap = Decompose(MeshDataFromArrays(TWIN_POSITIONS, TWIN_FACES, TWIN_NORMALS,
+                                                        weights = weights))
+    assert len(tData.verticesList) == 8
+
+    normals = TWIN_NORMALS[:4] + [(0.0, 0.8, 0.6)] * 4
+    tData, faceVertexMap = Decompose(MeshDataFromArrays(TWIN_POSITIONS, TWIN_FACES, normals))
+    assert len(tData.verticesList) == 8
+
+#--------------------
+# Normals
+#--------------------
+
+# Normals of the faces and of the vertices of a grid of 2 x 2 quads with a vertex moved
+# up by 'height'
+def GridNormals(vertexIndex, height):
+    positions, faces, normals = GridMesh(2)
+    # Blender space is Z up
+    coords = [c for x, y, z in positions for c in (x, z, y)]
+    coords[3 * vertexIndex + 2] += height
+    faceNormals = {faceIndex: TessfaceNormal(coords, face) for faceIndex, face in enumerate(faces)}
+    vertexNormals = []
+    for i in range(len(positions)):
+        vertexFaces = [faceIndex for faceIndex, face in enumerate(faces) if i in face]
+        vertexNormals.append(VertexNormal(coords, i, vertexFaces, faces, faceNormals))
+    return faceNormals, vertexNormals
+
+def test_flat_normals():
+    faceNormals, vertexNormals = GridNormals(4, 0.0)
+    assert list(faceNormals.values()) == [(0.0, 0.0, 1.0)] * 4
+    assert vertexNormals == [(0.0, 0.0, 1.0)] * 9
+
+def test_shape_normals():
+    # The center vertex is moved up: the normals of the faces are the cross product of
+    # their diagonals, the vertex normals are the average of the faces normals weighted
+    # by the corner angles, stored as shorts like Blender does
+    faceNormals, vertexNormals = GridNormals(4, 0.5)
+    length = 18 ** 0.5
+    assert faceNormals[0] == pytest.approx((-1 / length, -1 / length, 4 / length))
+    assert faceNormals[3] == pytest.approx((1 / length, 1 / length, 4 / length))
+    corner = 0.235694
+    cornerZ = 0.942808
+    side = 0.242531
+    sideZ = 0.970122
+    expected = [
+        (-corner, -corner, cornerZ), (0.0, -side, sideZ), (corner, -corner, cornerZ),
+        (-side, 0.0, sideZ), (0.0, 0.0, 1.0), (side, 0.0, sideZ),
+        (-corner, corner, cornerZ), (0.0, side, sideZ), (corner, corner, cornerZ)]
+    for normal, expectedNormal in zip(vertexNormals, expected):
+        assert normal == pytest.approx(expectedNormal, abs = 1e-6)
+
+def test_triangle_normal():
+    assert TessfaceNormal([0, 0, 0, 2, 0, 0, 0, 2, 0], (0, 1, 2)) == (0.0, 0.0, 1.0)
+    # Degenerate face
+    assert TessfaceNormal([0, 0, 0, 1, 0, 0, 2, 0, 0], (0, 1, 2)) == (0.0, 0.0, 0.0)
+
+def test_vertex_without_faces():
+    # Like Blender the normal is the direction of the vertex position
+    assert VertexNormal([0.0, 0.0, 2.0], 0, [], [], {}) == (0.0, 0.0, 1.0)
+
+#--------------------
+# Shape keys
+#--------------------
+
+# Decomposes a grid of 2 x 2 quads, then a shape key which moves a vertex up by 
+# 'height'. Returns the morph (None if the shape is empty).
+def DecomposeGridShape(vertexIndex, height, tOptions = None):
+    positions, faces, normals = GridMesh(2)
+    tMeshData = MeshDataFromArrays(positions, faces, normals, GridUv(positions, faces, 2))
+    tData, faceVertexMap = Decompose(tMeshData)
+    # Blender space is Z up
+    baseCoords = [c for x, y, z in positions for c in (x, z, y)]
+    coords = list(baseCoords)
+    coords[3 * vertexIndex + 2] += height
+    identity = Matrix.Identity(4)
+    DecomposeShape(tMeshData, tData, tOptions or TOptions(), faceVertexMap, 
+                   VertexFaces(tMeshData, len(positions)), baseCoords, coords, identity, identity, "Shape")
+    return tData.morphsList[0] if tData.morphsList else None
+
+def test_shape_normals():
+    # The center vertex is moved up: the normals of the faces are the cross product of
+    # their diagonals, the vertex normals are the average of the faces normals weighted
+    # by the corner angles, stored as shorts like Blender does
+    tMorph = DecomposeGridShape(4, 0.5)
+    vertices = [(v.blenderIndex, tuple(v.pos), tuple(v.normal)) for k, v in sorted(tMorph.vertexMap.items())]
+    corner = 0.235694
+    cornerY = 0.942808
+    side = 0.242531
+    sideY = 0.970122
+    expected = [
+        (0, (0.0, 0.0, 0.0), (-corner, cornerY, -corner)),
+        (1, (1.0, 0.0, 0.0), (0.0, sideY, -side)),
+        (4, (1.0, 0.5, 1.0), (0.0, 1.0, 0.0)),
+        (3, (0.0, 0.0, 1.0), (-side, sideY, 0.0)),
+        (2, (2.0, 0.0, 0.0), (corner, cornerY, -corner)),
+        (5, (2.0, 0.0, 1.0), (side, sideY, 0.0)),
+        (7, (1.0, 0.0, 2.0), (0.0, sideY, side)),
+        (6, (0.0, 0.0, 2.0), (-corner, cornerY, corner)),
+        (8, (2.0, 0.0, 2.0), (corner, cornerY, corner))]
+    assert len(vertices) == len(expected)
+    for (index, position, normal), (expectedIndex, expectedPosition, expectedNormal) in zip(vertices, expected):
+        assert index == expectedIndex
+        assert position == pytest.approx(expectedPosition, abs = 1e-6)
+        assert normal == pytest.approx(expectedNormal, abs = 1e-6)
+    assert list(tMorph.triangleList) == [
+        (0, 2, 1), (0, 3, 2), (1, 5, 4), (1, 2, 5), (3, 6, 2), (3, 7, 6), (2, 8, 5), (2, 6, 8)]
+
+def test_shape_only_changed_faces():
+    # A corner moved: without normals only the vertices of its face are morphed
+    tOptions = TOptions()
+    tOptions.doMorphNor = False
+    tMorph = DecomposeGridShape(0, 0.5, tOptions)
+    assert sorted(v.blenderIndex for v in tMorph.vertexMap.values()) == [0, 1, 3, 4]
+    assert all(v.normal is None for v in tMorph.vertexMap.values())
+    assert list(tMorph.triangleList) == [(0, 2, 1), (0, 3, 2)]
+
+    # With normals the faces of the vertices with a new normal are morphed too, the 
+    # vertices far from the corner keep their normal
+    tMorph = DecomposeGridShape(0, 0.5)
+    normals = {v.blenderIndex: tuple(v.normal) for v in tMorph.vertexMap.values()}
+    assert sorted(normals) == list(range(9))
+    assert normals[0] == pytest.approx((0.235694, 0.942808, 0.235694), abs = 1e-6)
+    assert normals[1] == pytest.approx((0.119572, 0.985595, 0.119572), abs = 1e-6)
+    assert normals[4] == pytest.approx((0.059542, 0.996429, 0.059542), abs = 1e-6)
+    for vertexIndex in (2, 5, 6, 7, 8):
+        assert normals[vertexIndex] == (0.0, 1.0, 0.0)
+
+def test_empty_shape():
+    assert DecomposeGridShape(0, 0.0) is None
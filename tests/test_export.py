@@ -0,0 +1,144 @@
+#
+# This script is licensed as public domain.
+#
+
+import logging
+import struct
+from types import SimpleNamespace
+
+from core import TData, TOptions, AddBones, MeshDataFromArrays, DecomposeGeometry
+from export_urho import (UrhoExport, UrhoExportData, UrhoExportOptions, PartitionBones,
+                         RecordPacker, GetRecordPacker, PACK_BATCH_SIZE, VERTEX_ELEMENTS,
+                         MORPH_VERTEX_ELEMENTS, KEYFRAME_ELEMENTS, ELEMENT_POSITION, ELEMENT_NORMAL,
+                         ELEMENT_COLOR, ELEMENT_UV1, ELEMENT_UV2, ELEMENT_TANGENT, ELEMENT_BLEND,
+                         MORPH_ELEMENTS, TRACK_POSITION, TRACK_ROTATION, TRACK_SCALE)
+
+# Collects the bytes written, as BinaryFileWriter.writeBytes
+class BytesWriter:
+    def __init__(self):
+        self.data = bytearray()
+
+    def writeBytes(self, data):
+        self.data += data
+
+def Vertex(i):
+    return SimpleNamespace(index = i, pos = (i, 1.0, 2.0), normal = (0.0, 1.0, 0.0),
+                           color = (1, 2, 3, i % 256), uv = (0.5, i), uv2 = (i, 0.25),
+                           tangent = (1.0, 0.0, 0.0, -1.0), weights = [(i % 64, 0.5), (1, 0.25), (2, 0.25), (0, 0.0)])
+
+def Keyframe(i):
+    return SimpleNamespace(time = i / 25.0, position = (0.0, i, 0.0), rotation = (1.0, 0.0, 0.0, 0.0),
+                           scale = (1.0, 1.0, i))
+
+def Pack(packer, items):
+    fw = BytesWriter()
+    packer.write(fw, items)
+    return bytes(fw.data)
+
+def test_sizes():
+    allElements = (ELEMENT_POSITION | ELEMENT_NORMAL | ELEMENT_COLOR | ELEMENT_UV1 | ELEMENT_UV2 |
+                   ELEMENT_TANGENT | ELEMENT_BLEND)
+    assert RecordPacker(VERTEX_ELEMENTS, allElements).size == 80
+    assert RecordPacker(VERTEX_ELEMENTS, ELEMENT_POSITION).size == 12
+    assert RecordPacker(VERTEX_ELEMENTS, ELEMENT_POSITION | ELEMENT_NORMAL | ELEMENT_UV1).size == 32
+    assert RecordPacker(MORPH_VERTEX_ELEMENTS, MORPH_ELEMENTS).size == 40
+    assert RecordPacker(MORPH_VERTEX_ELEMENTS, ELEMENT_POSITION).size == 16
+    assert RecordPacker(KEYFRAME_ELEMENTS, TRACK_POSITION | TRACK_ROTATION | TRACK_SCALE).size == 44
+    assert RecordPacker(KEYFRAME_ELEMENTS, TRACK_ROTATION).size == 20
+
+def test_vertex_records():
+    mask = ELEMENT_POSITION | ELEMENT_NORMAL | ELEMENT_COLOR | ELEMENT_UV1 | ELEMENT_TANGENT | ELEMENT_BLEND
+    vertices = [Vertex(i) for i in range(3)]
+    expected = b"".join(struct.pack("<3f3f4B2f4f4f4B", *(v.pos + v.normal + v.color + v.uv + v.tangent +
+                                                        tuple(w[1] for w in v.weights) +
+                                                        tuple(w[0] for w in v.weights)))
+                        for v in vertices)
+    assert Pack(RecordPacker(VERTEX_ELEMENTS, mask), vertices) == expected
+
+def test_morph_records():
+    vertices = [Vertex(i) for i in range(3)]
+    expected = b"".join(struct.pack("<I3f3f", v.index, *(v.pos + v.tangent[:3])) for v in vertices)
+    assert Pack(RecordPacker(MORPH_VERTEX_ELEMENTS, ELEMENT_POSITION | ELEMENT_TANGENT), vertices) == expected
+
+def test_keyframe_records_batches():
+    # More records than a batch, the last batch is partial
+    keyframes = [Keyframe(i) for i in range(PACK_BATCH_SIZE + 3)]
+    expected = b"".join(struct.pack("<f3f4f", k.time, *(k.position + k.rotation)) for k in keyframes)
+    data = Pack(RecordPacker(KEYFRAME_ELEMENTS, TRACK_POSITION | TRACK_ROTATION), keyframes)
+    assert len(data) == 32 * len(keyframes)
+    assert data == expected
+
+def test_no_records():
+    assert Pack(RecordPacker(KEYFRAME_ELEMENTS, TRACK_POSITION), []) == b""
+
+def test_packers_cache():
+    packer = GetRecordPacker(KEYFRAME_ELEMENTS, TRACK_SCALE)
+    assert GetRecordPacker(KEYFRAME_ELEMENTS, TRACK_SCALE) is packer
+    assert GetRecordPacker(KEYFRAME_ELEMENTS, TRACK_POSITION) is not packer
+
+#--------------------
+# Bones partition
+#--------------------
+
+# Vertices of 10 triangles, each vertex has 4 bones so each triangle has 12 bones. Five 
+# triangles fill a part (60 bones), the sixth needs a new part.
+TRIANGLES_COUNT = 10
+BONES_COUNT = 12 * TRIANGLES_COUNT
+
+def PartitionVertex(bones):
+    return SimpleNamespace(weights = [(b, 0.25) for b in bones])
+
+def PartitionLod(distance, triangles):
+    triangleList = [tuple(triangle) for triangle in triangles]
+    return SimpleNamespace(distance = distance, triangleList = triangleList,
+                           indexSet = set(i for triangle in triangleList for i in triangle))
+
+def test_partition_later_lods():
+    verticesList = [PartitionVertex(range(4 * i, 4 * i + 4)) for i in range(3 * TRIANGLES_COUNT)]
+    # LOD1 vertices: one with a bone of the second part, one with new bones
+    verticesList.append(PartitionVertex([61, 62]))
+    verticesList += [PartitionVertex(range(BONES_COUNT + 4 * i, BONES_COUNT + 4 * i + 4)) for i in range(3)]
+    first = len(verticesList) - 4
+    lodLevels = [PartitionLod(0.0, [range(3 * t, 3 * t + 3) for t in range(TRIANGLES_COUNT)]),
+                 PartitionLod(10.0, [(first, first, first), (first + 1, first + 2, first + 3)])]
+    parts = PartitionBones(lodLevels, verticesList)
+    assert [[len(l.triangleList) for l in part] for part in parts] == [[5, 0], [5, 1], [0, 1]]
+    # The first part has room for the bones of the LOD1 triangle, but the second part 
+    # already has them
+    assert parts[1][1].triangleList == [(first, first, first)]
+    assert [l.distance for l in parts[2]] == [0.0, 10.0]
+
+def test_part_center_from_first_lod(caplog):
+    # Two LODs of the same triangles, the LOD1 has a triangle far away with new bones
+    # which needs a new part without triangles in LOD0
+    positions = [(float(t), float(c), 0.0) for t in range(TRIANGLES_COUNT) for c in range(3)]
+    faces = [(3 * t, 3 * t + 1, 3 * t + 2) for t in range(TRIANGLES_COUNT)]
+    weights = [[(b, 0.25) for b in range(4 * i, 4 * i + 4)] for i in range(len(positions))]
+    far = [(100.0, 0.0, 0.0), (103.0, 0.0, 0.0), (100.0, 3.0, 0.0)]
+    farWeights = [[(b, 0.25) for b in range(BONES_COUNT + 4 * i, BONES_COUNT + 4 * i + 4)] for i in range(3)]
+
+    tData = TData()
+    tData.objectName = "test"
+    bonesCount = BONES_COUNT + 12
+    identity = ((1, 0, 0, 0), (0, 1, 0, 0), (0, 0, 1, 0), (0, 0, 0, 1))
+    AddBones(tData, ["bone{}".format(b) for b in range(bonesCount)], [-1] * bonesCount, 
+             [identity] * bonesCount)
+    tOptions = TOptions()
+    for distance, tMeshData in ((0.0, MeshDataFromArrays(positions, faces, weights = weights)), 
+                                (10.0, MeshDataFromArrays(positions + far, faces + [(30, 31, 32)],
+                                                          weights = weights + farWeights))):
+        tOptions.lodUpdatedGeometryIndices.clear()
+        tOptions.lodDistance = distance
+        DecomposeGeometry(tMeshData, tData, tOptions, tData.errorsDict, "test")
+
+    uExportData = UrhoExportData()
+    with caplog.at_level(logging.WARNING):
+        UrhoExport(tData, UrhoExportOptions(), uExportData, tData.errorsDict)
+    # The first geometry split in 3 parts
+    uGeometries = uExportData.models[0].geometries[:3]
+    assert [[l.countIndex for l in g.lodLevels] for g in uGeometries] == [[15, 15], [15, 15], [0, 3]]
+    # Center of the far triangle
+    assert tuple(uGeometries[2].center) == (101.0, 1.0, 0.0)
+    # The vertices of the LOD1 triangles are in the LOD0 of their part or in the first
+    # LOD of a new part
+    assert "new vertices" not in caplog.text
@@ -0,0 +1,64 @@
+#
+# This script is licensed as public domain.
+#
+
+import random
+
+from core import TLodLevel, TTriangleList, OptimizeIndices, VERTEX_CACHE_SIZE
+
+# Triangles of a grid of n x n quads, row by row
+def GridTriangles(n, first = 0):
+    triangles = []
+    for row in range(n):
+        for column in range(n):
+            a = first + row * (n + 1) + column
+            b = a + n + 1
+            triangles.append( (a, b, a + 1) )
+            triangles.append( (a + 1, b, b + 1) )
+    return triangles
+
+def Optimize(triangles):
+    lodLevel = TLodLevel()
+    lodLevel.triangleList = TTriangleList(triangles)
+    OptimizeIndices(lodLevel)
+    return lodLevel.triangleList
+
+# Average cache miss ratio: vertices transformed per triangle with a LRU cache
+def Acmr(triangles, cacheSize = VERTEX_CACHE_SIZE):
+    cache = []
+    misses = 0
+    for triangle in triangles:
+        for vertexIndex in triangle:
+            if vertexIndex in cache:
+                cache.remove(vertexIndex)
+            else:
+                misses += 1
+            cache.insert(0, vertexIndex)
+            del cache[cacheSize:]
+    return misses / len(triangles)
+
+GRID3_OPTIMIZED = [
+    (0, 4, 1), (1, 4, 5), (1, 5, 2), (4, 8, 5), (2, 5, 6), (2, 6, 3),
+    (3, 6, 7), (5, 8, 9), (5, 9, 6), (8, 12, 9), (9, 12, 13), (6, 10, 7),
+    (6, 9, 10), (9, 13, 10), (7, 10, 11), (10, 13, 14), (10, 14, 11), (11, 14, 15)]
+
+def test_golden_order():
+    triangleList = Optimize(GridTriangles(3))
+    assert isinstance(triangleList, TTriangleList)
+    assert list(triangleList) == GRID3_OPTIMIZED
+
+def test_vertex_indices_not_contiguous():
+    # The indices of a LOD are indices in all the TData vertices
+    triangleList = Optimize(GridTriangles(3, first = 1000))
+    assert list(triangleList) == [tuple(i + 1000 for i in t) for t in GRID3_OPTIMIZED]
+
+def test_same_triangles_better_cache():
+    triangles = GridTriangles(24)
+    random.Random(1).shuffle(triangles)
+    triangleList = Optimize(triangles)
+    assert sorted(triangleList) == sorted(triangles)
+    assert Acmr(triangles) > 2.5
+    assert Acmr(triangleList) < 0.7
+
+def test_empty():
+    assert len(Optimize([])) == 0
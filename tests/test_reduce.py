@@ -0,0 +1,126 @@
+#
+# This script is licensed as public domain.
+#
+
+import math
+
+import pytest
+from mathutils import Vector, Quaternion
+
+from core import (TData, TOptions, TFrame, TTrack, TAnimation, AddBones, ReduceKeyframes,
+                  ReduceTrack, ChainTolerances, InterpolationError, REDUCE_SEGMENT_FRAMES)
+
+POS_TOLERANCE = 0.001
+ROT_TOLERANCE = math.radians(0.5)
+SCA_TOLERANCE = 0.001
+
+# Rotation of 'angle' radians around the Y axis
+def RotationY(angle):
+    return Quaternion((math.cos(angle / 2.0), 0.0, math.sin(angle / 2.0), 0.0))
+
+# Track with a keyframe for each frame returned by the function (position, rotation, scale)
+def Track(framesCount, function, name = "bone"):
+    tTrack = TTrack(name)
+    for f in range(framesCount):
+        position, rotation, scale = function(f)
+        tTrack.frames.append(TFrame(f / 25.0, Vector(position), rotation, Vector(scale)))
+    return tTrack
+
+def WaveFrame(f):
+    return (0.0, 0.1 * math.sin(0.05 * f), 0.0), RotationY(0.5 * math.sin(0.1 * f)), (1.0, 1.0, 1.0)
+
+def Reduce(tTrack):
+    frames = list(tTrack.frames)
+    ReduceTrack(tTrack, POS_TOLERANCE, ROT_TOLERANCE, SCA_TOLERANCE)
+    return frames
+
+# Max error relative to the tolerances of the frames interpolated from the kept ones,
+# interpolated as Urho does (lerp and slerp)
+def MaxError(frames, keptFrames):
+    worstError = 0.0
+    k = 0
+    for frame in frames:
+        while k + 2 < len(keptFrames) and keptFrames[k + 1].time <= frame.time:
+            k += 1
+        start, end = keptFrames[k], keptFrames[k + 1]
+        t = (frame.time - start.time) / (end.time - start.time)
+        position = start.position.lerp(end.position, t)
+        dot = abs(start.rotation.slerp(end.rotation, t).dot(frame.rotation))
+        scale = start.scale.lerp(end.scale, t)
+        worstError = max(worstError, (position - frame.position).length / POS_TOLERANCE,
+                         2.0 * math.acos(min(dot, 1.0)) / ROT_TOLERANCE,
+                         (scale - frame.scale).length / SCA_TOLERANCE)
+    return worstError
+
+def test_static_track():
+    # Longer than a segment checked for its worst keyframe
+    tTrack = Track(10 * REDUCE_SEGMENT_FRAMES, lambda f: ((1.0, 2.0, 3.0), RotationY(0.3), (1.0, 1.0, 1.0)))
+    Reduce(tTrack)
+    assert [f.time for f in tTrack.frames] == [0.0, (10 * REDUCE_SEGMENT_FRAMES - 1) / 25.0]
+
+def test_linear_track():
+    # Constant speeds, the rotation of 90 degrees needs a spherical interpolation
+    tTrack = Track(100, lambda f: ((0.01 * f, 0.0, -0.02 * f), RotationY(math.radians(90.0) * f / 99),
+                                   (1.0 + 0.01 * f, 1.0, 1.0)))
+    Reduce(tTrack)
+    assert len(tTrack.frames) == 2
+
+def test_step():
+    tTrack = Track(20, lambda f: ((0.0, 0.0 if f < 10 else 1.0, 0.0), RotationY(0.0), (1.0, 1.0, 1.0)))
+    Reduce(tTrack)
+    assert [round(f.time * 25.0) for f in tTrack.frames] == [0, 9, 10, 19]
+
+def test_wave_track():
+    tTrack = Track(200, WaveFrame)
+    frames = Reduce(tTrack)
+    assert [round(f.time * 25.0) for f in tTrack.frames] == [
+        0, 4, 7, 10, 13, 16, 18, 21, 24, 28, 32, 37, 40, 43, 45, 47, 49, 52, 56, 59, 68, 71, 74, 77,
+        79, 81, 84, 88, 92, 95, 99, 102, 105, 108, 111, 114, 117, 120, 124, 129, 132, 135, 138, 141,
+        143, 146, 149, 153, 157, 161, 165, 168, 170, 172, 174, 177, 181, 185, 194, 197, 199]
+    assert MaxError(frames, tTrack.frames) <= 1.0
+
+def test_missing_channels():
+    tTrack = Track(50, WaveFrame)
+    for frame in tTrack.frames:
+        frame.position = None
+        frame.scale = None
+    frames = Reduce(tTrack)
+    assert 2 < len(tTrack.frames) < len(frames)
+
+def test_short_tracks():
+    for framesCount in (1, 2):
+        tTrack = Track(framesCount, WaveFrame)
+        Reduce(tTrack)
+        assert len(tTrack.frames) == framesCount
+
+def test_chain_tolerances():
+    # Chain of three bones, 1 and 2 units long
+    tData = TData()
+    AddBones(tData, ["root", "middle", "tip"], [-1, 0, 1],
+             [((1, 0, 0, 0), (0, 1, 0, y), (0, 0, 1, 0), (0, 0, 0, 1)) for y in (0.0, 1.0, 3.0)])
+    tOptions = TOptions()
+    tolerances = ChainTolerances(tData.bonesMap, tOptions)
+    # The position tolerance is divided among the bones of the chain, the rotation and
+    # scale tolerances don't move the tip more than that
+    position = tOptions.reducePosTolerance / 3
+    assert tolerances["root"] == pytest.approx((position, position / 3, position / 3))
+    assert tolerances["middle"] == pytest.approx((position, position / 2, position / 2))
+    assert tolerances["tip"] == pytest.approx((position, tOptions.reduceRotTolerance,
+                                               tOptions.reduceScaTolerance))
+
+def test_reduce_animation():
+    tData = TData()
+    AddBones(tData, ["root"], [-1], [((1, 0, 0, 0), (0, 1, 0, 0), (0, 0, 1, 0), (0, 0, 0, 1))])
+    tAnimation = TAnimation("wave")
+    tAnimation.tracks.append(Track(100, WaveFrame, "root"))
+    # A track of a bone not in the skeleton uses the default tolerances
+    tAnimation.tracks.append(Track(100, WaveFrame, "other"))
+    ReduceKeyframes(tAnimation, tData.bonesMap, TOptions())
+    root, other = tAnimation.tracks
+    assert 2 < len(root.frames) < 100
+    assert [f.time for f in root.frames] == [f.time for f in other.frames]
+
+def test_interpolation_error():
+    assert InterpolationError(0.5, 0.25) == 2.0
+    assert InterpolationError(0.0, 0.0) == 0.0
+    assert InterpolationError(1e-9, 0.0) == float("inf")
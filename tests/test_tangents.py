@@ -0,0 +1,60 @@
+#
+# This script is licensed as public domain.
+#
+
+import math
+
+import pytest
+
+from core import MeshDataFromArrays, GenerateTangents
+from test_decompose import GridMesh, GridUv, Decompose
+
+def DecomposeGrid(positions = None, normals = None, uvs = None):
+    gridPositions, faces, gridNormals = GridMesh(2)
+    positions = positions or gridPositions
+    uvs = uvs or GridUv(gridPositions, faces, 2)
+    tData, faceVertexMap = Decompose(MeshDataFromArrays(positions, faces, normals or gridNormals, uvs))
+    return tData
+
+def Tangents(tData, tVertexList = None):
+    invalidUvIndices = set()
+    GenerateTangents(tData.geometriesList[0].lodLevels, tVertexList or tData.verticesList, invalidUvIndices)
+    return [tuple(v.tangent) for v in tData.verticesList], invalidUvIndices
+
+def test_flat_grid():
+    tangents, invalidUvIndices = Tangents(DecomposeGrid())
+    assert tangents == [(1.0, 0.0, 0.0, -1.0)] * 9
+    assert not invalidUvIndices
+
+def test_rotated_uv():
+    # U along the Z axis, the UV map is mirrored: W changes sign
+    positions, faces, normals = GridMesh(2)
+    uvs = [(positions[i][2] / 2, positions[i][0] / 2) for face in faces for i in face]
+    tangents, invalidUvIndices = Tangents(DecomposeGrid(uvs = uvs))
+    assert tangents == [(0.0, 0.0, 1.0, 1.0)] * 9
+
+def test_curved_grid():
+    # Parabolic cylinder y = x^2/2: the tangent is orthogonal to the normal, along the
+    # curve direction (1, x, 0)
+    positions, faces, normals = GridMesh(2)
+    positions = [(x, 0.5 * x * x, z) for x, y, z in positions]
+    normals = [(-x / math.hypot(x, 1.0), 1.0 / math.hypot(x, 1.0), 0.0) for x, y, z in positions]
+    tData = DecomposeGrid(positions, normals)
+    tangents, invalidUvIndices = Tangents(tData)
+    for vertex, tangent in zip(tData.verticesList, tangents):
+        x = vertex.pos[0]
+        length = math.hypot(x, 1.0)
+        assert tangent == pytest.approx((1.0 / length, x / length, 0.0, -1.0), abs = 1e-6)
+        assert sum(t * n for t, n in zip(tangent, vertex.normal)) == pytest.approx(0.0, abs = 1e-6)
+
+def test_vertices_map():
+    # Morphs pass a map vertex index to TVertex
+    tData = DecomposeGrid()
+    tangents, invalidUvIndices = Tangents(tData, dict(enumerate(tData.verticesList)))
+    assert tangents == [(1.0, 0.0, 0.0, -1.0)] * 9
+
+def test_invalid_uv():
+    tData = DecomposeGrid(uvs = [(0.5, 0.5)] * 16)
+    tangents, invalidUvIndices = Tangents(tData)
+    assert invalidUvIndices == set(range(9))
+    assert tangents == [(0.0, 0.0, 0.0, 1.0)] * 9